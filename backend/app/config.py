@@ -1,9 +1,78 @@
+from typing import Optional
+
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     app_name: str = "Whitelabel API"
     app_description: str = f"End points for frontend solutions to cater the {app_name} needs"
+    # Authenticated principals are reused for this many seconds at most,
+    # never beyond the expiry of the token itself.
+    principal_cache_ttl_seconds: int = 60
+    principal_cache_size: int = 4096
+    # Password hashing runs on its own thread pool, requests beyond
+    # workers + queue are answered with 503 instead of waiting.
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 32
+    # Indexes are applied by the deploy job (python -m app.db.indexes
+    # apply), when set the app also creates the missing ones at startup.
+    apply_indexes_on_startup: bool = False
+    reference_data_ttl_seconds: int = 3600
+    warm_up_reference_data: bool = True
+    facet_cache_ttl_seconds: int = 300
+    # Documents read per round trip, and rows per chunk, of streamed exports.
+    export_batch_size: int = 500
+    # Rows parsed and inserted per insert_many of a bulk import.
+    import_batch_size: int = 500
+    # Uploaded media are stored on their own thread pool, uploads beyond
+    # workers + queue are answered with 503.
+    upload_workers: int = 4
+    upload_max_queue: int = 16
+    upload_max_bytes: int = 10 * 1024 * 1024
+    upload_chunk_size: int = 1024 * 1024
+    # Public base URL of this API.
+    api_url: str = "http://127.0.0.1:8000"
+    # Media storage: "local", "s3" or "azure".
+    storage_backend: str = "local"
+    # Base URL media are served from, defaults to the storage itself.
+    media_public_url: Optional[str] = None
+    local_media_root: str = "static"
+    # Signs the local direct upload URLs, defaults to the JWT secret.
+    media_signing_key: Optional[str] = None
+    s3_bucket: Optional[str] = None
+    s3_region: Optional[str] = None
+    # Set for S3 compatible services such as MinIO.
+    s3_endpoint_url: Optional[str] = None
+    azure_storage_connection_string: Optional[str] = None
+    azure_media_container: str = "media"
+    presigned_upload_ttl_seconds: int = 900
+    # Thumbnails and medium sizes of uploaded images, "webp" or "jpg".
+    derivative_format: str = "webp"
+    derivative_quality: int = 80
+    derivative_workers: int = 2
+    derivative_max_queue: int = 64
+    # The typeahead index is built at startup, or for the first suggestion,
+    # and rebuilt in the background once older than this.
+    suggest_index_on_startup: bool = True
+    suggest_refresh_seconds: int = 600
+    # Responses of the customer routes, cached per instance and, when the
+    # URL is set, in a Redis shared by all instances.
+    response_cache_enabled: bool = True
+    response_cache_size: int = 1024
+    response_cache_ttl_seconds: int = 60
+    response_cache_redis_url: Optional[str] = None
+    # Prometheus metrics at /metrics. On Lambda (or when metrics_emf is set)
+    # they are also written to stdout in the CloudWatch embedded metric
+    # format after every request.
+    metrics_enabled: bool = True
+    metrics_emf: Optional[bool] = None
+    metrics_namespace: str = "WhitelabelAPI"
+    # Bearer token scrapers send to /metrics. Without it, and on Lambda,
+    # /metrics is not served.
+    metrics_token: Optional[str] = None
+    # Connections per Mongo server, the pool saturation metric is relative
+    # to it.
+    mongo_max_pool_size: int = 100
 
 
 settings = Settings()
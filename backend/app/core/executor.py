@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturated(Exception):
+
+    def __init__(self, name: str, depth: int):
+        super().__init__(f"{name} executor saturated ({depth} pending)")
+        self.name = name
+        self.depth = depth
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking work called from async handlers.
+    At most max_workers calls run at once and at most max_queue wait for a
+    worker, anything beyond that is rejected with ExecutorSaturated instead
+    of piling up on the event loop.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=name)
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> int:
+        return min(self.pending, self.max_workers)
+
+    @property
+    def queued(self) -> int:
+        return max(self.pending - self.max_workers, 0)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            logger.warning("%s executor saturated: %s running, %s queued",
+                           self.name, self.running, self.queued)
+            raise ExecutorSaturated(self.name, self.pending)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        self.pending += 1
+        # Counted when the thread is done, not when the caller stops
+        # waiting (e.g. a client disconnecting), the call keeps its worker.
+        future.add_done_callback(self._done)
+        return await asyncio.shield(future)
+
+    def _done(self, future: asyncio.Future):
+        self.pending -= 1
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
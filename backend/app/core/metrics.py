@@ -0,0 +1,335 @@
+"""
+Prometheus metrics of the API: request latency, status and in flight
+requests per route (MetricsMiddleware), Mongo command latency and connection
+pool usage (the pymongo listeners of mongo_listeners()), and the stats()
+of executors, caches, loaders and the like (register_stats()). They are
+served at /metrics to scrapers holding metrics_token, and on Lambda, where
+nothing scrapes the instances, written to stdout after every request as
+CloudWatch embedded metric format (EMF) lines instead.
+
+Metrics are per process, run a single worker per instance or scrape each.
+"""
+import json
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, TextIO, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import CollectorRegistry
+from pymongo import monitoring
+from starlette.routing import BaseRoute, Match
+
+MONGO_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+UNMATCHED_ROUTE = "unmatched"
+
+HTTP_REQUESTS = Counter("http_requests", "Requests answered", ("method", "route", "status"))
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds",
+                                  "Time to the last byte of the response", ("method", "route"))
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being answered", ("method", "route"))
+
+MONGO_COMMAND_DURATION = Histogram("mongo_command_duration_seconds", "Mongo command round trips",
+                                   ("collection", "command"), buckets=MONGO_BUCKETS)
+MONGO_COMMAND_FAILURES = Counter("mongo_command_failures", "Mongo commands failed", ("collection", "command"))
+MONGO_CHECKOUT_WAIT = Histogram("mongo_pool_checkout_wait_seconds", "Wait for a pooled connection",
+                                ("address", ), buckets=MONGO_BUCKETS)
+MONGO_CHECKOUT_FAILURES = Counter("mongo_pool_checkout_failures", "Connection checkouts failed",
+                                  ("address", "reason"))
+MONGO_CONNECTIONS = Gauge("mongo_pool_connections", "Open pooled connections", ("address", ))
+MONGO_CHECKED_OUT = Gauge("mongo_pool_checked_out", "Pooled connections in use", ("address", ))
+MONGO_SATURATION = Gauge("mongo_pool_saturation", "Pooled connections in use / maxPoolSize", ("address", ))
+
+
+def route_path(routes: Iterable[BaseRoute], scope: dict) -> str:
+    """Path template of the route answering a request, so paths with ids
+    do not make a label value each."""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            # e.g. a method the route does not allow
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    Times requests to the last byte sent. A plain ASGI middleware rather
+    than a BaseHTTPMiddleware, which would buffer the streamed exports.
+    """
+
+    def __init__(self, app, routes: List[BaseRoute], emf: Optional["EmfExporter"] = None):
+        self.app = app
+        self.routes = routes
+        self.emf = emf
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = route_path(self.routes, scope)
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        # Answered by ServerErrorMiddleware when the app raises.
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            in_progress.dec()
+            if self.emf is not None:
+                self.emf.flush()
+
+
+def _collection(event: monitoring.CommandStartedEvent) -> str:
+    target = event.command.get(event.command_name)
+    if isinstance(target, str):
+        return target
+    if event.command_name == "getMore":
+        return event.command.get("collection", "")
+    # Database commands, and sensitive ones pymongo redacts.
+    return ""
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Latency and failures per collection and command. Listeners are called
+    on the threads running the commands."""
+
+    def __init__(self):
+        # (connection, request id) -> collection of the running commands,
+        # finished events do not carry the command.
+        self._collections: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        self._collections[(event.connection_id, event.request_id)] = _collection(event)
+
+    def _finished(self, event) -> str:
+        return self._collections.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.labels(self._finished(event), event.command_name).observe(
+            event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._finished(event)
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Checkout waits and connections in use per server. A checkout starts
+    and ends on the thread running the command, the start is kept in a
+    thread local."""
+
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self._checkouts = threading.local()
+        self._lock = threading.Lock()
+        self._checked_out: Dict[str, int] = {}
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _waited(self) -> Optional[float]:
+        started = getattr(self._checkouts, "started", None)
+        self._checkouts.started = None
+        return None if started is None else time.perf_counter() - started
+
+    def _use(self, address: str, change: int):
+        with self._lock:
+            in_use = self._checked_out[address] = max(self._checked_out.get(address, 0) + change, 0)
+        MONGO_CHECKED_OUT.labels(address).set(in_use)
+        MONGO_SATURATION.labels(address).set(in_use / self.max_pool_size if self.max_pool_size else 0)
+
+    def connection_check_out_started(self, event):
+        self._checkouts.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        waited = self._waited()
+        if waited is not None:
+            MONGO_CHECKOUT_WAIT.labels(address).observe(waited)
+        self._use(address, 1)
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        waited = self._waited()
+        if waited is not None:
+            MONGO_CHECKOUT_WAIT.labels(address).observe(waited)
+        MONGO_CHECKOUT_FAILURES.labels(address, str(event.reason)).inc()
+
+    def connection_checked_in(self, event):
+        self._use(self._address(event), -1)
+
+    def connection_created(self, event):
+        MONGO_CONNECTIONS.labels(self._address(event)).inc()
+
+    def connection_closed(self, event):
+        MONGO_CONNECTIONS.labels(self._address(event)).dec()
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        with self._lock:
+            self._checked_out.pop(address, None)
+        MONGO_CHECKED_OUT.labels(address).set(0)
+        MONGO_SATURATION.labels(address).set(0)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+def mongo_listeners(max_pool_size: int) -> list:
+    """Listeners to pass as event_listeners to the Mongo client."""
+    return [MongoCommandMetrics(), MongoPoolMetrics(max_pool_size)]
+
+
+class StatsCollector:
+    """
+    Exports the stats() dicts of the app: numeric fields become metrics
+    named prefix_field, string fields (e.g. an executor name) and the given
+    labels become labels. Fields listed as counters are exported as
+    counters, the others as gauges.
+    """
+
+    def __init__(self):
+        self._sources: List[tuple] = []
+
+    def register(self, prefix: str, stats: Callable[[], dict], counters: Iterable[str] = (),
+                 labels: Optional[Dict[str, str]] = None):
+        self._sources.append((prefix, stats, frozenset(counters), labels or {}))
+
+    def collect(self):
+        families = {}
+        for prefix, stats, counters, labels in self._sources:
+            values = stats()
+            sample_labels = {**labels, **{k: v for k, v in values.items() if isinstance(v, str)}}
+            for field, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{field}"
+                family = families.get(name)
+                if family is None:
+                    kind = CounterMetricFamily if field in counters else GaugeMetricFamily
+                    family = families[name] = kind(name, f"{field} of {prefix} stats()",
+                                                   labels=sorted(sample_labels))
+                family.add_metric([sample_labels[x] for x in sorted(sample_labels)], value)
+        return families.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def register_stats(prefix: str, stats: Callable[[], dict], counters: Iterable[str] = (),
+                   labels: Optional[Dict[str, str]] = None):
+    stats_collector.register(prefix, stats, counters, labels)
+
+
+# Families left out of the EMF lines, CloudWatch has them for Lambda.
+EMF_SKIPPED_PREFIXES = ("process_", "python_")
+_CUMULATIVE = ("counter", "histogram", "summary")
+
+
+def _emf_unit(name: str) -> str:
+    if name.endswith("_seconds") or name.endswith("_seconds_sum"):
+        return "Seconds"
+    if name.endswith("_total") or name.endswith("_count"):
+        return "Count"
+    return "None"
+
+
+class EmfExporter:
+    """
+    Writes the metrics as CloudWatch embedded metric format lines, one per
+    label set: counters and histogram counts and sums as their change since
+    the previous flush, gauges when they changed. Histogram buckets are not
+    written, CloudWatch computes percentiles of its own from the
+    request durations.
+    """
+
+    # Metrics per EMF document at most.
+    MAX_METRICS = 100
+
+    def __init__(self, namespace: str, registry: CollectorRegistry = REGISTRY, stream: TextIO = sys.stdout):
+        self.namespace = namespace
+        self.registry = registry
+        self.stream = stream
+        self._last: Dict[Tuple, float] = {}
+
+    def _changes(self) -> Dict[Tuple, Dict[str, float]]:
+        """Label set -> {metric: value} of what changed."""
+        changes = {}
+        for family in self.registry.collect():
+            if family.name.startswith(EMF_SKIPPED_PREFIXES):
+                continue
+            cumulative = family.type in _CUMULATIVE
+            for sample in family.samples:
+                if sample.name.endswith(("_bucket", "_created")):
+                    continue
+                labels = tuple(sorted(sample.labels.items()))
+                key = (sample.name, labels)
+                last = self._last.get(key)
+                self._last[key] = sample.value
+                if cumulative:
+                    value = sample.value - (last or 0)
+                    if not value:
+                        continue
+                elif sample.value == last:
+                    continue
+                else:
+                    value = sample.value
+                changes.setdefault(labels, {})[sample.name] = value
+        return changes
+
+    def lines(self) -> List[str]:
+        timestamp = int(time.time() * 1000)
+        lines = []
+        for labels, values in self._changes().items():
+            names = list(values)
+            for i in range(0, len(names), self.MAX_METRICS):
+                chunk = names[i:i + self.MAX_METRICS]
+                document = {
+                    "_aws": {
+                        "Timestamp": timestamp,
+                        "CloudWatchMetrics": [{
+                            "Namespace": self.namespace,
+                            "Dimensions": [[k for k, _ in labels]],
+                            "Metrics": [{"Name": x, "Unit": _emf_unit(x)} for x in chunk],
+                        }],
+                    },
+                    **dict(labels),
+                    **{x: values[x] for x in chunk},
+                }
+                lines.append(json.dumps(document, separators=(",", ":")))
+        return lines
+
+    def flush(self):
+        lines = self.lines()
+        if lines:
+            # Not through logging, CloudWatch needs the bare JSON lines.
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
@@ -0,0 +1,55 @@
+"""
+Single-flight execution of identical concurrent reads: while a call for a
+key is running, callers asking for the same key wait for its result instead
+of starting their own. The result is shared, callers must not modify it.
+"""
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+def flight_key(*parts) -> str:
+    """Key of a read from the parts of its normalized query."""
+    return json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class SingleFlight:
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            # A task, so callers giving up (e.g. a client disconnecting)
+            # do not cancel the call the others wait for.
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved, so failures nobody waited for are not logged as
+            # never retrieved.
+            task.exception()
+
+    def stats(self) -> dict:
+        requests = self.calls + self.coalesced
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+            "coalescing_ratio": self.coalesced / requests if requests else 0.0,
+        }
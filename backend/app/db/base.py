@@ -1,9 +1,14 @@
 import os
 
 import motor.motor_asyncio
-import pymongo
 
-client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGODB_URL"])
+from app.config import settings
+from app.core.metrics import mongo_listeners
+
+client = motor.motor_asyncio.AsyncIOMotorClient(
+    os.environ["MONGODB_URL"],
+    maxPoolSize=settings.mongo_max_pool_size,
+    event_listeners=mongo_listeners(settings.mongo_max_pool_size) if settings.metrics_enabled else [])
 db = client.foodsafety
 
 users_collection = db["users"]
@@ -12,10 +17,5 @@ circles_collection = db["circles"]
 districts_collection = db['districts']
 restaurants_type_collection = db['restaurants_type']
 roles_collection = db["roles"]
-
-# For non-async database connections only
-pymongo_client = pymongo.MongoClient(os.environ["MONGODB_URL"],
-                                     serverSelectionTimeoutMS=5000)
-pymongo_db = pymongo_client['foodsafety']
-users_collection_pymongo = pymongo_db["users"]
-districts_collection_pymongo = pymongo_db['districts']
+media_collection = db["media"]
+migrations_collection = db["migrations"]
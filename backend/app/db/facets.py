@@ -0,0 +1,76 @@
+"""
+Faceted restaurant listing: one page of results, the total and per-facet
+counts from a single $facet aggregation over the listing query.
+"""
+from typing import List, Tuple
+
+from app.config import settings
+from app.db.base import restaurants_collection
+from app.utils.cache import TTLCache
+
+FACET_FIELDS = ("type", "district", "circle", "rating")
+
+# Totals and counts of the unfiltered listing, the most requested one.
+facet_cache = TTLCache(maxsize=1, ttl=settings.facet_cache_ttl_seconds)
+
+UNFILTERED_QUERY = {"is_deleted": False}
+
+
+def invalidate_facets():
+    facet_cache.clear()
+
+
+def _without_text(query: dict) -> dict:
+    """query minus its $text clause, which is only allowed in the first
+    stage of a pipeline."""
+    query = {k: v for k, v in query.items() if k != "$text"}
+    if "$and" in query:
+        query["$and"] = [_without_text(x) for x in query["$and"]]
+    return query
+
+
+async def restaurant_facets(find_query: dict, page_query: dict,
+                            sort: List[Tuple[str, int]], skip: int,
+                            limit: int, projection: dict):
+    """
+    find_query selects the restaurants that are counted, page_query (the
+    same query, possibly narrowed by a cursor) selects the page. Returns
+    (page, total, facets) where facets maps each facet field to
+    [{"value": ..., "count": ...}] sorted by count.
+    """
+    results = []
+    if page_query is not find_query:
+        # The text search already ran in the first stage.
+        results.append({"$match": _without_text(page_query)})
+    results.extend([{"$sort": dict(sort)}, {"$skip": skip},
+                    {"$limit": limit}, {"$project": projection}])
+    facet = {"results": results}
+
+    cached = facet_cache.get("unfiltered") if find_query == UNFILTERED_QUERY else None
+    if cached is None:
+        facet["total"] = [{"$count": "count"}]
+        for field in FACET_FIELDS:
+            # Ties are ordered on the value so the counts, and the ETag
+            # computed from them, are stable.
+            facet[field] = [
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+            ]
+
+    result = await restaurants_collection.aggregate([
+        {"$match": find_query},
+        {"$facet": facet},
+    ]).to_list(1)
+    result = result[0]
+
+    if cached is None:
+        total = result["total"][0]["count"] if result["total"] else 0
+        facets = {
+            field: [{"value": x["_id"], "count": x["count"]} for x in result[field]]
+            for field in FACET_FIELDS
+        }
+        if find_query == UNFILTERED_QUERY:
+            facet_cache.set("unfiltered", (total, facets))
+    else:
+        total, facets = cached
+    return result["results"], total, facets
@@ -0,0 +1,123 @@
+"""
+Bulk restaurant import from CSV or XLSX sheets. Rows are parsed off the
+event loop a batch at a time, validated against AddRestaurants and written
+with unordered insert_many, so one bad row never stops the others.
+"""
+from typing import BinaryIO, Dict, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.db.base import restaurants_collection
+from app.db.suggest import index_restaurant
+from app.db.facets import invalidate_facets
+from app.db.reference_data import get_district, get_districts
+from app.models.restaurants import AddRestaurants, RestaurantsModel, point
+from app.utils.tabular import next_rows, read_sheet
+from app.utils.utils import get_timestamp
+
+
+def _validation_errors(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(x) for x in e['loc'])}: {e['msg']}" for e in error.errors()]
+
+
+async def _resolve_district(value, districts_by_name: Dict[str, dict]) -> Optional[dict]:
+    """District by id, or by case insensitive name."""
+    district = await get_district(value)
+    if district is None:
+        district = districts_by_name.get(str(value).strip().lower())
+    return district
+
+
+async def _restaurant(row: dict, user: dict, timestamp: int,
+                      districts_by_name: Dict[str, dict]) -> RestaurantsModel:
+    row.setdefault("is_new_logo", False)
+    request = AddRestaurants(**row)
+    if request.is_new_logo:
+        raise ValueError("logo: new logos cannot be imported, give the logo url")
+    district = await _resolve_district(request.district, districts_by_name)
+    if district is None:
+        raise ValueError(f"district: unknown district {request.district}")
+    return RestaurantsModel(
+        name=request.name,
+        district_id=str(district.get("_id")),
+        district=district.get("name"),
+        description=request.description or "",
+        circle=request.circle,
+        location=point(request.latitude, request.longitude),
+        type=request.type,
+        logo=request.logo,
+        rating=request.rating,
+        status="open",
+        created_by=user.get("_id"),
+        created_by_name=user.get("name"),
+        created_ts=timestamp
+    )
+
+
+async def _insert(documents: List[dict], lines: List[int], errors: List[dict]) -> int:
+    if not documents:
+        return 0
+    failed = set()
+    try:
+        result = await restaurants_collection.insert_many(documents, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed.add(error["index"])
+            errors.append({"row": lines[error["index"]], "errors": [error.get("errmsg")]})
+        inserted = e.details.get("nInserted", 0)
+    for i, document in enumerate(documents):
+        if i not in failed:
+            index_restaurant(document["_id"], document)
+    return inserted
+
+
+async def import_restaurants(file: BinaryIO, filename: str, user: dict,
+                             batch_size: Optional[int] = None) -> dict:
+    """
+    Insert the restaurants of a sheet with one row per restaurant and the
+    AddRestaurants fields as columns, the district is given by id or name.
+    Returns the number of inserted rows and the errors of the others, by
+    line number. A sheet breaking halfway is reported as an error of the
+    line it broke at, the rows before are imported. Raises UnsupportedSheet
+    for other file types and files that cannot be read at all.
+    """
+    batch_size = batch_size or settings.import_batch_size
+    rows = read_sheet(file, filename)
+    districts_by_name = {str(x.get("name", "")).strip().lower(): x for x in await get_districts()}
+    timestamp = get_timestamp()
+    inserted = 0
+    errors = []
+    read_error = None
+    while read_error is None:
+        batch, read_error = await run_in_threadpool(next_rows, rows, batch_size)
+        if read_error is not None:
+            errors.append({"row": read_error.line, "errors": [str(read_error)]})
+        elif not batch:
+            break
+        documents = []
+        lines = []
+        for line, row in batch:
+            try:
+                restaurant = await _restaurant(row, user, timestamp, districts_by_name)
+            except ValidationError as e:
+                errors.append({"row": line, "errors": _validation_errors(e)})
+                continue
+            except ValueError as e:
+                errors.append({"row": line, "errors": [str(e)]})
+                continue
+            documents.append(jsonable_encoder(restaurant))
+            lines.append(line)
+        inserted += await _insert(documents, lines, errors)
+    if inserted:
+        invalidate_facets()
+    errors.sort(key=lambda x: x["row"])
+    return {
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": errors
+    }
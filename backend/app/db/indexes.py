@@ -0,0 +1,227 @@
+"""
+Declarative index registry for every collection in app.db.base.
+
+Indexes are applied by the deploy job from the command line, after the
+pending migrations (app.db.migrations), apply fails when an index could not
+be created:
+
+    python -m app.db.indexes apply [--prune]
+    python -m app.db.indexes drift
+
+With apply_indexes_on_startup the app also creates the missing ones when it
+starts, but never drops any: instances starting together would race on the
+drops, and queries needing a rebuilt index fail until it is created again.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from typing import Dict, List
+
+import pymongo
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from app.db.base import db
+
+logger = logging.getLogger(__name__)
+
+INDEX_NOT_FOUND = 27
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "restaurants": [
+        # The only text index of the collection, weighted so that matches
+        # on the name rank first.
+        IndexModel([("name", pymongo.TEXT),
+                    ("district", pymongo.TEXT),
+                    ("type", pymongo.TEXT),
+                    ("circle", pymongo.TEXT),
+                    ("description", pymongo.TEXT)],
+                   name="restaurants_search",
+                   weights={"name": 10, "district": 5, "type": 3,
+                            "circle": 3, "description": 1},
+                   default_language="english"),
+        IndexModel([("is_deleted", pymongo.ASCENDING),
+                    ("type", pymongo.ASCENDING),
+                    ("district_key", pymongo.ASCENDING),
+                    ("circle", pymongo.ASCENDING),
+                    ("rating", pymongo.ASCENDING)],
+                   name="restaurants_listing"),
+        IndexModel([("is_deleted", pymongo.ASCENDING),
+                    ("name", pymongo.ASCENDING),
+                    ("_id", pymongo.ASCENDING)],
+                   name="restaurants_by_name"),
+        IndexModel([("is_deleted", pymongo.ASCENDING),
+                    ("created_ts", pymongo.ASCENDING),
+                    ("_id", pymongo.ASCENDING)],
+                   name="restaurants_by_created"),
+        IndexModel([("location", pymongo.GEOSPHERE)],
+                   name="restaurants_location"),
+    ],
+    "users": [
+        IndexModel([("is_deleted", pymongo.ASCENDING),
+                    ("_id", pymongo.ASCENDING)],
+                   name="users_listing"),
+        IndexModel([("email", pymongo.ASCENDING),
+                    ("is_deleted", pymongo.ASCENDING)],
+                   name="users_email"),
+        IndexModel([("_id", pymongo.ASCENDING),
+                    ("activation_code", pymongo.ASCENDING)],
+                   name="users_invite"),
+    ],
+    "circles": [
+        IndexModel([("is_deleted", pymongo.ASCENDING)],
+                   name="circles_is_deleted"),
+    ],
+    "districts": [
+        IndexModel([("name", pymongo.ASCENDING)], name="districts_name"),
+    ],
+    "restaurants_type": [
+        IndexModel([("name", pymongo.ASCENDING)],
+                   name="restaurants_type_name"),
+    ],
+    "roles": [
+        IndexModel([("role", pymongo.ASCENDING)], name="roles_role"),
+    ],
+    "media": [
+        IndexModel([("refs", pymongo.ASCENDING),
+                    ("unreferenced_ts", pymongo.ASCENDING)],
+                   name="media_gc"),
+    ],
+}
+
+
+def _key(spec: dict) -> list:
+    key = spec["key"]
+    return list(key.items()) if hasattr(key, "items") else list(key)
+
+
+def _direction(direction):
+    return direction if isinstance(direction, str) else int(direction)
+
+
+def _is_text(spec: dict) -> bool:
+    return any(direction == pymongo.TEXT
+               for _, direction in _key(spec)) or "weights" in spec
+
+
+def _signature(spec: dict):
+    """Comparable form of a declared IndexModel document or of an entry of
+    index_information()."""
+    if _is_text(spec):
+        fields = spec.get("weights") or {
+            field: 1
+            for field, direction in _key(spec) if direction == pymongo.TEXT
+        }
+        return "text", tuple(sorted(fields.items()))
+    return "key", tuple(
+        (field, _direction(direction)) for field, direction in _key(spec))
+
+
+async def collection_drift(name: str, declared: List[IndexModel]) -> dict:
+    actual = await db[name].index_information()
+    actual.pop("_id_", None)
+    drift = {"missing": [], "changed": [], "extra": []}
+    for model in declared:
+        spec = model.document
+        current = actual.pop(spec["name"], None)
+        if current is None:
+            drift["missing"].append(spec["name"])
+        elif _signature(current) != _signature(spec):
+            drift["changed"].append(spec["name"])
+    drift["extra"] = sorted(actual)
+    return drift
+
+
+async def index_drift() -> dict:
+    """Differences between INDEXES and the indexes present in the database,
+    per collection. Collections without drift are left out."""
+    report = {}
+    for name, declared in INDEXES.items():
+        drift = await collection_drift(name, declared)
+        if any(drift.values()):
+            report[name] = drift
+    return report
+
+
+async def _drop_index(collection, index_name: str, drift: dict) -> bool:
+    try:
+        await collection.drop_index(index_name)
+    except OperationFailure as e:
+        if e.code == INDEX_NOT_FOUND:
+            # Dropped by someone else meanwhile.
+            return True
+        drift.setdefault("failed", []).append(index_name)
+        logger.error("could not drop index %s on %s: %s", index_name,
+                     collection.name, e)
+        return False
+    return True
+
+
+async def ensure_indexes(prune: bool = False, drop: bool = True) -> dict:
+    """
+    Create missing indexes and rebuild changed ones. Undeclared indexes are
+    only dropped with prune, except for text indexes since a collection
+    holds at most one. Without drop, only missing indexes are created and
+    changed ones are left as they are. Returns the drift found before
+    applying.
+    """
+    report = {}
+    for name, declared in INDEXES.items():
+        collection = db[name]
+        drift = await collection_drift(name, declared)
+        if not any(drift.values()):
+            continue
+        report[name] = drift
+        actual = await collection.index_information()
+        declares_text = any(_is_text(m.document) for m in declared)
+        rebuilt = []
+        if drop:
+            for index_name in drift["changed"]:
+                if await _drop_index(collection, index_name, drift):
+                    rebuilt.append(index_name)
+            for index_name in drift["extra"]:
+                if prune or (declares_text and _is_text(actual[index_name])):
+                    await _drop_index(collection, index_name, drift)
+        elif drift["changed"] or drift["extra"]:
+            logger.warning("indexes of %s differ from INDEXES, run "
+                           "python -m app.db.indexes apply: %s", name, drift)
+        to_create = [
+            m for m in declared
+            if m.document["name"] in drift["missing"] + rebuilt
+        ]
+        for model in to_create:
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                # e.g. a 2dsphere index over documents that are not valid
+                # GeoJSON yet, see app.db.migrations.
+                drift.setdefault("failed", []).append(model.document["name"])
+                logger.error("could not create index %s on %s: %s",
+                             model.document["name"], name, e)
+        logger.info("indexes applied on %s: %s", name, drift)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    parser.add_argument("command", choices=["apply", "drift"])
+    parser.add_argument("--prune",
+                        action="store_true",
+                        help="drop indexes that are not declared")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    if args.command == "apply":
+        report = loop.run_until_complete(ensure_indexes(prune=args.prune))
+    else:
+        report = loop.run_until_complete(index_drift())
+    print(json.dumps(report, indent=2))
+    failed = {name: x["failed"] for name, x in report.items() if x.get("failed")}
+    if failed:
+        # Fails the deploy, queries needing the indexes would fail after it.
+        sys.exit(f"indexes could not be created: {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+DataLoader style batching of single document lookups. Lookups issued in the
+same event loop tick are merged into one {field: {"$in": [...]}} query, and
+concurrent lookups of the same key share the result. Nothing is cached past
+the batch, a lookup issued after a write always sees it.
+
+    restaurant = await restaurant_loader.load(restaurant_id)
+
+replaces
+
+    restaurant = await restaurants_collection.find_one({
+        "_id": restaurant_id,
+        "is_deleted": False
+    })
+"""
+import asyncio
+import copy
+import json
+from typing import Dict, List, Optional, Set
+
+from app.db.base import restaurants_collection, users_collection
+
+
+class _Batch:
+
+    def __init__(self, projection: Optional[dict]):
+        self.projection = projection
+        self.waiters: Dict[object, List[asyncio.Future]] = {}
+
+
+class DataLoader:
+
+    def __init__(self, collection, query: Optional[dict] = None,
+                 field: str = "_id", max_batch_size: int = 500):
+        """
+        collection: motor collection the documents are read from
+        query: filter every lookup is combined with, e.g. {"is_deleted": False}
+        field: document field the keys are matched against, must be unique
+        """
+        self.collection = collection
+        self.query = query or {}
+        self.field = field
+        self.max_batch_size = max_batch_size
+        # One pending batch per projection, lookups with different
+        # projections are not merged.
+        self._batches: Dict[str, _Batch] = {}
+        # Running fetches, referenced so they are not garbage collected.
+        self._fetches: Set[asyncio.Task] = set()
+        self.loads = 0
+        self.queries = 0
+
+    @staticmethod
+    def _projection_key(projection: Optional[dict]) -> str:
+        return json.dumps(projection, sort_keys=True, default=str)
+
+    async def load(self, key, projection: Optional[dict] = None) -> Optional[dict]:
+        """Document matching key, None when there is none. The document
+        belongs to the caller."""
+        loop = asyncio.get_running_loop()
+        batch_key = self._projection_key(projection)
+        batch = self._batches.get(batch_key)
+        if batch is None:
+            batch = self._batches[batch_key] = _Batch(projection)
+            loop.call_soon(self._dispatch, batch_key, batch)
+        future = loop.create_future()
+        batch.waiters.setdefault(key, []).append(future)
+        self.loads += 1
+        if len(batch.waiters) >= self.max_batch_size:
+            self._dispatch(batch_key, batch)
+        return await future
+
+    async def load_many(self, keys: List, projection: Optional[dict] = None) -> List[Optional[dict]]:
+        return list(await asyncio.gather(*(self.load(x, projection) for x in keys)))
+
+    def _dispatch(self, batch_key: str, batch: _Batch):
+        # The batch may already have been sent once it was full.
+        if self._batches.get(batch_key) is not batch:
+            return
+        del self._batches[batch_key]
+        fetch = asyncio.ensure_future(self._fetch(batch))
+        self._fetches.add(fetch)
+        fetch.add_done_callback(self._fetches.discard)
+
+    async def _fetch(self, batch: _Batch):
+        keys = list(batch.waiters)
+        projection = batch.projection
+        if projection:
+            # The key field is needed to match documents back to keys.
+            if any(v == 0 for k, v in projection.items() if k != "_id"):
+                projection = {k: v for k, v in projection.items() if k != self.field}
+            else:
+                projection = {**projection, self.field: 1}
+        self.queries += 1
+        try:
+            documents = await self.collection.find(
+                {**self.query, self.field: {"$in": keys}},
+                projection).to_list(len(keys))
+        except BaseException as e:
+            # Waiters of a cancelled fetch are cancelled with it, nothing
+            # else would resolve them.
+            for futures in batch.waiters.values():
+                for future in futures:
+                    if future.done():
+                        continue
+                    if isinstance(e, Exception):
+                        future.set_exception(e)
+                    else:
+                        future.cancel()
+            if isinstance(e, Exception):
+                return
+            raise
+        found = {x.get(self.field): x for x in documents}
+        for key, futures in batch.waiters.items():
+            document = found.get(key)
+            for i, future in enumerate(futures):
+                if future.done():
+                    continue
+                # Callers are free to modify what they get back.
+                future.set_result(document if i == 0 or document is None else copy.deepcopy(document))
+
+    def stats(self) -> dict:
+        return {
+            "collection": self.collection.name,
+            "field": self.field,
+            "loads": self.loads,
+            "queries": self.queries,
+            "pending": sum(len(x.waiters) for x in self._batches.values()),
+        }
+
+
+restaurant_loader = DataLoader(restaurants_collection, {"is_deleted": False})
+user_loader = DataLoader(users_collection, {"is_deleted": False})
@@ -0,0 +1,127 @@
+"""
+Reference counts of stored media. Media are stored under the sha256 of
+their content (see app.utils.uploads), so identical uploads share one
+object. Every live image entry holds a reference to its key, objects whose
+count dropped to zero are deleted by the garbage collector after a grace
+period. The collector claims a media document before it deletes the
+objects and removes the document after, a reference cannot be taken in
+between: acquire_media waits for the claim to go, then the caller writes
+the object when it is missing (app.utils.uploads).
+
+    python -m app.db.media gc [--grace-hours 24] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import logging
+from typing import Iterable
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.db.base import media_collection
+from app.storage import get_storage
+from app.utils.derivatives import DERIVATIVES, FORMATS, derivative_key
+from app.utils.utils import get_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+# A claim older than this was left by a collector that stopped.
+CLAIM_TIMEOUT_SECONDS = 60
+CLAIM_POLL_SECONDS = 0.05
+
+
+def _unclaimed(timestamp: int) -> dict:
+    return {"$or": [{"deleting_ts": {"$exists": False}},
+                    {"deleting_ts": {"$lt": timestamp - CLAIM_TIMEOUT_SECONDS * 1000}}]}
+
+
+async def acquire_media(keys: Iterable[str]):
+    for key in keys:
+        while True:
+            timestamp = get_timestamp()
+            try:
+                await media_collection.update_one({"_id": key, **_unclaimed(timestamp)}, {
+                    "$inc": {"refs": 1},
+                    "$set": {"last_referenced_ts": timestamp},
+                    "$unset": {"unreferenced_ts": "", "deleting_ts": ""},
+                    "$setOnInsert": {"created_ts": timestamp},
+                }, upsert=True)
+                break
+            except DuplicateKeyError:
+                # Claimed by the collector, its objects are being deleted.
+                await asyncio.sleep(CLAIM_POLL_SECONDS)
+
+
+async def release_media(keys: Iterable[str]):
+    timestamp = get_timestamp()
+    for key in keys:
+        media = await media_collection.find_one_and_update(
+            {"_id": key}, {"$inc": {"refs": -1}},
+            return_document=ReturnDocument.AFTER)
+        if media is not None and media.get("refs", 0) <= 0:
+            await media_collection.update_one(
+                {"_id": key, "refs": {"$lte": 0}},
+                {"$set": {"unreferenced_ts": timestamp}})
+
+
+def media_keys(images: Iterable[dict]) -> set:
+    """Keys referenced by the live entries of a restaurant image list."""
+    return {x["key"] for x in images or [] if x and x.get("key") and not x.get("is_deleted")}
+
+
+def _delete_objects(key: str):
+    storage = get_storage()
+    for name in DERIVATIVES:
+        for extension in FORMATS:
+            storage.delete(derivative_key(key, name, extension))
+    storage.delete(key)
+
+
+async def collect_garbage(grace_seconds: int = 24 * 3600,
+                          dry_run: bool = False) -> dict:
+    """Delete the objects, and their derivatives, unreferenced for longer
+    than grace_seconds."""
+    before = get_timestamp() - grace_seconds * 1000
+    query = {"refs": {"$lte": 0}, "unreferenced_ts": {"$lt": before}}
+    deleted = []
+    async for media in media_collection.find({**query, **_unclaimed(get_timestamp())}, {"_id": 1}):
+        key = media["_id"]
+        if dry_run:
+            deleted.append(key)
+            continue
+        # Skipped when the object was referenced again meanwhile.
+        timestamp = get_timestamp()
+        claimed = await media_collection.update_one({"_id": key, **query, **_unclaimed(timestamp)},
+                                                    {"$set": {"deleting_ts": timestamp}})
+        if not claimed.modified_count:
+            continue
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _delete_objects, key)
+        except Exception:
+            await media_collection.update_one({"_id": key, "deleting_ts": timestamp},
+                                              {"$unset": {"deleting_ts": ""}})
+            raise
+        await media_collection.delete_one({"_id": key, "deleting_ts": timestamp})
+        deleted.append(key)
+    logger.info("media gc: %s objects deleted", len(deleted))
+    return {"deleted": deleted, "dry_run": dry_run}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage stored media")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--grace-hours", type=float, default=24,
+                        help="keep unreferenced media this long")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="list the media that would be deleted")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(
+        collect_garbage(int(args.grace_hours * 3600), args.dry_run))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+One off data migrations. The deploy job runs the pending ones, those not
+recorded in the migrations collection yet, before the indexes are applied
+and the code that depends on them is deployed:
+
+    python -m app.db.migrations
+    python -m app.db.migrations <name> [<name> ...]
+
+Named migrations run again even when applied, every migration is safe to
+rerun.
+"""
+import argparse
+import asyncio
+import logging
+import re
+from typing import List
+
+from app.db.base import media_collection, migrations_collection, restaurants_collection
+from app.utils.uploads import LOGO_PREFIX
+from app.utils.utils import get_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+async def geojson_locations() -> dict:
+    """
+    Rewrite restaurant locations stored as {"type": "point",
+    "coordinates": [latitude, longitude]} into GeoJSON Points with
+    [longitude, latitude] coordinates, so the 2dsphere index can be built.
+    Locations without usable coordinates are removed.
+    """
+    swapped = await restaurants_collection.update_many(
+        {"location.type": "point"}, [{
+            "$set": {
+                "location": {
+                    "type": "Point",
+                    "coordinates": [
+                        {"$arrayElemAt": ["$location.coordinates", 1]},
+                        {"$arrayElemAt": ["$location.coordinates", 0]},
+                    ]
+                }
+            }
+        }])
+    removed = await restaurants_collection.update_many(
+        {"$or": [
+            {"location.coordinates": None},
+            {"location.coordinates": {"$size": 0}},
+        ]},
+        {"$unset": {"location": ""}})
+    return {
+        "swapped": swapped.modified_count,
+        "removed": removed.modified_count
+    }
+
+
+async def district_keys() -> dict:
+    """
+    Store the normalized district name matched by the district filter (see
+    app.models.restaurants.district_key) on every restaurant.
+    """
+    result = await restaurants_collection.update_many(
+        {"district": {"$type": "string"}}, [{
+            "$set": {
+                "district_key": {"$toLower": {"$trim": {"input": "$district"}}}
+            }
+        }])
+    return {"updated": result.modified_count}
+
+
+async def image_ids() -> dict:
+    """
+    Store the ids of restaurant images as strings, like the _id of the
+    restaurants. Images used to be pushed with ObjectId ids, which the
+    "image.id" filters written with string ids did not match.
+    """
+    result = await restaurants_collection.update_many(
+        {"image.id": {"$type": "objectId"}}, [{
+            "$set": {
+                "image": {
+                    "$map": {
+                        "input": "$image",
+                        "as": "image",
+                        "in": {
+                            "$cond": [
+                                {"$eq": [{"$type": "$$image.id"}, "objectId"]},
+                                {"$mergeObjects": ["$$image", {"id": {"$toString": "$$image.id"}}]},
+                                "$$image"
+                            ]
+                        }
+                    }
+                }
+            }
+        }])
+    return {"updated": result.modified_count}
+
+
+async def logo_keys() -> dict:
+    """
+    Store the media key of logos uploaded through the API as logo_key, so
+    the reference they took is released when the logo is replaced or the
+    restaurant deleted. The key is read from the end of the URL, whatever
+    the storage, and must be a stored media. Logos given as URLs of
+    elsewhere are left without.
+    """
+    pattern = rf"/({re.escape(LOGO_PREFIX)}/[0-9a-f]{{64}}\.[a-z]+)$"
+    updated = 0
+    async for restaurant in restaurants_collection.find(
+            {"logo_key": None, "logo": {"$regex": pattern}}, {"logo": 1}):
+        key = re.search(pattern, restaurant["logo"]).group(1)
+        if await media_collection.count_documents({"_id": key}, limit=1):
+            result = await restaurants_collection.update_one(
+                {"_id": restaurant["_id"], "logo": restaurant["logo"], "logo_key": None},
+                {"$set": {"logo_key": key}})
+            updated += result.modified_count
+    return {"updated": updated}
+
+
+MIGRATIONS = {
+    "geojson_locations": geojson_locations,
+    "district_keys": district_keys,
+    "image_ids": image_ids,
+    "logo_keys": logo_keys,
+}
+
+
+async def pending() -> List[str]:
+    """Names of the migrations not applied yet, in MIGRATIONS order."""
+    applied = {x["_id"] async for x in migrations_collection.find({}, {"_id": 1})}
+    return [x for x in MIGRATIONS if x not in applied]
+
+
+async def run(names) -> dict:
+    results = {}
+    for name in names:
+        results[name] = await MIGRATIONS[name]()
+        await migrations_collection.update_one(
+            {"_id": name}, {"$set": {"applied_ts": get_timestamp(), "result": results[name]}}, upsert=True)
+        logger.info("migration %s: %s", name, results[name])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run data migrations")
+    parser.add_argument("names", nargs="*", choices=sorted(MIGRATIONS),
+                        help="migrations to run, the pending ones when none is given")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    names = args.names or loop.run_until_complete(pending())
+    print(loop.run_until_complete(run(names)))
+
+
+if __name__ == "__main__":
+    main()
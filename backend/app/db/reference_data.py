@@ -0,0 +1,87 @@
+"""
+In-process cache of reference data (districts, circles, restaurant types and
+roles). The data changes a few times a year, so it is read from Mongo at most
+once per reference_data_ttl_seconds and per instance. Call
+invalidate_reference_data() after changing it.
+"""
+import logging
+from typing import List, Optional, Tuple
+
+from app.config import settings
+from app.db.base import circles_collection, districts_collection, restaurants_type_collection, roles_collection
+from app.utils.cache import TTLCache
+from app.utils.conditional import make_etag
+
+logger = logging.getLogger(__name__)
+
+# name -> (collection, filter, maximum number of documents)
+REFERENCE_DATA = {
+    "districts": (districts_collection, {}, 200),
+    "circles": (circles_collection, {"is_deleted": False}, 200),
+    "restaurant_types": (restaurants_type_collection, {}, 100),
+    "roles": (roles_collection, {}, 100),
+}
+
+reference_cache = TTLCache(maxsize=2 * len(REFERENCE_DATA),
+                           ttl=settings.reference_data_ttl_seconds)
+
+
+async def _load(name: str) -> Tuple[List[dict], str]:
+    entry = reference_cache.get(name)
+    if entry is None:
+        collection, query, length = REFERENCE_DATA[name]
+        documents = await collection.find(query).to_list(length)
+        entry = documents, make_etag(name, documents)
+        reference_cache.set(name, entry)
+    return entry
+
+
+async def get_reference_data(name: str) -> List[dict]:
+    """Documents of a reference collection, shared between callers: do not
+    modify them."""
+    documents, _ = await _load(name)
+    return documents
+
+
+async def reference_etag(name: str) -> str:
+    """ETag of the cached reference data, computed once per load."""
+    _, etag = await _load(name)
+    return etag
+
+
+async def get_districts() -> List[dict]:
+    return await get_reference_data("districts")
+
+
+async def get_circles() -> List[dict]:
+    return await get_reference_data("circles")
+
+
+async def get_restaurant_types() -> List[dict]:
+    return await get_reference_data("restaurant_types")
+
+
+async def get_roles() -> List[dict]:
+    return await get_reference_data("roles")
+
+
+async def get_district(district_id: str) -> Optional[dict]:
+    districts = reference_cache.get("districts_by_id")
+    if districts is None:
+        districts = {str(x.get("_id")): x for x in await get_districts()}
+        reference_cache.set("districts_by_id", districts)
+    return districts.get(str(district_id))
+
+
+def invalidate_reference_data(*names: str):
+    """Drop the given reference data, or all of it when no name is given."""
+    for name in names or REFERENCE_DATA:
+        reference_cache.pop(name)
+        if name == "districts":
+            reference_cache.pop("districts_by_id")
+
+
+async def warm_up():
+    for name in REFERENCE_DATA:
+        await get_reference_data(name)
+    logger.info("reference data loaded: %s", ", ".join(REFERENCE_DATA))
@@ -0,0 +1,71 @@
+"""
+Restaurant lookups shared by the business and customer routers.
+"""
+from typing import List, Optional, Tuple
+
+from app.core.singleflight import SingleFlight
+from app.db.base import restaurants_collection
+from app.models.restaurants import RestaurantSort, TEXT_SCORE, district_key, restaurant_projection, \
+    restaurant_response
+from app.utils.pagination import sort_spec
+
+# Identical concurrent customer listings and lookups share one read. The
+# business routes read alone, so editors see their writes.
+restaurant_reads = SingleFlight("restaurant_reads")
+
+
+def restaurant_filter(restaurant_type: Optional[str] = None,
+                      query: Optional[str] = None,
+                      district: Optional[str] = None,
+                      circle: Optional[str] = None,
+                      rating: Optional[int] = None) -> dict:
+    """find() filter of the live restaurants matching the listing parameters.
+    query is a $text search over the fields of the restaurants_search index,
+    the other parameters are exact matches."""
+    find_query = {
+        "is_deleted": False,
+    }
+    if restaurant_type is not None:
+        find_query["type"] = restaurant_type
+    if query is not None:
+        find_query["$text"] = {"$search": query}
+    if district is not None:
+        find_query["district_key"] = district_key(district)
+    if circle is not None:
+        find_query["circle"] = circle
+    if rating is not None:
+        find_query["rating"] = rating
+    return find_query
+
+
+def listing_sort(sort: RestaurantSort, query: Optional[str]) -> RestaurantSort:
+    """
+    Sort order of a listing, text searches are ordered by relevance unless
+    another order is asked for. Raises ValueError for a relevance order
+    without a query.
+    """
+    if query is None:
+        if sort == RestaurantSort.relevance:
+            raise ValueError("The relevance sort needs a query.")
+        return sort
+    return RestaurantSort.relevance if sort == RestaurantSort.default else sort
+
+
+def listing_sort_spec(field: str, direction: int) -> List[Tuple[str, object]]:
+    if field == "score":
+        return [("score", TEXT_SCORE), ("_id", 1)]
+    return sort_spec(field, direction)
+
+
+async def restaurants_by_ids(ids: List[str], fields: tuple) -> List[dict]:
+    """
+    Restaurants with the given ids fetched with a single $in query, in the
+    order of ids. Ids that do not match a live restaurant are answered with
+    {"id": ..., "found": False}.
+    """
+    unique = list(dict.fromkeys(ids))
+    documents = await restaurants_collection.find(
+        {"_id": {"$in": unique}, "is_deleted": False},
+        restaurant_projection(fields)).to_list(len(unique))
+    found = {x["_id"]: restaurant_response(x, fields) for x in documents}
+    return [{**found[x], "found": True} if x in found else {"id": x, "found": False} for x in ids]
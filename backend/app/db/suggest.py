@@ -0,0 +1,95 @@
+"""
+Typeahead index (app.utils.suggest) of the live restaurants. It is built from
+Mongo at startup, or for the first suggestion, kept current by the restaurant
+writes of this instance and rebuilt in the background every
+suggest_refresh_seconds, which picks up the writes of other instances.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, List, Optional
+
+from app.config import settings
+from app.db.base import restaurants_collection
+from app.utils.suggest import SuggestIndex
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_PROJECTION = {"name": 1, "district": 1, "circle": 1}
+
+_index: Optional[SuggestIndex] = None
+_built_at = 0.0
+_build: Optional[asyncio.Task] = None
+# Writes made while a build runs, applied to the new index once it is built.
+_replay: List[Callable[[SuggestIndex], None]] = []
+
+
+async def build_suggest_index() -> SuggestIndex:
+    index = SuggestIndex()
+    cursor = restaurants_collection.find({"is_deleted": False}, SUGGEST_PROJECTION,
+                                         batch_size=settings.export_batch_size)
+    async for restaurant in cursor:
+        index.add(str(restaurant["_id"]), restaurant.get("name"),
+                  restaurant.get("district"), restaurant.get("circle"))
+    return index
+
+
+async def _rebuild():
+    global _index, _built_at
+    started = time.monotonic()
+    try:
+        index = await build_suggest_index()
+    except Exception:
+        logger.exception("suggest index build failed")
+        _replay.clear()
+        raise
+    for change in _replay:
+        change(index)
+    _replay.clear()
+    _index, _built_at = index, time.monotonic()
+    logger.info("suggest index built: %s restaurants in %.2fs", len(index),
+                _built_at - started)
+
+
+def _start_build() -> asyncio.Task:
+    global _build
+    if _build is None or _build.done():
+        _build = asyncio.get_running_loop().create_task(_rebuild())
+    return _build
+
+
+async def get_suggest_index() -> SuggestIndex:
+    """The index, built on first use. Once it is older than
+    suggest_refresh_seconds it is rebuilt in the background while the
+    current one keeps answering."""
+    if _index is None:
+        await asyncio.shield(_start_build())
+    elif time.monotonic() - _built_at > settings.suggest_refresh_seconds:
+        _start_build()
+    return _index
+
+
+def suggest_stats() -> dict:
+    return {
+        "restaurants": len(_index) if _index is not None else 0,
+        "age_seconds": time.monotonic() - _built_at if _index is not None else 0,
+        "building": int(_build is not None and not _build.done()),
+    }
+
+
+def _apply(change: Callable[[SuggestIndex], None]):
+    if _index is not None:
+        change(_index)
+    if _build is not None and not _build.done():
+        _replay.append(change)
+
+
+def index_restaurant(restaurant_id: str, restaurant: dict):
+    """Index, or re-index, a restaurant from a document with its name,
+    district and circle."""
+    name, district, circle = restaurant.get("name"), restaurant.get("district"), restaurant.get("circle")
+    _apply(lambda index: index.add(str(restaurant_id), name, district, circle))
+
+
+def unindex_restaurant(restaurant_id: str):
+    _apply(lambda index: index.remove(str(restaurant_id)))
@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 
 import uvicorn
@@ -8,7 +9,19 @@ from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from fastapi.staticfiles import StaticFiles
 
-from app.router import auth, users, restaurants, restaurants_customer
+from app.config import settings
+from app.core.metrics import EmfExporter, MetricsMiddleware, register_stats
+from app.db import reference_data
+from app.db.facets import facet_cache
+from app.db.indexes import ensure_indexes
+from app.db.loader import restaurant_loader, user_loader
+from app.db.restaurants import restaurant_reads
+from app.db.suggest import get_suggest_index, suggest_stats
+from app.utils.derivatives import derivative_renderer
+from app.utils.pagination import NEXT_CURSOR_HEADER
+from app.utils.response_cache import response_cache
+from app.utils.uploads import upload_writer
+from app.router import auth, users, restaurants, restaurants_customer, media, metrics
 from mangum import Mangum
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -30,12 +43,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Last-Modified", "Content-Disposition"],
 )
 
+on_lambda = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+if settings.metrics_enabled:
+    emf = settings.metrics_emf
+    if emf is None:
+        emf = on_lambda
+    app.add_middleware(MetricsMiddleware, routes=app.routes,
+                       emf=EmfExporter(settings.metrics_namespace) if emf else None)
+    for executor in (auth.password_hasher, upload_writer, derivative_renderer):
+        register_stats("executor", executor.stats, counters=("completed", "failed", "rejected"))
+    for name, cache in (("principal", auth.principal_cache), ("reference", reference_data.reference_cache),
+                        ("facet", facet_cache), ("response", response_cache)):
+        register_stats("cache", cache.stats, counters=("hits", "misses"), labels={"cache": name})
+    for name, loader in (("restaurant", restaurant_loader), ("user", user_loader)):
+        register_stats("loader", loader.stats, counters=("loads", "queries"), labels={"loader": name})
+    register_stats("singleflight", restaurant_reads.stats, counters=("calls", "coalesced"))
+    register_stats("suggest_index", suggest_stats)
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(restaurants.router)
 app.include_router(restaurants_customer.router)
+app.include_router(media.router)
+if settings.metrics_enabled and settings.metrics_token and not on_lambda:
+    # Nothing scrapes Lambda instances, their metrics are the EMF lines.
+    app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+async def apply_indexes():
+    if settings.apply_indexes_on_startup:
+        await ensure_indexes(drop=False)
+
+
+@app.on_event("startup")
+async def load_reference_data():
+    if settings.warm_up_reference_data:
+        await reference_data.warm_up()
+
+
+@app.on_event("startup")
+async def build_suggest_index():
+    if settings.suggest_index_on_startup:
+        await get_suggest_index()
 
 
 # to make it work with Amcd app && uvicorn main:app --reloadazon Lambda, we create a handler object
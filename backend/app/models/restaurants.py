@@ -1,28 +1,37 @@
 from enum import Enum
-from typing import Optional, List
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional, List
 
 from bson import ObjectId
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, validator
 
-from app.db.base import districts_collection_pymongo
 from app.models.base import PyObjectId
 
 
 class RestaurantsModel(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     name: str
-    location: dict
+    location: Optional[dict] = None
     description: str
     type: str
     circle: Optional[str] = None
     district_id: str
     district: str
+    # Normalized district name, matched by the district filter.
+    district_key: Optional[str] = None
     status: str
     logo: str
+    # Key of a logo stored through the API, whose media reference the
+    # restaurant holds. None for logos given as URLs.
+    logo_key: Optional[str] = None
     image: List[Optional[dict]] = []
-    rating: Optional[int] = None
+    rating: Optional[float] = None
     created_ts: int
     last_updated_ts: Optional[int] = None
+    # Incremented by every edit of a user (PUT and PATCH), which must be made
+    # to the version the user read. Media changes and derivatives leave it.
+    # Missing on restaurants never edited since it was added, read as 0.
+    version: int = 0
     created_by: PyObjectId
     created_by_name: str
     updated_by: Optional[PyObjectId] = None
@@ -34,73 +43,150 @@ class RestaurantsModel(BaseModel):
         arbitrary_types_allowed = True
         json_encoders = {ObjectId: str}
 
-    def list_response(self):
-        return {
-            "id":
-            str(self.id),
-            "name":
-            self.name,
-            "type":
-            self.type,
-            "district":
-            self.district,
-            "circle":
-            self.circle,
-            "logo":
-            self.logo,
-            "status":
-            self.status,
-            "rating":
-            self.rating,
-            "images": [{
-                "id": str(x.get("id")),
-                "image": x.get("image")
-            } for x in self.image if x.get("is_deleted") == False],
-            "created_ts":
-            self.created_ts,
-            "created_by":
-            self.created_by_name,
-        }
+    @validator("district_key", always=True)
+    def _district_key(cls, value, values):
+        return district_key(values.get("district")) if values.get("district") else value
+
+    def _document(self) -> dict:
+        return {**self.__dict__, "_id": self.id}
+
+    def list_response(self, distance: float = None):
+        response = restaurant_response(self._document(), LIST_FIELDS)
+        if distance is not None:
+            response["distance"] = round(distance)
+        return response
 
     def detailed_response(self):
-        return {
-            "id":
-            str(self.id),
-            "name":
-            self.name,
-            "latitude":
-            float(self.location["coordinates"][0]),
-            "longitude":
-            float(self.location["coordinates"][1]),
-            "district_id":
-            self.district_id,
-            "logo":
-            self.logo,
-            "district":
-            self.district,
-            "type":
-            self.type,
-            "circle":
-            self.circle,
-            "status":
-            self.status,
-            "images": [{
-                "id": str(x.get("id")),
-                "image": x.get("image")
-            } for x in self.image if x.get("is_deleted") == False],
-            "description":
-            self.description,
-            "rating":
-            self.rating,
-            "created_ts":
-            self.created_ts,
-            "created_by":
-            self.created_by_name,
-            "last_updated_ts":
-            self.last_updated_ts,
-            "updated_by":
-            self.updated_by_name,
+        return restaurant_response(self._document(), DETAIL_FIELDS)
+
+
+def district_key(name: Optional[str]) -> Optional[str]:
+    """Form of a district name the district filter compares, the same as
+    the district_keys migration computes."""
+    return name.strip().lower() if name is not None else None
+
+
+def _images(restaurant: dict) -> list:
+    # Derivatives fall back to the original until they are rendered.
+    return [{
+        "id": str(x.get("id")),
+        "image": x.get("image"),
+        "thumbnail": x.get("thumbnail") or x.get("image"),
+        "medium": x.get("medium") or x.get("image")
+    } for x in restaurant.get("image") or [] if x.get("is_deleted") == False]
+
+
+class ResponseField(NamedTuple):
+    # Document fields the response field is read from.
+    sources: tuple
+    getter: Callable[[dict], object]
+
+
+def _field(name: str) -> ResponseField:
+    return ResponseField((name, ), lambda restaurant: restaurant.get(name))
+
+
+RESTAURANT_RESPONSE_FIELDS = {
+    "id": ResponseField(("_id", ), lambda restaurant: str(restaurant["_id"])),
+    "name": _field("name"),
+    "latitude": ResponseField(
+        ("location", ),
+        lambda restaurant: coordinates_of(restaurant.get("location"))[0]),
+    "longitude": ResponseField(
+        ("location", ),
+        lambda restaurant: coordinates_of(restaurant.get("location"))[1]),
+    "district_id": _field("district_id"),
+    "logo": _field("logo"),
+    "district": _field("district"),
+    "type": _field("type"),
+    "circle": _field("circle"),
+    "status": _field("status"),
+    "images": ResponseField(("image", ), _images),
+    "description": _field("description"),
+    "rating": _field("rating"),
+    "created_ts": _field("created_ts"),
+    "created_by": _field("created_by_name"),
+    "last_updated_ts": _field("last_updated_ts"),
+    "updated_by": _field("updated_by_name"),
+    "version": ResponseField(("version", ), lambda restaurant: restaurant.get("version") or 0),
+}
+
+LIST_FIELDS = ("id", "name", "type", "district", "circle", "logo", "status",
+               "rating", "images", "created_ts", "created_by")
+DETAIL_FIELDS = ("id", "name", "latitude", "longitude", "district_id", "logo",
+                 "district", "type", "circle", "status", "images",
+                 "description", "rating", "created_ts", "created_by",
+                 "last_updated_ts", "updated_by", "version")
+
+# Relevance of the restaurant to the $text search of the query.
+TEXT_SCORE = {"$meta": "textScore"}
+
+# Only the live images are sent back from the database.
+_LIVE_IMAGES = {
+    "$map": {
+        "input": {
+            "$filter": {
+                "input": {"$ifNull": ["$image", []]},
+                "as": "image",
+                "cond": {"$eq": ["$$image.is_deleted", False]}
+            }
+        },
+        "as": "image",
+        "in": {
+            "id": "$$image.id",
+            "image": "$$image.image",
+            "thumbnail": "$$image.thumbnail",
+            "medium": "$$image.medium",
+            "is_deleted": "$$image.is_deleted"
         }
+    }
+}
+
+
+def parse_fields(fields: Optional[str], default: tuple) -> tuple:
+    """
+    Response fields requested with the fields= query parameter, a comma
+    separated list. The id is always returned. Raises ValueError on unknown
+    fields.
+    """
+    if not fields:
+        return default
+    requested = [x.strip() for x in fields.split(",") if x.strip()]
+    unknown = [x for x in requested if x not in RESTAURANT_RESPONSE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(["id"] + requested))
+
+
+def restaurant_projection(fields: tuple, *extra: str) -> dict:
+    """Mongo projection reading only what the response fields need. An extra
+    "score" reads the text search relevance."""
+    projection = {}
+    for field in fields:
+        for source in RESTAURANT_RESPONSE_FIELDS[field].sources:
+            projection[source] = _LIVE_IMAGES if source == "image" else 1
+    for source in extra:
+        projection.setdefault(source, TEXT_SCORE if source == "score" else 1)
+    return projection
+
+
+@lru_cache(maxsize=128)
+def restaurant_converter(fields: tuple) -> Callable[[dict], dict]:
+    """
+    Document to response function for the given fields, built once per
+    field tuple from the getters of the fields. Documents are trusted reads
+    from our own database, nothing is validated.
+    """
+    getters = tuple((name, RESTAURANT_RESPONSE_FIELDS[name].getter) for name in fields)
+
+    def convert(restaurant: dict) -> dict:
+        return {name: getter(restaurant) for name, getter in getters}
+
+    return convert
+
+
+def restaurant_response(restaurant: dict, fields: tuple) -> dict:
+    return restaurant_converter(fields)(restaurant)
 
 
 class AddRestaurants(BaseModel):
@@ -111,7 +197,7 @@ class AddRestaurants(BaseModel):
     circle: Optional[str] = None
     latitude: Optional[float] = 0
     longitude: Optional[float] = 0
-    rating: Optional[int] = 0
+    rating: Optional[float] = 0
     logo: str
     is_new_logo: bool
 
@@ -143,11 +229,14 @@ class UpdateRestaurants(BaseModel):
     circle: Optional[str] = None
     latitude: Optional[float] = None
     longitude: Optional[float] = None
-    rating: Optional[str] = None
+    rating: Optional[float] = None
     restaurant_image: Optional[str] = None
     logo: str
     images: Optional[List] = None
     is_new_logo: bool
+    # Version read with the restaurant, when sent the update is refused if
+    # the restaurant was edited since.
+    version: Optional[int] = None
 
     class Config:
         allow_population_by_field_name = True
@@ -165,17 +254,125 @@ class UpdateRestaurants(BaseModel):
                 "rating": 0,
                 "logo": "str",
                 "is_new_logo": "true",
-                "images": []
+                "images": [],
+                "version": 3
+            }
+        }
+
+
+BATCH_MAX_IDS = 500
+
+
+class RestaurantIds(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=BATCH_MAX_IDS)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "ids": ["62a1f3c2b5e4a8d9c0e1f2a3", "62a1f3c2b5e4a8d9c0e1f2a4"]
             }
         }
 
 
+class PatchRestaurants(BaseModel):
+    """
+    Partial update, only the fields that are sent are changed and null
+    removes an optional field. version is the value read with the
+    restaurant, the update is refused when the restaurant was edited since.
+    The logo is not patched, it is uploaded with the media endpoints.
+    """
+    version: int
+    name: Optional[str] = None
+    district: Optional[str] = None
+    type: Optional[str] = None
+    description: Optional[str] = None
+    circle: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    rating: Optional[float] = None
+    # Refused, logos are uploaded with the media endpoints.
+    logo: Optional[str] = None
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "version": 3,
+                "name": "restaurant_name",
+                "circle": None
+            }
+        }
+
+
+# Fields that cannot be removed with a null.
+PATCH_REQUIRED_FIELDS = ("name", "district", "type", "description")
+
+
+class MediaKind(str, Enum):
+    logo = "logo"
+    image = "image"
+
+
+class MediaUploadRequest(BaseModel):
+    kind: MediaKind
+    content_type: str
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "kind": "image",
+                "content_type": "image/jpeg"
+            }
+        }
+
+
+class MediaConfirmRequest(BaseModel):
+    kind: MediaKind
+    key: str
+
+
 class Location(BaseModel):
-    type: str
+    """GeoJSON Point, coordinates are stored as [longitude, latitude]."""
+    type: str = "Point"
     coordinates: Optional[List[float]]
 
 
+def point(latitude: Optional[float],
+          longitude: Optional[float]) -> Optional[Location]:
+    if latitude is None or longitude is None:
+        return None
+    return Location(type="Point",
+                    coordinates=[float(longitude),
+                                 float(latitude)])
+
+
+def coordinates_of(location: Optional[dict]):
+    """(latitude, longitude) of a stored GeoJSON location."""
+    if not location or not location.get("coordinates"):
+        return None, None
+    longitude, latitude = location["coordinates"]
+    return float(latitude), float(longitude)
+
+
 class RestaurantType(str, Enum):
     bakery = "bakery"
     juicery = "juicery"
     restaurant = "restaurant"
+
+
+class RestaurantSort(str, Enum):
+    default = "default"
+    name = "name"
+    newest = "newest"
+    oldest = "oldest"
+    # Text searches only, their default order.
+    relevance = "relevance"
+
+
+# Sort order -> (field, direction), ties are broken on _id.
+RESTAURANT_SORTS = {
+    RestaurantSort.relevance: ("score", -1),
+    RestaurantSort.default: ("_id", 1),
+    RestaurantSort.name: ("name", 1),
+    RestaurantSort.newest: ("created_ts", -1),
+    RestaurantSort.oldest: ("created_ts", 1),
+}
@@ -1,4 +1,9 @@
+import hashlib
+import itertools
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta, datetime
 from random import randint
 from typing import Optional
@@ -13,11 +18,13 @@ from pydantic import BaseModel
 from starlette import status
 from starlette.responses import JSONResponse
 
-from app.db.base import users_collection_pymongo, users_collection
+from app.core.executor import BoundedExecutor, ExecutorSaturated
+from app.db.base import users_collection
 # from app.managers.email_managers import get_email_template, EmailTemplate
 from app.models.user import ForgotPasswordModel, UserModel, LoginModel, LoginResponseModel, SignupModel, \
     ResetPasswordModel, ChangePasswordModel, SetPasswordLoginModel, UserRole, UserActionMatrix
 # from app.utils.emails import MailRequest, send_email
+from app.utils.cache import TTLCache
 from app.utils.utils import get_error_response, get_timestamp
 
 from app.config import settings
@@ -39,13 +46,51 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 2880
 OTP_EXPIRE_MINUTES = 5
 
+# Fields of the user document kept with a cached principal. Route handlers
+# only rely on these, the password hash is never cached.
+PRINCIPAL_FIELDS = {
+    "_id": 1,
+    "name": 1,
+    "email": 1,
+    "role": 1,
+    "status": 1,
+    "company_id": 1
+}
+
+principal_cache = TTLCache(maxsize=settings.principal_cache_size,
+                           ttl=settings.principal_cache_ttl_seconds)
+# ("id" or "email", value) -> (generation, expiry) of the invalidated users.
+# A generation only has to outlive the principals cached before it, so it is
+# dropped after principal_cache_ttl_seconds. They come from one counter, a
+# user invalidated again later never gets a generation used before.
+_principal_generations: "OrderedDict[tuple, tuple]" = OrderedDict()
+_principal_generations_lock = threading.Lock()
+_principal_generation_counter = itertools.count(1)
+
+
+password_hasher = BoundedExecutor("password-hash",
+                                  max_workers=settings.password_hash_workers,
+                                  max_queue=settings.password_hash_max_queue)
+
+
+async def run_password_hasher(fn, *args):
+    try:
+        return await password_hasher.run(fn, *args)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await run_password_hasher(pwd_context.verify, plain_password,
+                                     hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await run_password_hasher(pwd_context.hash, password)
 
 
 class Token(BaseModel):
@@ -57,24 +102,27 @@ class TokenData(BaseModel):
     email: Optional[str] = None
 
 
-def get_user(email: str) -> object:
-    user = users_collection_pymongo.find_one({
-        "email": email,
-        "is_deleted": False
-    })
+async def get_user(email: str) -> object:
+    user = await users_collection.find_one({"email": email, "is_deleted": False})
+    return user
+
+
+async def get_principal(email: str) -> object:
+    # Not batched with a loader, emails are not unique in users.
+    user = await users_collection.find_one({"email": email, "is_deleted": False}, PRINCIPAL_FIELDS)
     return user
 
 
-def get_user_by_id(user_id: str) -> object:
-    user = users_collection_pymongo.find_one({"_id": user_id})
+async def get_user_by_id(user_id: str) -> object:
+    user = await users_collection.find_one({"_id": user_id})
     return user
 
 
-def authenticate_user(email: str, password: str) -> object:
-    user: object = get_user(email)
+async def authenticate_user(email: str, password: str) -> object:
+    user: object = await get_user(email)
     if not user:
         return None
-    if not verify_password(password, user.get("password")):
+    if not await verify_password(password, user.get("password")):
         return None
     return user
 
@@ -90,12 +138,71 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def _generation_of(key: tuple) -> int:
+    entry = _principal_generations.get(key)
+    if entry is None or entry[1] <= time.monotonic():
+        return 0
+    return entry[0]
+
+
+def _principal_generation(user_id=None, email=None) -> tuple:
+    return _generation_of(("id", str(user_id))), _generation_of(("email", email))
+
+
+def invalidate_principal(user_id=None, email=None):
+    """
+    Drop every cached principal of a user, call it whenever the user
+    document is modified. Either the id or the email is enough.
+    """
+    with _principal_generations_lock:
+        now = time.monotonic()
+        # Entries are kept in expiry order, the ttl is the same for all.
+        while _principal_generations and next(iter(_principal_generations.values()))[1] <= now:
+            _principal_generations.popitem(last=False)
+        for key in (("id", str(user_id)) if user_id is not None else None,
+                    ("email", email) if email is not None else None):
+            if key is not None:
+                _principal_generations.pop(key, None)
+                _principal_generations[key] = (next(_principal_generation_counter),
+                                               now + settings.principal_cache_ttl_seconds)
+
+
+def get_cached_principal(token: str):
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    entry = principal_cache.get(digest)
+    if entry is None:
+        return digest, None
+    payload, user, generation = entry
+    if generation != _principal_generation(user.get("_id"),
+                                           user.get("email")):
+        principal_cache.pop(digest)
+        return digest, None
+    return digest, (payload, user)
+
+
+def cache_principal(digest: str, payload: dict, user: dict, generation: tuple):
+    user_generation = _principal_generation(user.get("_id"), user.get("email"))
+    # Generations are looked up before the database read, a mismatch means
+    # the user was modified meanwhile and the record may already be stale.
+    if generation[1] != user_generation[1]:
+        return
+    ttl = settings.principal_cache_ttl_seconds
+    if payload.get("exp") is not None:
+        ttl = min(ttl, float(payload["exp"]) - time.time())
+    principal_cache.set(digest, (payload, user, user_generation), ttl=ttl)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    digest, principal = get_cached_principal(token)
+    if principal is not None:
+        payload, user = principal
+        if payload.get("exp") is None or payload["exp"] > time.time():
+            return dict(user)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = str(payload.get("sub"))
@@ -104,13 +211,15 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = get_user(str(token_data.email))
+    generation = _principal_generation(email=token_data.email)
+    user = await get_principal(str(token_data.email))
     if user is None:
         raise credentials_exception
-    return user
+    cache_principal(digest, payload, user, generation)
+    return dict(user)
 
 
-def get_current_active_user(
+async def get_current_active_user(
         current_user: UserModel = Depends(get_current_user)):
     return current_user
 
@@ -136,7 +245,7 @@ async def login(request: LoginModel = Body(...)):
         return get_error_response("User not found.", status.HTTP_404_NOT_FOUND)
 
     user = UserModel.parse_obj(user)
-    password_match = verify_password(request.password, user.password)
+    password_match = await verify_password(request.password, user.password)
     if not password_match:
         return get_error_response("Incorrect password",
                                   status.HTTP_404_NOT_FOUND)
@@ -162,7 +271,8 @@ async def login(request: LoginModel = Body(...)):
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends()):
-    user: object = authenticate_user(form_data.username, form_data.password)
+    user: object = await authenticate_user(form_data.username,
+                                           form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -196,7 +306,7 @@ async def signup(request: SignupModel = Body(...)):
         return get_error_response("Email already exists",
                                   status.HTTP_400_BAD_REQUEST)
     timestamp = get_timestamp()
-    hashed_password = get_password_hash(request.password)
+    hashed_password = await get_password_hash(request.password)
     company_id = ObjectId()
     user: UserModel = UserModel(name=request.name,
                                 email=request.email,
@@ -306,12 +416,13 @@ async def reset_password(request: ResetPasswordModel = Body(...)):
         raise HTTPException(status_code=401, detail="Request expired")
     """
     if request.otp == otp:
-        new_password = get_password_hash(request.new_password)
+        new_password = await get_password_hash(request.new_password)
         r = await users_collection.update_one(
             {"_id": str(user.get("_id"))},
             {"$set": {
                 "password": new_password
             }})
+        invalidate_principal(user.get("_id"), user.get("email"))
         if r.modified_count == 1:
             response = {
                 "status": True,
@@ -335,15 +446,17 @@ async def change_password(request: ChangePasswordModel = Body(...),
         return get_error_response(
             "Current password and new passwords cannot be same",
             status.HTTP_500_INTERNAL_SERVER_ERROR)
-    password_match = verify_password(request.current_password, user.password)
+    password_match = await verify_password(request.current_password,
+                                           user.password)
     if not password_match:
         return get_error_response("Incorrect password",
                                   status.HTTP_500_INTERNAL_SERVER_ERROR)
-    new_password = get_password_hash(request.new_password)
+    new_password = await get_password_hash(request.new_password)
     r = await users_collection.update_one({"_id": str(user.id)},
                                           {"$set": {
                                               "password": new_password
                                           }})
+    invalidate_principal(user.id, user.email)
     if r.modified_count == 1:
         response = {"status": True, "message": "Password changed successfully"}
         return JSONResponse(status_code=200, content=response)
@@ -386,7 +499,7 @@ async def set_password(request: SetPasswordLoginModel = Body(...)):
             "status") == "completed":
         raise HTTPException(status_code=401, detail="Request expired")
 
-    hashed_password = get_password_hash(request.password)
+    hashed_password = await get_password_hash(request.password)
     update = {
         "password": hashed_password,
         "updated_ts": get_timestamp(),
@@ -395,6 +508,7 @@ async def set_password(request: SetPasswordLoginModel = Body(...)):
     }
     r = await users_collection.update_one({"_id": user.get("_id")},
                                           {"$set": update})
+    invalidate_principal(user.get("_id"), user.get("email"))
     if r.modified_count != 1:
         raise HTTPException(status_code=501,
                             detail="Error occurred during operation")
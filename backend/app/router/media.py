@@ -0,0 +1,50 @@
+import tempfile
+
+from fastapi import APIRouter, Request
+from starlette import status
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.storage.local import InvalidUploadToken, verify_upload
+from app.utils.responses import ORJSONResponse
+from app.utils.uploads import put_object
+from app.utils.utils import get_error_response
+
+router = APIRouter(
+    prefix="/media",
+    tags=["media"],
+    default_response_class=ORJSONResponse,
+)
+
+
+@router.put("/upload/{token}", description="Direct upload target of the local storage")
+async def upload_object(token: str, request: Request):
+    """
+    Counterpart of the pre-signed PUT URLs of S3 and Azure when media are
+    stored locally, the token authorizes a single key.
+    """
+    if settings.storage_backend != "local":
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    try:
+        claims = verify_upload(token)
+    except InvalidUploadToken:
+        return get_error_response("Invalid or expired upload URL.", status.HTTP_403_FORBIDDEN)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != claims["content_type"]:
+        return get_error_response("Content-Type does not match the upload URL.", status.HTTP_400_BAD_REQUEST)
+    max_bytes = claims["max_bytes"]
+    with tempfile.SpooledTemporaryFile(max_size=settings.upload_chunk_size) as spool:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                return get_error_response(f"Uploads are limited to {max_bytes} bytes",
+                                          status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await run_in_threadpool(spool.write, chunk)
+        spool.seek(0)
+        await put_object(claims["key"], content_type, spool, max_bytes)
+    return {
+        "key": claims["key"],
+        "status": True,
+        "message": "uploaded"
+    }
@@ -0,0 +1,30 @@
+import hmac
+
+from fastapi import APIRouter, Request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from starlette import status
+from starlette.responses import Response
+
+from app.config import settings
+from app.utils.utils import get_error_response
+
+router = APIRouter(tags=["metrics"])
+
+
+def _authorized(request: Request) -> bool:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and bool(settings.metrics_token) \
+        and hmac.compare_digest(token.encode(), settings.metrics_token.encode())
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus exposition of app.core.metrics, for scrapers sending
+    settings.metrics_token as a bearer token. Collected on the event loop,
+    the stats() it exports are of objects owned by the loop."""
+    if not _authorized(request):
+        response = get_error_response("Not authenticated.", status.HTTP_401_UNAUTHORIZED)
+        response.headers["WWW-Authenticate"] = "Bearer"
+        return response
+    # As a header, media_type would get a second charset.
+    return Response(generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
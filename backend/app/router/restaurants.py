@@ -1,26 +1,49 @@
-import base64
-import os
-from typing import Optional
+from typing import Dict, Optional
 
-import pymongo
 from bson import ObjectId
-from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, UploadFile
 from fastapi.encoders import jsonable_encoder
 from pydantic import EmailStr, BaseModel, Field
+from pymongo import ReturnDocument
 from starlette import status
 from starlette.responses import JSONResponse
 
-from app.db.base import users_collection, restaurants_collection, circles_collection, districts_collection, \
-    restaurants_type_collection
+from app.config import settings
+from app.db.base import users_collection, restaurants_collection
+from app.db.facets import invalidate_facets, restaurant_facets
+from app.db.imports import import_restaurants
+from app.db.loader import restaurant_loader
+from app.db.media import media_keys, release_media
+from app.db.restaurants import listing_sort, listing_sort_spec, restaurant_filter, \
+    restaurants_by_ids
+from app.db.reference_data import get_circles, get_district, get_districts, get_restaurant_types, reference_etag
+from app.db.suggest import index_restaurant, unindex_restaurant
 from app.models.base import PyObjectId
-from app.models.restaurants import RestaurantsModel, AddRestaurants, Location, UpdateRestaurants, RestaurantType
+from app.models.restaurants import RestaurantsModel, AddRestaurants, UpdateRestaurants, RestaurantType, point, \
+    RestaurantSort, RESTAURANT_SORTS, LIST_FIELDS, DETAIL_FIELDS, parse_fields, restaurant_projection, \
+    restaurant_response, restaurant_converter, RestaurantIds, MediaKind, MediaUploadRequest, MediaConfirmRequest, \
+    PatchRestaurants, PATCH_REQUIRED_FIELDS, district_key
 from app.models.user import UserRole
 from app.router.auth import get_current_active_user
+from app.utils.conditional import has_validators, not_modified_response, rows_etag, validator_headers, \
+    document_version, make_etag
+from app.utils.export import ExportFormat, export_response
+from app.utils.pagination import InvalidCursor, NEXT_CURSOR_HEADER, cursor_query, next_cursor
+from app.utils.response_cache import RESTAURANTS_TAG, invalidate_responses, restaurant_tags
+from app.utils.responses import ORJSONResponse, RenderedResponse, dumps
+from app.utils.tabular import UnsupportedSheet
+from app.utils.derivatives import schedule_derivatives
+from app.utils.uploads import LOGO_PREFIX, PHOTO_PREFIX, confirm_upload, image_entry, media_url, presigned_upload, \
+    save_data_url, save_upload
 from app.utils.utils import get_error_response, get_timestamp
 
+# Writes of a PUT retried when the restaurant changed under it.
+PUT_ATTEMPTS = 3
+
 router = APIRouter(
     prefix="/business",
     tags=["restaurants"],
+    default_response_class=ORJSONResponse,
     responses={404: {
         "description": "Not found"
     }},
@@ -32,22 +55,12 @@ async def create_restaurants(request: AddRestaurants, user: object = Depends(get
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
     timestamp = get_timestamp()
-    coordinates = []
-    coordinates.extend([request.latitude, request.longitude])
-    location = Location(
-        type="point",
-        coordinates=coordinates
-    )
-    district = await districts_collection.find_one({"_id": ObjectId(request.district)})
-    if request.is_new_logo:
-        logo = request.logo.split(',')
-        contents = base64.b64decode(logo[1])
-        logo_name = ObjectId()
-        destination_file_path = "static/logo/" + str(logo_name) + ".png"
-        logo_url = 'http://127.0.0.1:8000/static/logo/'
-        with open(destination_file_path, 'wb') as f:
-            f.write(contents)
-        logo = os.path.join(logo_url, str(logo_name) + ".png")
+    location = point(request.latitude, request.longitude)
+    district = await get_district(request.district)
+    if district is None:
+        return get_error_response("Unknown district.", status.HTTP_400_BAD_REQUEST)
+    logo_key = await save_data_url(request.logo, LOGO_PREFIX) if request.is_new_logo else None
+    logo = media_url(logo_key) if logo_key else request.logo
     restaurant = RestaurantsModel(
         name=request.name,
         district_id=request.district,
@@ -57,92 +70,262 @@ async def create_restaurants(request: AddRestaurants, user: object = Depends(get
         location=location,
         type=request.type,
         logo=logo,
-        rating=float(request.rating),
+        logo_key=logo_key,
+        rating=request.rating,
         status="open",
         created_by=user.get("_id"),
         created_by_name=user.get("name"),
         created_ts=timestamp
     )
-    await restaurants_collection.insert_one(jsonable_encoder(restaurant))
+    document = jsonable_encoder(restaurant)
+    try:
+        await restaurants_collection.insert_one(document)
+    except BaseException:
+        if logo_key:
+            await release_media([logo_key])
+        raise
+    invalidate_facets()
+    await invalidate_responses(*restaurant_tags(document["_id"]))
+    index_restaurant(document["_id"], document)
     response = {
         "id": str(restaurant.id)
     }
     return response
 
 
+@router.post("/restaurants/import", description="Create restaurants from a CSV or XLSX sheet")
+async def import_restaurants_sheet(file: UploadFile, user: object = Depends(get_current_active_user)):
+    if user.get('role') != UserRole.business_admin:
+        return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
+    try:
+        report = await import_restaurants(file.file, file.filename, user)
+    except UnsupportedSheet as e:
+        return get_error_response(str(e), status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    if report["inserted"]:
+        await invalidate_responses(RESTAURANTS_TAG)
+    return report
+
+
+def _live_image(restaurant: dict, key: str) -> Optional[dict]:
+    """Live image entry of the restaurant stored under key."""
+    return next((x for x in restaurant.get("image") or []
+                 if x and x.get("key") == key and not x.get("is_deleted")), None)
+
+
+async def _add_image(restaurant_id: str, key: str, updated: dict) -> Optional[dict]:
+    """
+    Add an image entry for key, whose reference the caller holds, unless a
+    live entry has it already, then the reference is released. Returns the
+    live entry of key, None when the restaurant is gone.
+    """
+    image = image_entry(key)
+    result = await restaurants_collection.update_one(
+        {"_id": restaurant_id, "is_deleted": False,
+         "image": {"$not": {"$elemMatch": {"key": key, "is_deleted": False}}}},
+        {"$push": {"image": image}, "$set": updated})
+    if result.modified_count:
+        await invalidate_responses(*restaurant_tags(restaurant_id))
+        schedule_derivatives(restaurant_id, image)
+        return image
+    await release_media([key])
+    restaurant = await restaurant_loader.load(restaurant_id, {"image": 1})
+    return None if restaurant is None else _live_image(restaurant, key)
+
+
 @router.post("/restaurants/upload-image")
 async def upload_image(restaurant_id: str, file: UploadFile, user: object = Depends(get_current_active_user)):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    restaurant = await restaurants_collection.find_one({
-        "_id": restaurant_id,
-        "is_deleted": False
+    restaurant = await restaurant_loader.load(restaurant_id)
+    if restaurant is None:
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    key = await save_upload(file, PHOTO_PREFIX)
+    image = await _add_image(restaurant_id, key, {
+        "last_updated_ts": get_timestamp(),
+        "updated_by": user.get("_id"),
+        "updated_by_name": user.get("name")
     })
+    if image is None:
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    response = {
+        "id": restaurant_id,
+        "image_id": str(image["id"]),
+        "status": True,
+        "message": "uploaded"
+    }
+    return response
+
+
+def _media_prefix(kind: MediaKind, restaurant_id: str) -> str:
+    return f"{LOGO_PREFIX if kind == MediaKind.logo else PHOTO_PREFIX}/{restaurant_id}"
+
+
+@router.post("/restaurants/{restaurant_id}/media/upload-url",
+             description="Pre-signed URL to upload a logo or image straight to storage")
+async def media_upload_url(restaurant_id: str, request: MediaUploadRequest,
+                           user: object = Depends(get_current_active_user)):
+    if user.get('role') != UserRole.business_admin:
+        return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
+    restaurant = await restaurant_loader.load(restaurant_id, {"_id": 1})
     if restaurant is None:
         return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
-    contents = await file.read()
-    destination_file_path = "static/restaurants-photos/" + file.filename
-    base_url = 'http://127.0.0.1:8000/static/restaurants-photos/'
-    with open(destination_file_path, 'wb') as f:
-        f.write(contents)
+    key, upload = await presigned_upload(_media_prefix(request.kind, restaurant_id), request.content_type)
+    return {
+        "key": key,
+        "url": upload.url,
+        "method": upload.method,
+        "headers": upload.headers,
+        "expires_in": upload.expires_in,
+        "max_bytes": settings.upload_max_bytes
+    }
 
-    update = {
-        "image": {"id": ObjectId(),
-                  "image": os.path.join(base_url, file.filename),
-                  "is_deleted": False}
+
+@router.post("/restaurants/{restaurant_id}/media/confirm",
+             description="Record a logo or image uploaded with a pre-signed URL")
+async def confirm_media_upload(restaurant_id: str, request: MediaConfirmRequest,
+                               user: object = Depends(get_current_active_user)):
+    if user.get('role') != UserRole.business_admin:
+        return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
+    if not request.key.startswith(_media_prefix(request.kind, restaurant_id) + "/"):
+        return get_error_response("Invalid key.", status.HTTP_400_BAD_REQUEST)
+    restaurant = await restaurant_loader.load(restaurant_id, {"_id": 1, "image": 1})
+    if restaurant is None:
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    key = await confirm_upload(request.key, LOGO_PREFIX if request.kind == MediaKind.logo else PHOTO_PREFIX)
+    url = media_url(key)
+    updated = {
+        "last_updated_ts": get_timestamp(),
+        "updated_by": user.get("_id"),
+        "updated_by_name": user.get("name")
     }
-    await restaurants_collection.update_one({"_id": restaurant_id}, {"$push": update})
     response = {
         "id": restaurant_id,
-        "status": True,
-        "message": "uploaded"
+        "url": url
     }
+    if request.kind == MediaKind.logo:
+        previous = await restaurants_collection.find_one_and_update(
+            {"_id": restaurant_id, "is_deleted": False}, {"$set": {"logo": url, "logo_key": key, **updated}},
+            projection={"logo_key": 1}, return_document=ReturnDocument.BEFORE)
+        if previous is None:
+            await release_media([key])
+            return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+        # The restaurant holds the reference to the new logo instead.
+        if previous.get("logo_key"):
+            await release_media([previous["logo_key"]])
+        await invalidate_responses(*restaurant_tags(restaurant_id))
+    else:
+        image = await _add_image(restaurant_id, key, updated)
+        if image is None:
+            return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+        response["image_id"] = str(image["id"])
     return response
 
 
 @router.get("/restaurants")
-async def list_restaurants(restaurant_type: Optional[RestaurantType] = None,
+async def list_restaurants(request: Request,
+                           restaurant_type: Optional[RestaurantType] = None,
                            skip: int = 0,
                            limit: int = 40,
                            user: object = Depends(get_current_active_user),
                            query: str = None, district: str = None,
-                           circle: str = None
+                           circle: str = None,
+                           sort: RestaurantSort = RestaurantSort.default,
+                           cursor: str = None,
+                           fields: str = Query(None, description="Comma separated response fields"),
+                           facets: bool = Query(False, description="Return the page with total and facet counts"),
+                           score: bool = Query(False, description="Return the relevance of each result to the query")
                            ):
-    await restaurants_collection.create_index([('name', pymongo.TEXT)], default_language='english')
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    find_query = {
-        "is_deleted": False,
-    }
-    if district is not None:
-        find_query["district"] = {"$regex": district, "$options": "i"}
-    if restaurant_type is not None:
-        find_query["type"] = restaurant_type
+    try:
+        fields = parse_fields(fields, LIST_FIELDS)
+        sort = listing_sort(sort, query)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    if score and query is None:
+        return get_error_response("The score needs a query.", status.HTTP_400_BAD_REQUEST)
+    if sort == RestaurantSort.relevance and cursor is not None:
+        return get_error_response("Cursors cannot be used with the relevance sort, use skip.",
+                                  status.HTTP_400_BAD_REQUEST)
+    find_query = restaurant_filter(restaurant_type, query, district, circle)
+    field, direction = RESTAURANT_SORTS[sort]
+    try:
+        page_query = cursor_query(find_query, cursor, sort.value, field, direction)
+    except InvalidCursor as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    if cursor is not None:
+        skip = 0
+    projection = restaurant_projection(fields, field, "created_ts", "last_updated_ts")
 
-    if query is not None:
-        find_query["$text"] = {"$search": query}
-    if circle is not None:
-        find_query["circle"] = circle
-    restaurants = await restaurants_collection.find(find_query).skip(skip).limit(
-        limit).to_list(limit)
-    restaurants_response = [RestaurantsModel(**x).list_response() for x in restaurants]
-    return restaurants_response
+    async def read_page() -> RenderedResponse:
+        total = facet_counts = None
+        if facets:
+            restaurants, total, facet_counts = await restaurant_facets(find_query, page_query,
+                                                                       listing_sort_spec(field, direction), skip,
+                                                                       limit, projection)
+        else:
+            restaurants = await restaurants_collection.find(page_query, projection).sort(
+                listing_sort_spec(field, direction)).skip(skip).limit(limit).to_list(limit)
+        etag = rows_etag([page_query, sort, skip, limit, fields, score, facets and (total, facet_counts)],
+                         restaurants)
+        content = [restaurant_response(x, fields) for x in restaurants]
+        if score:
+            for restaurant, x in zip(content, restaurants):
+                restaurant["score"] = x.get("score")
+        if facets:
+            content = {"results": content, "total": total, "facets": facet_counts}
+        page_cursor = None if sort == RestaurantSort.relevance else next_cursor(restaurants, limit, sort.value, field)
+        headers = {NEXT_CURSOR_HEADER: page_cursor} if page_cursor is not None else {}
+        return RenderedResponse(dumps(content), etag, headers=headers)
+
+    # Not coalesced, a read started before a write must not answer the
+    # editors reading after it.
+    rendered = await read_page()
+    return rendered.response(request)
+
+
+@router.get("/restaurants/export", description="Stream all matching restaurants as NDJSON or CSV")
+async def export_restaurants(restaurant_type: Optional[RestaurantType] = None,
+                             user: object = Depends(get_current_active_user),
+                             query: str = None, district: str = None,
+                             circle: str = None,
+                             export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+                             fields: str = Query(None, description="Comma separated response fields")):
+    if user.get('role') != UserRole.business_admin:
+        return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
+    try:
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    find_query = restaurant_filter(restaurant_type, query, district, circle)
+    cursor = restaurants_collection.find(find_query, restaurant_projection(fields)).sort("_id", 1)
+    return export_response(cursor, restaurant_converter(fields), export_format, fields,
+                           settings.export_batch_size, "restaurants")
 
 
 @router.delete("/restaurants/delete-image")
 async def delete_images(restaurant_id: str, image_id: str, user: object = Depends(get_current_active_user)):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    restaurant = await restaurants_collection.find_one({
-        "_id": restaurant_id,
-        "is_deleted": False
-    })
+    restaurant = await restaurant_loader.load(restaurant_id)
     if restaurant is None:
         return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    image = next((x for x in restaurant.get("image") or []
+                  if x and str(x.get("id")) == image_id and not x.get("is_deleted")), None)
+    if image is None:
+        return get_error_response("Image not found.", status.HTTP_404_NOT_FOUND)
     update = {
-        "image.$.is_deleted": True
+        "image.$.is_deleted": True,
+        "last_updated_ts": get_timestamp(),
+        "updated_by": user.get("_id"),
+        "updated_by_name": user.get("name")
     }
-    await restaurants_collection.update_one({"_id": restaurant_id, "image.id": ObjectId(image_id)}, {"$set": update})
+    result = await restaurants_collection.update_one(
+        {"_id": restaurant_id, "is_deleted": False,
+         "image": {"$elemMatch": {"id": image["id"], "is_deleted": False}}}, {"$set": update})
+    if result.modified_count:
+        await invalidate_responses(*restaurant_tags(restaurant_id))
+        await release_media(media_keys([image]))
     response = {
         "id": restaurant_id,
         "status": True,
@@ -151,18 +334,87 @@ async def delete_images(restaurant_id: str, image_id: str, user: object = Depend
     return response
 
 
+@router.post("/restaurants/batch", description="Get many restaurants by id")
+async def get_restaurants_batch(request: RestaurantIds,
+                                user: object = Depends(get_current_active_user),
+                                fields: str = Query(None, description="Comma separated response fields")):
+    if user.get('role') != UserRole.business_admin:
+        return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
+    try:
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    return ORJSONResponse({"results": await restaurants_by_ids(request.ids, fields)})
+
+
 @router.get("/restaurants/{restaurants_id}", description="Get restaurant data")
 async def get_restaurants(
+        request: Request,
         restaurants_id: str,
-        user: object = Depends(get_current_active_user)):
+        user: object = Depends(get_current_active_user),
+        fields: str = Query(None, description="Comma separated response fields")):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    restaurant = await restaurants_collection.find_one({
-        "_id": restaurants_id,
-        "is_deleted": False
-    })
-    restaurants_response = RestaurantsModel(**restaurant).detailed_response()
-    return restaurants_response
+    try:
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    if has_validators(request):
+        # Answer revalidations from the timestamps alone.
+        restaurant = await restaurant_loader.load(restaurants_id, {"created_ts": 1, "last_updated_ts": 1})
+        if restaurant is None:
+            return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+        last_modified = document_version(restaurant)
+        not_modified = not_modified_response(request, make_etag(restaurants_id, last_modified, fields),
+                                             last_modified)
+        if not_modified is not None:
+            return not_modified
+
+    async def read_restaurant() -> Optional[RenderedResponse]:
+        restaurant = await restaurant_loader.load(restaurants_id,
+                                                  restaurant_projection(fields, "created_ts", "last_updated_ts"))
+        if restaurant is None:
+            return None
+        last_modified = document_version(restaurant)
+        return RenderedResponse(dumps(restaurant_response(restaurant, fields)),
+                                make_etag(restaurants_id, last_modified, fields), last_modified)
+
+    rendered = await read_restaurant()
+    if rendered is None:
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    return rendered.response(request)
+
+
+def _version_is(version: int) -> dict:
+    """Filter of the restaurants at version, those never edited since
+    versions were added have none."""
+    return {"version": version} if version else {"version": {"$in": [0, None]}}
+
+
+async def _requested_images(images: Optional[list], items: list, stored: Dict[str, str]) -> list:
+    """
+    Image list of a PUT. Images are sent as base64 data, or as the id or
+    URL of an image the restaurant already has, which is kept as it is.
+    Data is stored once per request, stored maps it to the key whose
+    reference is held for it.
+    """
+    existing = {}
+    for image in images or []:
+        if image and not image.get("is_deleted"):
+            existing.update({str(image.get("id")): image, image.get("image"): image})
+            if image.get("key"):
+                existing[image["key"]] = image
+    result = []
+    for item in items:
+        image = existing.get(item)
+        if image is None:
+            key = stored.get(item)
+            if key is None:
+                key = stored[item] = await save_data_url(item, PHOTO_PREFIX)
+            image = existing.setdefault(key, image_entry(key))
+        if all(x is not image for x in result):
+            result.append(image)
+    return result
 
 
 @router.put('/restaurants/{restaurant_id}')
@@ -171,84 +423,187 @@ async def update_restaurant(restaurant_id: str, request: UpdateRestaurants,
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
 
-    restaurant = await restaurants_collection.find_one({
-        "_id": restaurant_id,
-        "is_deleted": False
-    })
-    district = await districts_collection.find_one({"_id": ObjectId(request.district)})
-    if restaurant is None:
-        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
-    restaurant = RestaurantsModel(**restaurant)
-    coordinates = []
-    coordinates.extend([request.latitude, request.longitude])
-    location = Location(
-        type="point",
-        coordinates=coordinates
-    )
-    if request.is_new_logo:
-        logo = request.logo.split(',')
-        contents = base64.b64decode(logo[1])
-        logo_name = ObjectId()
-        destination_file_path = "static/logo/" + str(logo_name) + ".png"
-        logo_url = 'http://127.0.0.1:8000/static/logo/'
-        with open(destination_file_path, 'wb') as f:
-            f.write(contents)
-        logo = os.path.join(logo_url, str(logo_name) + ".png")
-    else:
-        logo = request.logo
-    images = []
-    if len(request.images) != 0:
-        for image in request.images:
-            image_str = image.split(',')
-            contents = base64.b64decode(image_str[1])
-            image_name = ObjectId()
-            destination_file_path = "static/restaurants-photos/" + str(image_name) + ".png"
-            image_url = 'http://127.0.0.1:8000/restaurants-photos/'
-            with open(destination_file_path, 'wb') as f:
-                f.write(contents)
-            update = {
-                "image": {"id": ObjectId(),
-                          "image": os.path.join(image_url, str(image_name) + ".png"),
-                          "is_deleted": False}
-            }
-            images.append(update)
+    district = await get_district(request.district)
+    if district is None:
+        return get_error_response("Unknown district.", status.HTTP_400_BAD_REQUEST)
+    new_logo_key = await save_data_url(request.logo, LOGO_PREFIX) if request.is_new_logo else None
+    logo = media_url(new_logo_key) if new_logo_key else request.logo
+    stored = {}
+    written = False
+    try:
+        for _ in range(PUT_ATTEMPTS):
+            restaurant = await restaurant_loader.load(restaurant_id)
+            if restaurant is None:
+                return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+            version = restaurant.get("version") or 0
+            if request.version is not None and request.version != version:
+                break
+            previous = restaurant.get("image")
+            previous_logo_key = restaurant.get("logo_key")
+            if new_logo_key:
+                logo_key = new_logo_key
+            else:
+                # Kept while the logo is, a URL of elsewhere has no key.
+                logo_key = previous_logo_key if logo == restaurant.get("logo") else None
+            restaurant = RestaurantsModel(**restaurant)
+            images = restaurant.image
+            if request.images is not None:
+                images = await _requested_images(previous, request.images, stored)
+            previous_keys = media_keys(previous)
+            added_keys = media_keys(images) - previous_keys
 
-    timestamp = get_timestamp()
-    restaurant.name = request.name
-    restaurant.district_id = request.district
-    restaurant.district = district.get("name")
-    restaurant.description = request.description
-    restaurant.circle = request.circle
-    restaurant.location = location
-    restaurant.logo = logo
-    restaurant.image=images
-    restaurant.rating = float(request.rating)
-    restaurant.last_updated_ts = timestamp
-    restaurant.updated_by = user.get("_id")
-    restaurant.updated_by_name = user.get("name")
-
-    await restaurants_collection.update_one({"_id": restaurant_id}, {"$set": jsonable_encoder(restaurant)})
+            restaurant.name = request.name
+            restaurant.district_id = request.district
+            restaurant.district = district.get("name")
+            restaurant.district_key = district_key(restaurant.district)
+            restaurant.description = request.description
+            restaurant.circle = request.circle
+            restaurant.location = point(request.latitude, request.longitude) or restaurant.location
+            restaurant.logo = logo
+            restaurant.logo_key = logo_key
+            restaurant.image = images
+            restaurant.rating = request.rating
+            restaurant.last_updated_ts = get_timestamp()
+            restaurant.updated_by = user.get("_id")
+            restaurant.updated_by_name = user.get("name")
+
+            document = jsonable_encoder(restaurant)
+            del document["version"]
+            # Only written over the version, image list and logo it was
+            # built from, an edit, an image or logo added or a derivative
+            # recorded meanwhile makes it start over, and the reference
+            # changes are exact.
+            result = await restaurants_collection.update_one(
+                {"_id": restaurant_id, "is_deleted": False, "image": previous, "logo_key": previous_logo_key,
+                 **_version_is(version)},
+                {"$set": document, "$inc": {"version": 1}})
+            if result.matched_count:
+                written = True
+                break
+    finally:
+        # References of the stored data no image entry or logo took.
+        unused = list(stored.values())
+        if new_logo_key and not written:
+            unused.append(new_logo_key)
+        if written:
+            for key in added_keys:
+                unused.remove(key)
+        await release_media(unused)
+    if not written:
+        return get_error_response("Restaurant was modified, reload it and retry.", status.HTTP_409_CONFLICT)
+    invalidate_facets()
+    index_restaurant(restaurant_id, document)
+    await invalidate_responses(*restaurant_tags(restaurant_id))
+    await release_media(previous_keys - media_keys(images))
+    if previous_logo_key and (new_logo_key or logo_key != previous_logo_key):
+        await release_media([previous_logo_key])
+    for image in document["image"]:
+        if image.get("key") in added_keys:
+            schedule_derivatives(restaurant_id, image)
     response = {
         "id": restaurant_id,
+        "version": version + 1,
         "message": "updated"
     }
     return response
 
 
-@router.delete("/restaurants/{restaurant_id}")
-async def delete_restaurant(restaurant_id: str, user: object = Depends(get_current_active_user)):
+@router.patch("/restaurants/{restaurant_id}", description="Update some fields of a restaurant")
+async def patch_restaurant(restaurant_id: str, request: PatchRestaurants,
+                           user: object = Depends(get_current_active_user),
+                           fields: str = Query(None, description="Comma separated response fields")):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    restaurant = await restaurants_collection.find_one({
-        "_id": restaurant_id,
-        "is_deleted": False
+    try:
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    changes = request.dict(exclude_unset=True)
+    version = changes.pop("version")
+    if not changes:
+        return get_error_response("Nothing to update.", status.HTTP_400_BAD_REQUEST)
+    if "logo" in changes:
+        # The logo holds a media reference, PATCH would leak it.
+        return get_error_response("Upload the logo with the media upload-url and confirm endpoints.",
+                                  status.HTTP_400_BAD_REQUEST)
+    removed = [x for x in PATCH_REQUIRED_FIELDS if x in changes and changes[x] is None]
+    if removed:
+        return get_error_response(f"Cannot remove: {', '.join(removed)}", status.HTTP_400_BAD_REQUEST)
+
+    update = {"$set": {}, "$unset": {}}
+    if "district" in changes:
+        district_id = changes.pop("district")
+        district = await get_district(district_id)
+        if district is None:
+            return get_error_response("Unknown district.", status.HTTP_400_BAD_REQUEST)
+        update["$set"].update({"district_id": district_id, "district": district.get("name"),
+                               "district_key": district_key(district.get("name"))})
+    if "latitude" in changes or "longitude" in changes:
+        latitude, longitude = changes.pop("latitude", None), changes.pop("longitude", None)
+        if (latitude is None) != (longitude is None):
+            return get_error_response("latitude and longitude are updated together.",
+                                      status.HTTP_400_BAD_REQUEST)
+        if latitude is None:
+            update["$unset"]["location"] = ""
+        else:
+            update["$set"]["location"] = point(latitude, longitude).dict()
+    for name, value in changes.items():
+        if value is None:
+            update["$unset"][name] = ""
+        else:
+            update["$set"][name] = value
+    update["$set"].update({
+        "last_updated_ts": get_timestamp(),
+        "updated_by": user.get("_id"),
+        "updated_by_name": user.get("name")
     })
+    if not update["$unset"]:
+        del update["$unset"]
+    update["$inc"] = {"version": 1}
+
+    # Only matches the version the client read, a concurrent edit makes it
+    # miss instead of being overwritten.
+    restaurant = await restaurants_collection.find_one_and_update(
+        {"_id": restaurant_id, "is_deleted": False, **_version_is(version)},
+        update,
+        projection=restaurant_projection(fields, "created_ts", "last_updated_ts", "version", "name", "district",
+                                         "circle"),
+        return_document=ReturnDocument.AFTER)
     if restaurant is None:
-        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+        if await restaurant_loader.load(restaurant_id, {"_id": 1}) is None:
+            return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+        return get_error_response("Restaurant was modified, reload it and retry.", status.HTTP_409_CONFLICT)
+    invalidate_facets()
+    index_restaurant(restaurant_id, restaurant)
+    await invalidate_responses(*restaurant_tags(restaurant_id))
+    last_modified = document_version(restaurant)
+    response = restaurant_response(restaurant, fields)
+    response["version"] = restaurant["version"]
+    return ORJSONResponse(response,
+                          headers=validator_headers(make_etag(restaurant_id, last_modified, fields), last_modified))
+
+
+@router.delete("/restaurants/{restaurant_id}")
+async def delete_restaurant(restaurant_id: str, user: object = Depends(get_current_active_user)):
+    if user.get('role') != UserRole.business_admin:
+        return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
     update = {
         "is_deleted": True
     }
-    await restaurants_collection.update_one({"_id": restaurant_id}, {"$set": update})
+    # The references are released from the images and logo as they were
+    # deleted.
+    restaurant = await restaurants_collection.find_one_and_update(
+        {"_id": restaurant_id, "is_deleted": False}, {"$set": update}, projection={"image": 1, "logo_key": 1},
+        return_document=ReturnDocument.BEFORE)
+    if restaurant is None:
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    invalidate_facets()
+    unindex_restaurant(restaurant_id)
+    await invalidate_responses(*restaurant_tags(restaurant_id))
+    keys = media_keys(restaurant.get("image"))
+    if restaurant.get("logo_key"):
+        keys.add(restaurant["logo_key"])
+    await release_media(keys)
     response = {
         "id": restaurant_id,
         "status": True,
@@ -258,35 +613,51 @@ async def delete_restaurant(restaurant_id: str, user: object = Depends(get_curre
 
 
 @router.get("/restaurants/restaurant_type")
-async def get_restaurant_type(user: object = Depends(get_current_active_user)):
+async def get_restaurant_type(request: Request, user: object = Depends(get_current_active_user)):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    restaurants_type = await restaurants_type_collection.find().to_list(100)
-    return restaurants_type
+    etag = await reference_etag("restaurant_types")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    restaurants_type = await get_restaurant_types()
+    return ORJSONResponse(restaurants_type, headers=validator_headers(etag))
 
 
 @router.get("/district/circles")
-async def list_circle(user: object = Depends(get_current_active_user)):
+async def list_circle(request: Request, user: object = Depends(get_current_active_user)):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    circles = await circles_collection.find({"is_deleted": False}).to_list(200)
+    etag = await reference_etag("circles")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    circles = await get_circles()
     circle_list = [{"name": x.get("name"), "district": x.get("district")} for x in circles]
-    return circle_list
+    return ORJSONResponse(circle_list, headers=validator_headers(etag))
 
 
 @router.get("/district")
-async def list_district(user: object = Depends(get_current_active_user)):
+async def list_district(request: Request, user: object = Depends(get_current_active_user)):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    district = await districts_collection.find().to_list(200)
+    etag = await reference_etag("districts")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    district = await get_districts()
     district_list = [{"id": str(x.get("_id")), "name": x.get("name")} for x in district]
-    return district_list
+    return ORJSONResponse(district_list, headers=validator_headers(etag))
 
 
 @router.get("/restaurant_type")
-async def get_restaurant_type(user: object = Depends(get_current_active_user)):
+async def get_restaurant_type(request: Request, user: object = Depends(get_current_active_user)):
     if user.get('role') != UserRole.business_admin:
         return get_error_response("Invalid operation.", status.HTTP_401_UNAUTHORIZED)
-    restaurants_type = await restaurants_type_collection.find().to_list(100)
+    etag = await reference_etag("restaurant_types")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    restaurants_type = await get_restaurant_types()
     restaurants_type_list = [{"id": str(x.get("_id")), "name": x.get("name").capitalize()} for x in restaurants_type]
-    return restaurants_type_list
+    return ORJSONResponse(restaurants_type_list, headers=validator_headers(etag))
@@ -1,42 +1,79 @@
 import os
-from typing import Optional
+from typing import Awaitable, Callable, Optional, TypeVar
 
-import pymongo
 from bson import ObjectId
-from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, UploadFile
 from fastapi.encoders import jsonable_encoder
 from pydantic import EmailStr, BaseModel, Field
 from starlette import status
 from starlette.responses import JSONResponse
 
-from app.db.base import users_collection, restaurants_collection, restaurants_type_collection, districts_collection, \
-    circles_collection
+from app.core.singleflight import flight_key
+from app.db.base import users_collection, restaurants_collection
+from app.db.facets import restaurant_facets
+from app.db.loader import restaurant_loader
+from app.db.restaurants import listing_sort, listing_sort_spec, restaurant_filter, restaurant_reads, \
+    restaurants_by_ids
+from app.db.reference_data import get_circles, get_districts, get_restaurant_types, reference_etag
+from app.db.suggest import get_suggest_index
 from app.models.base import PyObjectId
-from app.models.restaurants import RestaurantsModel, AddRestaurants, Location, UpdateRestaurants, RestaurantType
+from app.models.restaurants import RestaurantsModel, AddRestaurants, UpdateRestaurants, RestaurantType, point, \
+    RestaurantSort, RESTAURANT_SORTS, LIST_FIELDS, DETAIL_FIELDS, parse_fields, restaurant_projection, \
+    restaurant_response, RestaurantIds
 from app.models.user import UserRole
 from app.router.auth import get_current_active_user
+from app.utils.conditional import has_validators, not_modified_response, rows_etag, validator_headers, \
+    document_version, make_etag
+from app.utils.pagination import InvalidCursor, NEXT_CURSOR_HEADER, cursor_query, next_cursor
+from app.utils.response_cache import REFERENCE_TAG, RESTAURANTS_TAG, cached_response, response_versions, \
+    restaurant_tag
+from app.utils.responses import ORJSONResponse, RenderedResponse, dumps
 from app.utils.utils import get_error_response, get_timestamp
 
 router = APIRouter(
     tags=["restaurants-customer"],
+    default_response_class=ORJSONResponse,
     responses={404: {
         "description": "Not found"
     }},
 )
 
+T = TypeVar("T")
+
+
+async def _read_once(tag: str, key: str, read: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run read through restaurant_reads, keyed with the response cache
+    version of tag. Writes bump it, so requests made after a write do not
+    join a read started before it, nor cache what it read under the new
+    version. Read alone when the version is unavailable.
+    """
+    versions = await response_versions(tag)
+    if versions is None:
+        return await read()
+    return await restaurant_reads.do(flight_key(key, versions), read)
+
 
 @router.get("/restaurants/restaurant_type")
-async def get_restaurant_type():
-    restaurants_type = await restaurants_type_collection.find().to_list(100)
+@cached_response(REFERENCE_TAG)
+async def get_restaurant_type(request: Request):
+    etag = await reference_etag("restaurant_types")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    restaurants_type = await get_restaurant_types()
     restaurants_type_list = [{
         "id": str(x.get("_id")),
         "name": x.get("name").capitalize()
     } for x in restaurants_type]
-    return restaurants_type_list
+    return ORJSONResponse(restaurants_type_list,
+                          headers=validator_headers(etag))
 
 
 @router.get("/restaurants/")
-async def list_restaurants(restaurant_type: Optional[RestaurantType] = None,
+@cached_response(RESTAURANTS_TAG)
+async def list_restaurants(request: Request,
+                           restaurant_type: Optional[RestaurantType] = None,
                            skip: int = 0,
                            limit: int = 40,
                            lat: float = None,
@@ -44,57 +81,185 @@ async def list_restaurants(restaurant_type: Optional[RestaurantType] = None,
                            query: str = None,
                            district: str = None,
                            circle: str = None,
-                           rating: int = None):
-    await restaurants_collection.create_index([('name', pymongo.TEXT)],
-                                              default_language='english')
-    find_query = {
-        "is_deleted": False,
-    }
-    if restaurant_type is not None:
-        find_query["type"] = restaurant_type
-    if query is not None:
-        find_query["$text"] = {"$search": query}
-    if district is not None:
-        find_query["district"] = {"$regex": district, "$options": "i"}
-    if circle is not None:
-        find_query["circle"] = circle
-    if rating is not None:
-        find_query["rating"] = rating
-    
-    # @todo add geospacial query here.
-    restaurants = await restaurants_collection.find(find_query).skip(
-        skip).limit(limit).to_list(limit)
-    restaurants_response = [
-        RestaurantsModel(**x).list_response() for x in restaurants
-    ]
-    return restaurants_response
+                           rating: int = None,
+                           radius: float = Query(None, gt=0, description="Meters around lat/lon"),
+                           nearest: int = Query(None, gt=0, le=100, description="Return the k nearest"),
+                           sort: RestaurantSort = RestaurantSort.default,
+                           cursor: str = None,
+                           fields: str = Query(None, description="Comma separated response fields"),
+                           facets: bool = Query(False, description="Return the page with total and facet counts"),
+                           score: bool = Query(False, description="Return the relevance of each result to the query")):
+    try:
+        fields = parse_fields(fields, LIST_FIELDS)
+        sort = listing_sort(sort, query)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    if score and query is None:
+        return get_error_response("The score needs a query.", status.HTTP_400_BAD_REQUEST)
+    find_query = restaurant_filter(restaurant_type, query, district, circle,
+                                   rating)
+
+    if lat is not None and lon is not None:
+        if query is not None or cursor is not None or facets:
+            return get_error_response("Text search, cursors and facets cannot be combined with a location.",
+                                      status.HTTP_400_BAD_REQUEST)
+        geo_near = {
+            "near": point(lat, lon).dict(),
+            "distanceField": "distance",
+            "spherical": True,
+            "query": find_query,
+        }
+        if radius is not None:
+            geo_near["maxDistance"] = radius
+        limit = nearest or limit
+
+        async def read_nearby() -> RenderedResponse:
+            restaurants = await restaurants_collection.aggregate([
+                {"$geoNear": geo_near},
+                {"$skip": skip},
+                {"$limit": limit},
+                {"$project": restaurant_projection(fields, "distance", "created_ts", "last_updated_ts")},
+            ]).to_list(limit)
+            etag = rows_etag([geo_near, skip, limit, fields], restaurants)
+            restaurants_response = []
+            for x in restaurants:
+                restaurant = restaurant_response(x, fields)
+                restaurant["distance"] = round(x["distance"])
+                restaurants_response.append(restaurant)
+            return RenderedResponse(dumps(restaurants_response), etag)
+
+        rendered = await _read_once(RESTAURANTS_TAG, flight_key("nearby", geo_near, skip, limit, fields),
+                                    read_nearby)
+        return rendered.response(request)
+
+    if sort == RestaurantSort.relevance and cursor is not None:
+        return get_error_response("Cursors cannot be used with the relevance sort, use skip.",
+                                  status.HTTP_400_BAD_REQUEST)
+    field, direction = RESTAURANT_SORTS[sort]
+    try:
+        page_query = cursor_query(find_query, cursor, sort.value, field,
+                                  direction)
+    except InvalidCursor as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    if cursor is not None:
+        skip = 0
+    projection = restaurant_projection(fields, field, "created_ts",
+                                       "last_updated_ts")
+
+    async def read_page() -> RenderedResponse:
+        total = facet_counts = None
+        if facets:
+            restaurants, total, facet_counts = await restaurant_facets(
+                find_query, page_query, listing_sort_spec(field, direction), skip, limit,
+                projection)
+        else:
+            restaurants = await restaurants_collection.find(
+                page_query, projection).sort(listing_sort_spec(
+                    field, direction)).skip(skip).limit(limit).to_list(limit)
+        etag = rows_etag(
+            [page_query, sort, skip, limit, fields, score, facets and (total, facet_counts)],
+            restaurants)
+        content = [restaurant_response(x, fields) for x in restaurants]
+        if score:
+            for restaurant, x in zip(content, restaurants):
+                restaurant["score"] = x.get("score")
+        if facets:
+            content = {"results": content, "total": total, "facets": facet_counts}
+        page_cursor = None if sort == RestaurantSort.relevance else next_cursor(
+            restaurants, limit, sort.value, field)
+        headers = {NEXT_CURSOR_HEADER: page_cursor} if page_cursor is not None else {}
+        return RenderedResponse(dumps(content), etag, headers=headers)
+
+    rendered = await _read_once(
+        RESTAURANTS_TAG, flight_key("page", page_query, sort, skip, limit, fields, score, facets), read_page)
+    return rendered.response(request)
+
+
+@router.get("/restaurants/suggest", description="Restaurants whose name, district or circle match what is typed")
+async def suggest_restaurants(q: str = Query(..., min_length=1, max_length=100),
+                              limit: int = Query(10, ge=1, le=50)):
+    index = await get_suggest_index()
+    return ORJSONResponse([x.response() for x in index.suggest(q, limit)])
+
+
+@router.post("/restaurants/batch", description="Get many restaurants by id")
+async def get_restaurants_batch(request: RestaurantIds,
+                                fields: str = Query(None, description="Comma separated response fields")):
+    try:
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    return ORJSONResponse(
+        {"results": await restaurants_by_ids(request.ids, fields)})
 
 
 @router.get("/restaurants/{restaurant_id}", description="Get emission data")
-async def get_restaurants(restaurant_id: str):
-    restaurant = await restaurants_collection.find_one({
-        "_id": restaurant_id,
-        "is_deleted": False,
-    })
-    restaurants_response = RestaurantsModel(**restaurant).detailed_response()
-    return restaurants_response
+@cached_response(restaurant_tag)
+async def get_restaurants(request: Request,
+                          restaurant_id: str,
+                          fields: str = Query(None, description="Comma separated response fields")):
+    try:
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    if has_validators(request):
+        # Answer revalidations from the timestamps alone.
+        restaurant = await restaurant_loader.load(restaurant_id, {
+            "created_ts": 1,
+            "last_updated_ts": 1
+        })
+        if restaurant is None:
+            return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+        last_modified = document_version(restaurant)
+        not_modified = not_modified_response(
+            request, make_etag(restaurant_id, last_modified, fields),
+            last_modified)
+        if not_modified is not None:
+            return not_modified
+
+    async def read_restaurant() -> Optional[RenderedResponse]:
+        restaurant = await restaurant_loader.load(
+            restaurant_id,
+            restaurant_projection(fields, "created_ts", "last_updated_ts"))
+        if restaurant is None:
+            return None
+        last_modified = document_version(restaurant)
+        return RenderedResponse(dumps(restaurant_response(restaurant, fields)),
+                                make_etag(restaurant_id, last_modified, fields),
+                                last_modified)
+
+    rendered = await _read_once(restaurant_tag(restaurant_id), flight_key("restaurant", restaurant_id, fields),
+                                read_restaurant)
+    if rendered is None:
+        return get_error_response("Not Found.", status.HTTP_404_NOT_FOUND)
+    return rendered.response(request)
 
 
 @router.get("/district")
-async def list_district():
-    district = await districts_collection.find().to_list(200)
+@cached_response(REFERENCE_TAG)
+async def list_district(request: Request):
+    etag = await reference_etag("districts")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    district = await get_districts()
     district_list = [{
         "id": str(x.get("_id")),
         "name": x.get("name")
     } for x in district]
-    return district_list
+    return ORJSONResponse(district_list, headers=validator_headers(etag))
 
 
 @router.get("/district/circles")
-async def list_circle():
-    circles = await circles_collection.find({"is_deleted": False}).to_list(200)
+@cached_response(REFERENCE_TAG)
+async def list_circle(request: Request):
+    etag = await reference_etag("circles")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    circles = await get_circles()
     circle_list = [{
         "name": x.get("name"),
         "district": x.get("district")
     } for x in circles]
-    return circle_list
+    return ORJSONResponse(circle_list, headers=validator_headers(etag))
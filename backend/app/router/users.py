@@ -1,19 +1,27 @@
 from bson import ObjectId
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
 from fastapi.encoders import jsonable_encoder
 from pydantic import EmailStr, BaseModel, Field
 from starlette import status
 from starlette.responses import JSONResponse
 
-from app.db.base import users_collection, roles_collection
+from app.config import settings
+from app.db.base import users_collection
+from app.db.loader import user_loader
+from app.db.reference_data import get_roles, reference_etag
 from app.models.base import PyObjectId
 from app.models.user import InviteUpdateModel, InviteUserModel, UserRole
-from app.router.auth import get_user, get_current_active_user
+from app.router.auth import get_user, get_current_active_user, invalidate_principal
+from app.utils.conditional import not_modified_response, validator_headers
+from app.utils.export import ExportFormat, export_response
+from app.utils.pagination import InvalidCursor, NEXT_CURSOR_HEADER, cursor_query, next_cursor
+from app.utils.responses import ORJSONResponse
 from app.utils.utils import APIResponseModel, get_error_response, get_timestamp
 
 router = APIRouter(
     prefix="/business/users",
     tags=["users"],
+    default_response_class=ORJSONResponse,
     responses={404: {
         "description": "Not found"
     }},
@@ -44,40 +52,54 @@ class AddUserModel(BaseModel):
 
 
 @router.get("/list-role")
-async def list_role(user: object = Depends(get_current_active_user)):
-    roles = await roles_collection.find().to_list(100)
+async def list_role(request: Request,
+                    user: object = Depends(get_current_active_user)):
+    etag = await reference_etag("roles")
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    roles = await get_roles()
     roles = [{"role": x.get("role")} for x in roles]
-    return roles
+    return ORJSONResponse(roles, headers=validator_headers(etag))
 
 
 @router.get("", description="List all users")
-async def list_users(user: object = Depends(get_current_active_user)):
+async def list_users(user: object = Depends(get_current_active_user),
+                     limit: int = Query(1000, gt=0, le=1000),
+                     cursor: str = None):
     company_id = user.get("company_id")
-    associated_users = await users_collection.find({
-        "is_deleted": False
-    }).to_list(1000)
-    response = []
-
-    for user in associated_users:
-        logged_in_status = get_user_logged_in_status(user)
-        result = {
-            "id": user.get("_id"),
-            "name": user.get("name"),
-            "email": user.get("email"),
-            "role": user.get("role"),
-            "logged_in": logged_in_status,
-        }
-        response.append(result)
+    try:
+        find_query = cursor_query({"is_deleted": False}, cursor, "default",
+                                  "_id", 1)
+    except InvalidCursor as e:
+        return get_error_response(str(e), status.HTTP_400_BAD_REQUEST)
+    associated_users = await users_collection.find(find_query).sort(
+        "_id", 1).limit(limit).to_list(limit)
+    users_response = [user_list_response(x) for x in associated_users]
+    response = ORJSONResponse(users_response)
+    page_cursor = next_cursor(associated_users, limit, "default", "_id")
+    if page_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page_cursor
     return response
 
 
+@router.get("/export", description="Stream all users as NDJSON or CSV")
+async def export_users(user: object = Depends(get_current_active_user),
+                       export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format")):
+    if user.get('role') != UserRole.super_admin:
+        return get_error_response("Invalid operation.",
+                                  status.HTTP_401_UNAUTHORIZED)
+    cursor = users_collection.find({"is_deleted": False},
+                                   USER_LIST_PROJECTION).sort("_id", 1)
+    return export_response(cursor, user_list_response, export_format,
+                           USER_LIST_COLUMNS, settings.export_batch_size,
+                           "users")
+
+
 @router.get("/{user_id}", description="Get user")
 async def get_users(user_id: str,
                     user: object = Depends(get_current_active_user)):
-    user_result = await users_collection.find_one({
-        "_id": user_id,
-        "is_deleted": False
-    })
+    user_result = await user_loader.load(user_id)
     if user_result is None:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -91,7 +113,7 @@ async def get_users(user_id: str,
         "logged_in": logged_in_status
     }
 
-    return response
+    return ORJSONResponse(response)
 
 
 @router.post("", description="Add a user")
@@ -100,7 +122,7 @@ async def add_user(request: AddUserModel = Body(...),
     if user.get('role') != UserRole.super_admin:
         return get_error_response("Invalid operation.",
                                   status.HTTP_401_UNAUTHORIZED)
-    user_found: object = get_user(request.email)
+    user_found: object = await get_user(request.email)
     if not user_found:
         activation_code = str(ObjectId())
         timestamp = get_timestamp()
@@ -194,11 +216,8 @@ async def update_user(user_id: str,
     if user.get('role') != UserRole.super_admin:
         return get_error_response("Invalid operation.",
                                   status.HTTP_401_UNAUTHORIZED)
-    user_found: object = get_user(request.email)
-    invited_user = await users_collection.find_one({
-        "_id": user_id,
-        "is_deleted": False
-    })
+    user_found: object = await get_user(request.email)
+    invited_user = await user_loader.load(user_id)
 
     if invited_user:
         if invited_user.get("email") != request.email:
@@ -213,6 +232,7 @@ async def update_user(user_id: str,
         }
 
         await users_collection.update_one({"_id": user_id}, {"$set": update})
+        invalidate_principal(user_id, invited_user.get("email"))
         response = APIResponseModel(status=True, message="updated").dict()
         return JSONResponse(status_code=status.HTTP_200_OK, content=response)
     else:
@@ -227,10 +247,7 @@ async def delete_user(user_id: str,
     """
     Delete a user
     """
-    user_found = await users_collection.find_one({
-        "_id": user_id,
-        "is_deleted": False
-    })
+    user_found = await user_loader.load(user_id)
     if user.get('role') != UserRole.super_admin:
         return get_error_response("Invalid operation.",
                                   status.HTTP_401_UNAUTHORIZED)
@@ -241,6 +258,7 @@ async def delete_user(user_id: str,
                                   status.HTTP_401_UNAUTHORIZED)
     update = {"is_deleted": True}
     await users_collection.update_one({"_id": str(user_id)}, {"$set": update})
+    invalidate_principal(user_id, user_found.get("email"))
     response = APIResponseModel(status=True, message="Deleted").dict()
     return JSONResponse(status_code=status.HTTP_200_OK, content=response)
 
@@ -261,6 +279,26 @@ async def send_email_to_user(email_dict: object):
 """
 
 
+USER_LIST_COLUMNS = ("id", "name", "email", "role", "logged_in")
+USER_LIST_PROJECTION = {
+    "name": 1,
+    "email": 1,
+    "role": 1,
+    "is_invited": 1,
+    "status": 1
+}
+
+
+def user_list_response(user: dict) -> dict:
+    return {
+        "id": user.get("_id"),
+        "name": user.get("name"),
+        "email": user.get("email"),
+        "role": user.get("role"),
+        "logged_in": get_user_logged_in_status(user),
+    }
+
+
 def get_user_logged_in_status(user_result):
     if user_result.get("is_invited") and user_result.get(
             "status") == "pending":
@@ -0,0 +1,29 @@
+"""
+Object storage of restaurant media. The backend is chosen with the
+storage_backend setting: "local" (default), "s3" or "azure".
+"""
+from functools import lru_cache
+
+from app.config import settings
+from app.storage.base import PresignedUpload, Storage, StoredObject
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> Storage:
+    if settings.storage_backend == "s3":
+        from app.storage.s3 import S3Storage
+        return S3Storage(settings.s3_bucket,
+                         region=settings.s3_region,
+                         endpoint_url=settings.s3_endpoint_url,
+                         public_url=settings.media_public_url)
+    if settings.storage_backend == "azure":
+        from app.storage.azure import AzureStorage
+        return AzureStorage(settings.azure_storage_connection_string,
+                            settings.azure_media_container,
+                            public_url=settings.media_public_url)
+    if settings.storage_backend == "local":
+        from app.storage.local import LocalStorage
+        return LocalStorage(settings.local_media_root,
+                            settings.media_public_url or f"{settings.api_url}/static",
+                            settings.api_url)
+    raise ValueError(f"Unknown storage backend {settings.storage_backend}")
@@ -0,0 +1,66 @@
+"""
+Media stored in an Azure Blob Storage container.
+"""
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterator, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobSasPermissions, BlobServiceClient, ContentSettings, generate_blob_sas
+
+from app.storage.base import PresignedUpload, Storage, StoredObject
+
+
+class AzureStorage(Storage):
+
+    def __init__(self, connection_string: str, container: str,
+                 public_url: Optional[str] = None):
+        self.service = BlobServiceClient.from_connection_string(connection_string)
+        self.container = self.service.get_container_client(container)
+        self.public_url = (public_url or self.container.url).rstrip("/")
+
+    def put(self, key: str, source: BinaryIO, content_type: str):
+        self.container.upload_blob(key, source, overwrite=True,
+                                   content_settings=ContentSettings(content_type=content_type))
+
+    def head(self, key: str) -> Optional[StoredObject]:
+        try:
+            properties = self.container.get_blob_client(key).get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        return StoredObject(properties.size, properties.content_settings.content_type)
+
+    def read_head(self, key: str, length: int) -> bytes:
+        return self.container.download_blob(key, offset=0, length=length).readall()
+
+    def get(self, key: str) -> bytes:
+        return self.container.download_blob(key).readall()
+
+    def read_chunks(self, key: str, chunk_size: int) -> Iterator[bytes]:
+        # Chunked by the client's max_chunk_get_size rather than chunk_size.
+        yield from self.container.download_blob(key).chunks()
+
+    def delete(self, key: str):
+        try:
+            self.container.delete_blob(key)
+        except ResourceNotFoundError:
+            pass
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+    def presigned_put(self, key: str, content_type: str, max_bytes: int,
+                      expires_in: int) -> PresignedUpload:
+        # The size limit is checked when the upload is confirmed.
+        blob = self.container.get_blob_client(key)
+        sas = generate_blob_sas(
+            account_name=self.service.account_name,
+            container_name=self.container.container_name,
+            blob_name=key,
+            account_key=self.service.credential.account_key,
+            permission=BlobSasPermissions(create=True, write=True),
+            expiry=datetime.utcnow() + timedelta(seconds=expires_in),
+            content_type=content_type)
+        return PresignedUpload(f"{blob.url}?{sas}", "PUT", {
+            "Content-Type": content_type,
+            "x-ms-blob-type": "BlockBlob"
+        }, expires_in)
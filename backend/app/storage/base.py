@@ -0,0 +1,58 @@
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional
+
+
+class StoredObject(NamedTuple):
+    size: int
+    content_type: Optional[str] = None
+
+
+class PresignedUpload(NamedTuple):
+    url: str
+    method: str
+    # Headers the client must send with the upload.
+    headers: Dict[str, str]
+    expires_in: int
+
+
+class Storage(ABC):
+    """
+    Object storage of restaurant media, addressed by keys such as
+    "restaurants-photos/<id>.png". Every method blocks, call them off the
+    event loop (see app.utils.uploads).
+    """
+
+    @abstractmethod
+    def put(self, key: str, source: BinaryIO, content_type: str):
+        """Store the bytes read from source under key, replacing any object
+        with the same key. Exceptions raised by source.read abort the write."""
+
+    @abstractmethod
+    def head(self, key: str) -> Optional[StoredObject]:
+        """Size and content type of the object, None when there is none."""
+
+    @abstractmethod
+    def read_head(self, key: str, length: int) -> bytes:
+        """The first length bytes of the object."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """The whole object."""
+
+    @abstractmethod
+    def read_chunks(self, key: str, chunk_size: int) -> Iterator[bytes]:
+        """The object in chunks of about chunk_size bytes, never whole in
+        memory."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """Public URL of the object."""
+
+    @abstractmethod
+    def presigned_put(self, key: str, content_type: str, max_bytes: int,
+                      expires_in: int) -> PresignedUpload:
+        """Upload URL the client can PUT the object to directly."""
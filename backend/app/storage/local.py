@@ -0,0 +1,113 @@
+"""
+Media stored on the local filesystem, under local_media_root. Direct
+uploads go to the PUT /media/upload/{token} route of this API, the token
+is a short lived JWT naming the key, content type and size limit.
+"""
+import os
+import time
+from typing import BinaryIO, Iterator, Optional
+
+from jose import JWTError, jwt
+
+from app.config import settings
+from app.storage.base import PresignedUpload, Storage, StoredObject
+
+ALGORITHM = "HS256"
+CHUNK_SIZE = 1024 * 1024
+
+
+class InvalidUploadToken(Exception):
+    pass
+
+
+def _signing_key() -> str:
+    if settings.media_signing_key:
+        return settings.media_signing_key
+    from app.router.auth import SECRET_KEY
+    return SECRET_KEY
+
+
+def sign_upload(key: str, content_type: str, max_bytes: int,
+                expires_in: int) -> str:
+    return jwt.encode({
+        "key": key,
+        "content_type": content_type,
+        "max_bytes": max_bytes,
+        "exp": int(time.time()) + expires_in,
+    }, _signing_key(), algorithm=ALGORITHM)
+
+
+def verify_upload(token: str) -> dict:
+    """Claims of an upload token. Raises InvalidUploadToken."""
+    try:
+        return jwt.decode(token, _signing_key(), algorithms=[ALGORITHM])
+    except JWTError as e:
+        raise InvalidUploadToken(str(e))
+
+
+class LocalStorage(Storage):
+
+    def __init__(self, root: str, base_url: str, api_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.api_url = api_url.rstrip("/")
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid key {key}")
+        return path
+
+    def put(self, key: str, source: BinaryIO, content_type: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + ".part"
+        try:
+            with open(partial, "wb") as f:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    def head(self, key: str) -> Optional[StoredObject]:
+        try:
+            return StoredObject(os.path.getsize(self._path(key)))
+        except FileNotFoundError:
+            return None
+
+    def read_head(self, key: str, length: int) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read(length)
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def read_chunks(self, key: str, chunk_size: int) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def presigned_put(self, key: str, content_type: str, max_bytes: int,
+                      expires_in: int) -> PresignedUpload:
+        token = sign_upload(key, content_type, max_bytes, expires_in)
+        return PresignedUpload(f"{self.api_url}/media/upload/{token}", "PUT",
+                               {"Content-Type": content_type}, expires_in)
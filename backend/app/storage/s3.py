@@ -0,0 +1,76 @@
+"""
+Media stored in an S3 compatible bucket (AWS S3, MinIO, ...). Needs boto3,
+which the Lambda runtime provides.
+"""
+from typing import BinaryIO, Iterator, Optional
+
+from app.storage.base import PresignedUpload, Storage, StoredObject
+
+
+class S3Storage(Storage):
+
+    def __init__(self, bucket: str, region: Optional[str] = None,
+                 endpoint_url: Optional[str] = None,
+                 public_url: Optional[str] = None):
+        """
+        endpoint_url: set for S3 compatible services such as MinIO
+        public_url: base URL objects are served from, e.g. a CDN, defaults to
+        the bucket URL
+        """
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.client = boto3.client("s3", region_name=region,
+                                   endpoint_url=endpoint_url)
+        if public_url is None:
+            if endpoint_url is not None:
+                public_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+            else:
+                public_url = f"https://{bucket}.s3.amazonaws.com"
+        self.public_url = public_url.rstrip("/")
+
+    def put(self, key: str, source: BinaryIO, content_type: str):
+        # Multipart upload once source is larger than the transfer threshold.
+        self.client.upload_fileobj(source, self.bucket, key,
+                                   ExtraArgs={"ContentType": content_type})
+
+    def head(self, key: str) -> Optional[StoredObject]:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StoredObject(response["ContentLength"], response.get("ContentType"))
+
+    def read_head(self, key: str, length: int) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=key,
+                                          Range=f"bytes=0-{length - 1}")
+        return response["Body"].read()
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def read_chunks(self, key: str, chunk_size: int) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+    def presigned_put(self, key: str, content_type: str, max_bytes: int,
+                      expires_in: int) -> PresignedUpload:
+        # The size limit is checked when the upload is confirmed.
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires_in)
+        return PresignedUpload(url, "PUT", {"Content-Type": content_type}, expires_in)
@@ -0,0 +1,78 @@
+"""
+HTTP validators (ETag / Last-Modified) and conditional GET handling.
+Timestamps are the millisecond timestamps stored on documents, see
+app.utils.utils.get_timestamp.
+"""
+import hashlib
+import json
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def make_etag(*parts) -> str:
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()}"'
+
+
+def document_version(document: dict) -> Optional[int]:
+    return document.get("last_updated_ts") or document.get("created_ts")
+
+
+def rows_etag(key, rows: Iterable[dict]) -> str:
+    """ETag of a list of documents, read from their _id and timestamps only.
+    key identifies the query the rows answer. Lists get no Last-Modified,
+    the newest row does not change when a row leaves the list."""
+    return make_etag(key, [(str(x.get("_id")), document_version(x)) for x in rows])
+
+
+def http_date(timestamp: int) -> str:
+    return formatdate(timestamp / 1000, usegmt=True)
+
+
+def _strip_weak(etag: str) -> str:
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(request: Request, etag: str,
+                    last_modified: Optional[int] = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        return _strip_weak(etag) in {
+            _strip_weak(x) for x in if_none_match.split(",")
+        }
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return last_modified // 1000 <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[int] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(request: Request, etag: str,
+                          last_modified: Optional[int] = None
+                          ) -> Optional[Response]:
+    """304 response when the client copy is still current, None otherwise."""
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304,
+                        headers=validator_headers(etag, last_modified))
+    return None
+
+
+def has_validators(request: Request) -> bool:
+    return "if-none-match" in request.headers or \
+        "if-modified-since" in request.headers
@@ -0,0 +1,101 @@
+"""
+Thumbnail and medium size derivatives of restaurant images. They are
+rendered after the upload response, on the "derivatives" thread pool, and
+recorded on the image entry as "thumbnail" and "medium" URLs. Until then,
+or when rendering fails, responses fall back to the original image.
+"""
+import asyncio
+import io
+import logging
+from typing import Dict, Set
+
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.core.executor import BoundedExecutor, ExecutorSaturated
+from app.db.base import restaurants_collection
+from app.storage import get_storage
+from app.utils.response_cache import invalidate_responses, restaurant_tags
+from app.utils.utils import get_timestamp
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box
+DERIVATIVES = {
+    "thumbnail": (320, 320),
+    "medium": (1024, 1024),
+}
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpg": ("JPEG", "image/jpeg"),
+}
+# Refuse to decode images larger than this, about 2x a 48 MP photo.
+Image.MAX_IMAGE_PIXELS = 100_000_000
+
+derivative_renderer = BoundedExecutor("derivatives",
+                                      max_workers=settings.derivative_workers,
+                                      max_queue=settings.derivative_max_queue)
+# Running jobs, referenced so they are not garbage collected.
+_jobs: Set[asyncio.Task] = set()
+
+
+def derivative_key(key: str, name: str, extension: str) -> str:
+    return f"{key.rsplit('.', 1)[0]}.{name}.{extension}"
+
+
+def _render(key: str, extension: str, quality: int) -> Dict[str, str]:
+    """Render and store the derivatives of the image stored under key,
+    returns their keys."""
+    storage = get_storage()
+    image_format, content_type = FORMATS[extension]
+    keys = {name: derivative_key(key, name, extension) for name in DERIVATIVES}
+    # Keys follow the content of the original, existing ones are current.
+    if all(storage.head(x) is not None for x in keys.values()):
+        return keys
+    with Image.open(io.BytesIO(storage.get(key))) as original:
+        largest = max(max(x) for x in DERIVATIVES.values())
+        # Lets JPEG decode at a reduced scale.
+        original.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        if image_format == "JPEG" or image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        for name, size in DERIVATIVES.items():
+            derivative = image.copy()
+            derivative.thumbnail(size, Image.LANCZOS)
+            buffer = io.BytesIO()
+            derivative.save(buffer, image_format, quality=quality)
+            buffer.seek(0)
+            storage.put(keys[name], buffer, content_type)
+    return keys
+
+
+async def generate_derivatives(restaurant_id: str, image_id: str, key: str):
+    try:
+        keys = await derivative_renderer.run(_render, key,
+                                             settings.derivative_format,
+                                             settings.derivative_quality)
+    except ExecutorSaturated:
+        logger.warning("derivatives of %s skipped, renderer saturated", key)
+        return
+    except Exception:
+        logger.exception("derivatives of %s failed", key)
+        return
+    storage = get_storage()
+    update = {f"image.$.{name}": storage.url(x) for name, x in keys.items()}
+    # Bumped so the validators of the restaurant change.
+    update["last_updated_ts"] = get_timestamp()
+    await restaurants_collection.update_one(
+        {"_id": restaurant_id, "image.id": image_id}, {"$set": update})
+    await invalidate_responses(*restaurant_tags(restaurant_id))
+
+
+def schedule_derivatives(restaurant_id: str, image: dict):
+    """Render the derivatives of an image entry in the background. Images
+    without a storage key (stored before media keys were recorded) are
+    skipped."""
+    if not image.get("key"):
+        return
+    job = asyncio.get_running_loop().create_task(
+        generate_derivatives(restaurant_id, image["id"], image["key"]))
+    _jobs.add(job)
+    job.add_done_callback(_jobs.discard)
@@ -0,0 +1,77 @@
+"""
+Streaming exports. Rows are read from a motor cursor batch by batch and
+written out as NDJSON or CSV, memory use does not grow with the export.
+"""
+import csv
+import io
+from enum import Enum
+from typing import AsyncIterator, Callable, Sequence
+
+from starlette.responses import StreamingResponse
+
+from app.utils.responses import dumps
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv; charset=utf-8",
+}
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        return dumps(value).decode()
+    return value
+
+
+async def export_rows(cursor, convert: Callable[[dict], dict],
+                      export_format: ExportFormat, columns: Sequence[str],
+                      batch_size: int) -> AsyncIterator[bytes]:
+    """
+    Encoded rows of cursor, one chunk per batch_size documents. convert
+    turns a document into a row keyed by columns.
+    """
+    if export_format == ExportFormat.csv:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+    else:
+        chunk = bytearray()
+    count = 0
+    async for document in cursor.batch_size(batch_size):
+        row = convert(document)
+        if export_format == ExportFormat.csv:
+            writer.writerow([_csv_value(row.get(x)) for x in columns])
+        else:
+            chunk += dumps(row)
+            chunk += b"\n"
+        count += 1
+        if count % batch_size == 0:
+            if export_format == ExportFormat.csv:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                yield bytes(chunk)
+                chunk.clear()
+    if export_format == ExportFormat.csv:
+        yield buffer.getvalue().encode()
+    elif chunk:
+        yield bytes(chunk)
+
+
+def export_response(cursor, convert: Callable[[dict], dict],
+                    export_format: ExportFormat, columns: Sequence[str],
+                    batch_size: int, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        export_rows(cursor, convert, export_format, columns, batch_size),
+        media_type=MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition":
+            f'attachment; filename="{filename}.{export_format.value}"'
+        })
@@ -0,0 +1,66 @@
+import base64
+import json
+from typing import List, Optional, Tuple
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort: str, value, _id) -> str:
+    raw = json.dumps([sort, value, _id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, object]:
+    """Sort key value and _id of the last row of the previous page. The cursor
+    must have been issued for the same sort order."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, _id = json.loads(
+            base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if cursor_sort != sort:
+        raise InvalidCursor("Cursor was issued for another sort order")
+    return value, _id
+
+
+def sort_spec(field: str, direction: int) -> List[Tuple[str, int]]:
+    if field == "_id":
+        return [("_id", direction)]
+    return [(field, direction), ("_id", direction)]
+
+
+def keyset_query(find_query: dict, field: str, direction: int, value,
+                 _id) -> dict:
+    """find_query narrowed to the rows after (value, _id) in sort order."""
+    op = "$gt" if direction > 0 else "$lt"
+    if field == "_id":
+        after = {"_id": {op: _id}}
+    else:
+        after = {
+            "$or": [{field: {op: value}}, {field: value, "_id": {op: _id}}]
+        }
+    if set(after) & set(find_query):
+        return {"$and": [find_query, after]}
+    return {**find_query, **after}
+
+
+def cursor_query(find_query: dict, cursor: Optional[str], sort: str,
+                 field: str, direction: int) -> dict:
+    if cursor is None:
+        return find_query
+    value, _id = decode_cursor(cursor, sort)
+    return keyset_query(find_query, field, direction, value, _id)
+
+
+def next_cursor(rows: list, limit: int, sort: str,
+                field: str) -> Optional[str]:
+    """Cursor for the page after rows, None once a short page is returned."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(sort, last.get(field), last.get("_id"))
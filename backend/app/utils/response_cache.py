@@ -0,0 +1,236 @@
+"""
+Response cache of the anonymous, read only customer routes. Responses are
+cached under their route and sorted query parameters, in an in-process LRU
+and, when response_cache_redis_url is set, in Redis (or anything speaking
+its protocol) shared by every instance.
+
+Entries are invalidated by tag. Every cached route declares tags, each tag
+has a version and the versions of its tags are part of the cache key, so
+invalidate_responses() bumping a version makes the entries of that tag
+unreachable, they expire from the tiers on their own. With Redis the
+versions live there and writes made on one instance invalidate the entries
+of all of them, without it they are per instance and entries of other
+instances live until response_cache_ttl_seconds.
+"""
+import functools
+import hashlib
+import inspect
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple, Union
+
+import orjson
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from app.config import settings
+from app.utils.cache import TTLCache
+from app.utils.conditional import is_not_modified
+
+logger = logging.getLogger(__name__)
+
+RESTAURANTS_TAG = "restaurants"
+REFERENCE_TAG = "reference"
+CACHE_STATUS_HEADER = "X-Cache"
+# Response headers stored with the body.
+CACHED_HEADERS = ("content-type", "etag", "last-modified", "cache-control", "x-next-cursor")
+
+
+def restaurant_tag(restaurant_id: str) -> str:
+    return f"restaurant:{restaurant_id}"
+
+
+def restaurant_tags(restaurant_id: str) -> Tuple[str, str]:
+    """Tags of the responses showing a restaurant: its own and the
+    listings."""
+    return RESTAURANTS_TAG, restaurant_tag(restaurant_id)
+
+
+class CachedResponse(NamedTuple):
+    status_code: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def dumps(self) -> bytes:
+        meta = orjson.dumps({"status_code": self.status_code, "headers": self.headers})
+        return meta + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        meta, body = data.split(b"\n", 1)
+        meta = orjson.loads(meta)
+        return cls(meta["status_code"], meta["headers"], body)
+
+    def last_modified(self) -> Optional[int]:
+        value = self.headers.get("last-modified")
+        if value is None:
+            return None
+        try:
+            return int(parsedate_to_datetime(value).timestamp() * 1000)
+        except (TypeError, ValueError):
+            return None
+
+    def response(self, request: Request) -> Response:
+        etag = self.headers.get("etag")
+        if etag is not None and is_not_modified(request, etag, self.last_modified()):
+            headers = {k: v for k, v in self.headers.items() if k != "content-type"}
+            return Response(status_code=304, headers={**headers, CACHE_STATUS_HEADER: "hit"})
+        return Response(self.body, status_code=self.status_code,
+                        headers={**self.headers, CACHE_STATUS_HEADER: "hit"})
+
+
+class RedisTier:
+    """Entries and tag versions in Redis. Needs the redis package, or pass
+    any client with the redis.asyncio interface."""
+
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = "response-cache:"):
+        if client is None:
+            import redis.asyncio
+
+            client = redis.asyncio.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(self.prefix + key, value, ex=ttl)
+
+    async def versions(self, tags: Tuple[str, ...]) -> Tuple[int, ...]:
+        values = await self.client.mget([f"{self.prefix}tag:{x}" for x in tags])
+        return tuple(int(x or 0) for x in values)
+
+    async def bump(self, tags: Iterable[str]):
+        pipeline = self.client.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(f"{self.prefix}tag:{tag}")
+        await pipeline.execute()
+
+
+class ResponseCache:
+    """
+    LRU tier in front of an optional shared tier. Failures of the shared
+    tier are logged and answered as misses, the routes then read Mongo.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, shared: Optional[RedisTier] = None):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared = shared
+        self._versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _versions_of(self, tags: Tuple[str, ...]) -> Optional[Tuple[int, ...]]:
+        if self.shared is not None:
+            try:
+                return await self.shared.versions(tags)
+            except Exception:
+                logger.warning("response cache versions unavailable", exc_info=True)
+                return None
+        return tuple(self._versions.get(x, 0) for x in tags)
+
+    async def key(self, path: str, query: Iterable[Tuple[str, str]],
+                  tags: Tuple[str, ...]) -> Optional[str]:
+        """Cache key of a response, None when it cannot be cached now."""
+        versions = await self._versions_of(tags)
+        if versions is None:
+            return None
+        raw = orjson.dumps([path, sorted(query), list(zip(tags, versions))])
+        return hashlib.sha1(raw).hexdigest()
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            try:
+                data = await self.shared.get(key)
+            except Exception:
+                logger.warning("response cache get failed", exc_info=True)
+                data = None
+            if data is not None:
+                entry = CachedResponse.loads(data)
+                self.local.set(key, entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def set(self, key: str, entry: CachedResponse):
+        self.local.set(key, entry)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, entry.dumps(), self.ttl)
+            except Exception:
+                logger.warning("response cache set failed", exc_info=True)
+
+    async def invalidate(self, *tags: str):
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+        if self.shared is not None:
+            try:
+                await self.shared.bump(tags)
+            except Exception:
+                # Entries of other instances live until they expire.
+                logger.error("response cache invalidation of %s failed", tags, exc_info=True)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.local)}
+
+
+response_cache = ResponseCache(
+    maxsize=settings.response_cache_size,
+    ttl=settings.response_cache_ttl_seconds,
+    shared=RedisTier(settings.response_cache_redis_url) if settings.response_cache_redis_url else None)
+
+
+async def invalidate_responses(*tags: str):
+    await response_cache.invalidate(*tags)
+
+
+async def response_versions(*tags: str) -> Optional[Tuple[int, ...]]:
+    """Current versions of the tags, None when the shared tier is
+    unavailable."""
+    return await response_cache._versions_of(tags)
+
+
+def cached_response(*tags: Union[str, Callable[..., str]]):
+    """
+    Cache the successful responses of a GET route. Tags are strings, or
+    functions called with the path parameters, e.g. restaurant_tag, so the
+    route and the invalidation build them alike. The route has to return a
+    Response, other results are passed through uncached.
+    """
+
+    def decorator(endpoint):
+        signature = inspect.signature(endpoint)
+        takes_request = "request" in signature.parameters
+        parameters = list(signature.parameters.values())
+        if not takes_request:
+            parameters.append(inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY,
+                                                annotation=Request))
+
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            request = kwargs["request"] if takes_request else kwargs.pop("request")
+            if not settings.response_cache_enabled:
+                return await endpoint(**kwargs)
+            key = await response_cache.key(
+                request.url.path, request.query_params.multi_items(),
+                tuple(x(**request.path_params) if callable(x) else x for x in tags))
+            entry = await response_cache.get(key) if key is not None else None
+            if entry is not None:
+                return entry.response(request)
+            response = await endpoint(**kwargs)
+            if key is not None and isinstance(response, Response) \
+                    and not isinstance(response, StreamingResponse) and response.status_code == 200:
+                headers = {k: v for k, v in response.headers.items() if k in CACHED_HEADERS}
+                await response_cache.set(key, CachedResponse(200, headers, response.body))
+                response.headers[CACHE_STATUS_HEADER] = "miss"
+            return response
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
+
+    return decorator
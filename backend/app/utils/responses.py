@@ -0,0 +1,48 @@
+from typing import Any, Dict, NamedTuple, Optional
+
+import orjson
+from bson import ObjectId
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from app.utils.conditional import not_modified_response, validator_headers
+
+
+def _default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    raise TypeError(f"Type is not JSON serializable: {type(o).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content,
+                        default=_default,
+                        option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson. Return it directly from a handler to
+    skip jsonable_encoder, the content must already be plain data.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RenderedResponse(NamedTuple):
+    """
+    A JSON body rendered once with its validators, answered to every
+    request sharing it (see app.core.singleflight).
+    """
+    body: bytes
+    etag: str
+    last_modified: Optional[int] = None
+    headers: Dict[str, str] = {}
+
+    def response(self, request: Request) -> Response:
+        not_modified = not_modified_response(request, self.etag, self.last_modified)
+        if not_modified is not None:
+            return not_modified
+        return Response(self.body, media_type="application/json",
+                        headers={**validator_headers(self.etag, self.last_modified), **self.headers})
@@ -0,0 +1,441 @@
+"""
+In-process typeahead index over the names, districts and circles of the
+restaurants. Query words match the indexed words they are a prefix of, found
+by bisecting a sorted vocabulary, and, when prefixes find too few
+restaurants, the words sharing enough trigrams with them, so typos still
+find something.
+
+Restaurants are ranked before anything is cut: when the restaurants matching
+every query word are few they are all scored, otherwise the postings of the
+most selective query word are scanned best weighted first, until no
+restaurant left can beat the ones found. Restaurants named like the query are
+always scored. Work per query is bounded by MAX_COMPLETIONS, MAX_SCORED and
+MAX_SCANNED whatever the size of the index.
+
+The index is only used from the event loop, app.db.suggest builds it and
+keeps it current.
+"""
+import bisect
+import heapq
+import re
+import unicodedata
+from collections import Counter
+from operator import itemgetter
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# Indexed fields and the weight of their words, words of the name are
+# scored first.
+FIELD_WEIGHTS = {"name": 1.0, "district": 0.6, "circle": 0.6}
+# Weight of the words of a field after the first.
+OTHER_WORD_WEIGHT = 0.9
+# Bonus of the restaurants whose name starts with the query.
+NAME_PREFIX_BONUS = 0.1
+# Words matched per query word.
+MAX_COMPLETIONS = 32
+# Restaurants matching every query word are all scored when there are at
+# most this many, more are scanned, and at most MAX_SCANNED looked at.
+MAX_SCORED = 1024
+MAX_SCANNED = 2048
+# Scanned for multi word queries when at least this share of the restaurants
+# of their most selective word are expected to match the other words, their
+# restaurants are intersected as sets otherwise.
+MIN_SCAN_HIT_RATE = 0.02
+# Query words matching at most this many restaurants are matched as sets.
+MAX_FILTER_SIZE = 20_000
+# Completions of prefixes up to this length are cached, their vocabulary
+# ranges are the largest.
+CACHED_PREFIX_LENGTH = 3
+# Fuzzy matches need this trigram similarity (Dice) and weigh less than
+# prefix matches.
+MIN_SIMILARITY = 0.45
+FUZZY_WEIGHT = 0.8
+FUZZY_MIN_LENGTH = 3
+
+_WORD = re.compile(r"[^\W_]+")
+# Only the first word of the name weighs _NAME_WEIGHT, the others at most
+# _OTHER_WEIGHT.
+_NAME_WEIGHT = FIELD_WEIGHTS["name"]
+_OTHER_WEIGHT = max([FIELD_WEIGHTS["name"] * OTHER_WORD_WEIGHT]
+                    + [x for field, x in FIELD_WEIGHTS.items() if field != "name"])
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lower case text without accents."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(x for x in decomposed if not unicodedata.combining(x)).casefold()
+
+
+def words(text: Optional[str]) -> List[str]:
+    return _WORD.findall(normalize(text))
+
+
+def trigrams(word: str) -> frozenset:
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _best_match(matches: Dict[str, float], weights: Dict[str, float]) -> float:
+    """Best score of the matched words found in weights, looked up from the
+    smaller of the two."""
+    if len(matches) > len(weights):
+        matches, weights = weights, matches
+    best = 0
+    for word, score in matches.items():
+        weight = weights.get(word)
+        if weight is not None and score * weight > best:
+            best = score * weight
+    return best
+
+
+class Suggestion(NamedTuple):
+    id: str
+    name: str
+    district: Optional[str]
+    circle: Optional[str]
+    score: float
+
+    def response(self) -> dict:
+        return {**self._asdict(), "score": round(self.score, 4)}
+
+
+class _Entry(NamedTuple):
+    name: str
+    district: Optional[str]
+    circle: Optional[str]
+    normalized_name: str
+    # Words of the name, and its first two words, joined by spaces.
+    name_words: str
+    head: str
+    # word -> weight
+    words: Dict[str, float]
+
+
+class SuggestIndex:
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        # word -> {weight: restaurants having the word with that weight}
+        self._postings: Dict[str, Dict[float, set]] = {}
+        self._vocabulary: List[str] = []
+        self._trigrams: Dict[str, set] = {}
+        self._completions: Dict[str, List[str]] = {}
+        # word -> restaurants having it, built for the words of multi word
+        # queries
+        self._sets: Dict[str, frozenset] = {}
+        # name words -> restaurants with that name
+        self._names: Dict[str, set] = {}
+        # first two name words -> restaurants whose name starts with them
+        self._heads: Dict[str, set] = {}
+        # restaurant id -> (name length, name), the order of equal scores
+        self._order: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, restaurant_id: str) -> bool:
+        return restaurant_id in self._entries
+
+    def add(self, restaurant_id: str, name: str, district: Optional[str] = None,
+            circle: Optional[str] = None):
+        """Index a restaurant, replacing what was indexed for it."""
+        self.remove(restaurant_id)
+        weights = {}
+        name_words = words(name)
+        for field, field_words in (("name", name_words), ("district", words(district)),
+                                   ("circle", words(circle))):
+            for position, word in enumerate(field_words):
+                # The first word of a field ranks above the others.
+                weight = FIELD_WEIGHTS[field] * (1.0 if position == 0 else OTHER_WORD_WEIGHT)
+                if weight > weights.get(word, 0):
+                    weights[word] = weight
+        head = " ".join(name_words[:2])
+        name_words = " ".join(name_words)
+        self._entries[restaurant_id] = _Entry(name or "", district, circle, normalize(name), name_words, head,
+                                              weights)
+        self._names.setdefault(name_words, set()).add(restaurant_id)
+        self._heads.setdefault(head, set()).add(restaurant_id)
+        self._order[restaurant_id] = (len(name or ""), name or "")
+        for word, weight in weights.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                bisect.insort(self._vocabulary, word)
+                for gram in trigrams(word):
+                    self._trigrams.setdefault(gram, set()).add(word)
+            postings.setdefault(weight, set()).add(restaurant_id)
+            self._forget_completions(word)
+
+    def remove(self, restaurant_id: str):
+        entry = self._entries.pop(restaurant_id, None)
+        if entry is None:
+            return
+        del self._order[restaurant_id]
+        for names, key in ((self._names, entry.name_words), (self._heads, entry.head)):
+            named = names[key]
+            named.discard(restaurant_id)
+            if not named:
+                del names[key]
+        for word, weight in entry.words.items():
+            postings = self._postings[word]
+            restaurants = postings[weight]
+            restaurants.discard(restaurant_id)
+            if not restaurants:
+                del postings[weight]
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+                for gram in trigrams(word):
+                    grams = self._trigrams[gram]
+                    grams.discard(word)
+                    if not grams:
+                        del self._trigrams[gram]
+            self._forget_completions(word)
+
+    def _forget_completions(self, word: str):
+        self._sets.pop(word, None)
+        for length in range(1, CACHED_PREFIX_LENGTH + 1):
+            self._completions.pop(word[:length], None)
+
+    def _count(self, word: str) -> int:
+        return sum(len(x) for x in self._postings[word].values())
+
+    def completions(self, prefix: str) -> List[str]:
+        """The indexed words starting with prefix, the word itself first,
+        then the most frequent."""
+        cached = self._completions.get(prefix)
+        if cached is not None:
+            return cached
+        matches = []
+        vocabulary = self._vocabulary
+        for i in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            matches.append(vocabulary[i])
+        matches = heapq.nsmallest(
+            MAX_COMPLETIONS, matches,
+            key=lambda x: (x != prefix, -self._count(x), len(x), x))
+        if len(prefix) <= CACHED_PREFIX_LENGTH:
+            self._completions[prefix] = matches
+        return matches
+
+    def similar(self, word: str) -> Dict[str, float]:
+        """Indexed words sharing at least MIN_SIMILARITY of their trigrams
+        with word -> similarity."""
+        grams = trigrams(word)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._trigrams.get(gram, ()))
+        similar = {}
+        for other, count in counts.items():
+            if count < 2:
+                continue
+            similarity = 2 * count / (len(grams) + len(trigrams(other)))
+            if similarity >= MIN_SIMILARITY:
+                similar[other] = similarity
+        return dict(heapq.nlargest(MAX_COMPLETIONS, similar.items(), key=lambda x: x[1]))
+
+    def _matches(self, query_word: str, enough: int) -> Dict[str, float]:
+        """Indexed words matching a query word -> score of the match."""
+        matches = {}
+        found = 0
+        for word in self.completions(query_word):
+            matches[word] = 1.0 if word == query_word else 0.6 + 0.4 * len(query_word) / len(word)
+            found += self._count(word)
+        if found < enough and len(query_word) >= FUZZY_MIN_LENGTH:
+            for word, similarity in self.similar(query_word).items():
+                matches.setdefault(word, similarity * FUZZY_WEIGHT)
+        return matches
+
+    def _size(self, matches: Dict[str, float]) -> int:
+        return sum(self._count(x) for x in matches)
+
+    def _restaurants(self, matches: Dict[str, float], among: Optional[set] = None) -> set:
+        """The restaurants having one of the matched words, among the given
+        ones."""
+        if among is None and len(matches) == 1:
+            word, = matches
+            restaurants = self._sets.get(word)
+            if restaurants is None:
+                restaurants = self._sets[word] = frozenset().union(*self._postings[word].values())
+            return restaurants
+        restaurants = set()
+        for word in matches:
+            for posted in self._postings[word].values():
+                restaurants.update(posted if among is None else among.intersection(posted))
+        return restaurants
+
+    def _groups(self, matches: Dict[str, float]) -> list:
+        """(match score, weight, restaurants) of the matched words, best
+        first: the restaurants of a group score match score times weight."""
+        groups = [(match * weight, weight, posted)
+                  for word, match in matches.items()
+                  for weight, posted in self._postings[word].items()]
+        groups.sort(key=itemgetter(0), reverse=True)
+        return groups
+
+    def _named(self, query_words: List[str], prefix: str) -> Iterable[str]:
+        """The restaurants named like the query: the names that are the
+        query with its last word completed, then with more query words,
+        every name starting with the query."""
+        head = " ".join(query_words[:-1])
+        completions = self.completions(query_words[-1])
+        for word in completions:
+            yield from self._names.get(f"{head} {word}" if head else word, ())
+        if len(query_words) == 1:
+            return
+        seconds = completions if len(query_words) == 2 else query_words[1:2]
+        entries = self._entries
+        for word in seconds:
+            for restaurant_id in self._heads.get(f"{query_words[0]} {word}", ()):
+                if entries[restaurant_id].normalized_name.startswith(prefix):
+                    yield restaurant_id
+
+    def _score(self, restaurant_id: str, matches: List[Dict[str, float]], prefix: str) -> float:
+        """Score of a restaurant, 0 when a query word does not match it."""
+        entry = self._entries[restaurant_id]
+        total = 0
+        for word_matches in matches:
+            best = _best_match(word_matches, entry.words)
+            if not best:
+                return 0
+            total += best
+        score = total / len(matches)
+        if entry.normalized_name.startswith(prefix):
+            score += NAME_PREFIX_BONUS
+        return score
+
+    def _score_all(self, restaurants: Iterable[str], matches: List[Dict[str, float]],
+                   prefix: str) -> Dict[str, float]:
+        """Scores of the restaurants matching every query word, from set
+        intersections with the groups of each query word, best first."""
+        totals = dict.fromkeys(restaurants, 0)
+        for word_matches in matches:
+            remaining = set(totals)
+            for score, _, posted in self._groups(word_matches):
+                found = remaining.intersection(posted)
+                if found:
+                    remaining -= found
+                    for restaurant_id in found:
+                        totals[restaurant_id] += score
+                    if not remaining:
+                        break
+            for restaurant_id in remaining:
+                del totals[restaurant_id]
+        entries = self._entries
+        count = len(matches)
+        return {x: total / count + (NAME_PREFIX_BONUS if entries[x].normalized_name.startswith(prefix) else 0)
+                for x, total in totals.items()}
+
+    def _scan(self, query_words: List[str], matches: List[Dict[str, float]], driver: int,
+              prefix: str, limit: int):
+        """
+        (scores, complete) of the restaurants named like the query and of
+        the groups of the driver query word, scanned best first. Complete
+        once the limit best scores found are at least the best score a
+        restaurant left could have, or every group was scanned, incomplete
+        when MAX_SCANNED restaurants were looked at before.
+        """
+        scores = {}
+        best = []
+        seen = set()
+
+        def consider(restaurant_id: str):
+            seen.add(restaurant_id)
+            score = self._score(restaurant_id, matches, prefix)
+            if score:
+                scores[restaurant_id] = score
+                if len(best) < limit:
+                    heapq.heappush(best, score)
+                elif score > best[0]:
+                    heapq.heapreplace(best, score)
+
+        # The best each query word can add, from the weights of its words,
+        # and the best it can add off the first word of the name, which
+        # only one of them matches.
+        weights = []
+        for word_matches in matches:
+            weights.append((max(match * max(self._postings[word]) for word, match in word_matches.items()),
+                            max(match * min(max(self._postings[word]), _OTHER_WEIGHT)
+                                for word, match in word_matches.items())))
+        others = sum(x[1] for i, x in enumerate(weights) if i != driver)
+        other_first = max((x[0] - x[1] for i, x in enumerate(weights) if i != driver), default=0)
+        top = (sum(x[1] for x in weights) + max(x[0] - x[1] for x in weights)) / len(matches) + NAME_PREFIX_BONUS
+        for restaurant_id in self._named(query_words, prefix):
+            if restaurant_id in seen:
+                continue
+            if len(seen) >= MAX_SCANNED:
+                return scores, False
+            consider(restaurant_id)
+            if len(best) == limit and best[0] >= top:
+                return scores, True
+        for match, weight, posted in self._groups(matches[driver]):
+            first = weight == _NAME_WEIGHT
+            bound = (match + others + (0 if first else other_first)) / len(matches)
+            # Multi word names starting with the query were all named
+            # above, single words start names at the first word of the name.
+            if first and len(matches) == 1:
+                bound += NAME_PREFIX_BONUS
+            if len(best) == limit and best[0] >= bound:
+                return scores, True
+            for restaurant_id in posted:
+                if restaurant_id in seen:
+                    continue
+                if len(seen) >= MAX_SCANNED:
+                    return scores, False
+                consider(restaurant_id)
+                if len(best) == limit and best[0] >= bound:
+                    return scores, True
+        return scores, True
+
+    def suggest(self, query: str, limit: int = 10) -> List[Suggestion]:
+        """
+        The limit best matching restaurants. Every word of the query has to
+        match a word of the restaurant, the score is the mean of their match
+        scores times the weight of the matched words, restaurants whose name
+        starts with the query get a bonus.
+        """
+        query_words = list(dict.fromkeys(words(query)))
+        if not query_words or limit <= 0:
+            return []
+        matches = [self._matches(x, limit) for x in query_words]
+        if not all(matches):
+            return []
+        prefix = normalize(query).strip()
+        sizes = [self._size(x) for x in matches]
+        order = sorted(range(len(matches)), key=sizes.__getitem__)
+        # Share of the restaurants of the most selective query word
+        # expected to match the others.
+        hit_rate = 1
+        for i in order[1:]:
+            hit_rate *= min(sizes[i] / len(self._entries), 1)
+        restaurants = None
+        if sizes[order[0]] <= MAX_SCORED or (hit_rate < MIN_SCAN_HIT_RATE and sizes[order[0]] <= MAX_FILTER_SIZE):
+            restaurants = self._matching(matches, order, sizes)
+        if restaurants is not None and len(restaurants) <= MAX_SCORED:
+            scores = self._score_all(restaurants, matches, prefix)
+        else:
+            scores, complete = self._scan(query_words, matches, order[0], prefix, limit)
+            if not complete and restaurants is None and len(matches) > 1 and sizes[order[0]] <= MAX_FILTER_SIZE:
+                # Fewer restaurants than expected match every query word,
+                # find them as sets.
+                restaurants = self._matching(matches, order, sizes)
+                if len(restaurants) <= MAX_SCORED:
+                    scores.update(self._score_all(restaurants, matches, prefix))
+        # Best first, shortest name first among equal scores.
+        ranked = sorted(scores, key=self._order.__getitem__)
+        ranked.sort(key=scores.__getitem__, reverse=True)
+        suggestions = []
+        for restaurant_id in ranked[:limit]:
+            entry = self._entries[restaurant_id]
+            suggestions.append(Suggestion(restaurant_id, entry.name, entry.district, entry.circle,
+                                          scores[restaurant_id]))
+        return suggestions
+
+    def _matching(self, matches: List[Dict[str, float]], order: List[int], sizes: List[int]) -> set:
+        """The restaurants matching every query word, but the very frequent
+        ones, intersected as sets from the smallest."""
+        restaurants = self._restaurants(matches[order[0]])
+        for i in order[1:]:
+            if sizes[i] <= MAX_FILTER_SIZE:
+                restaurants = self._restaurants(matches[i], restaurants)
+        return restaurants
@@ -0,0 +1,111 @@
+"""
+Row by row readers of uploaded CSV and XLSX sheets. Both are generators
+reading the file lazily, run them off the event loop. Files that cannot be
+read at all raise UnsupportedSheet, files that break after some rows raise
+SheetReadError once the rows before were read.
+"""
+import codecs
+import csv
+import zipfile
+from itertools import islice
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+
+class UnsupportedSheet(ValueError):
+    pass
+
+
+class SheetReadError(ValueError):
+    """The sheet cannot be read from line on."""
+
+    def __init__(self, message: str, line: int):
+        super().__init__(f"{message} Rows from line {line} on were not read.")
+        self.line = line
+
+
+def _column(name) -> str:
+    return str(name or "").strip().lower().replace(" ", "_")
+
+
+def _cell(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _rows(header, values) -> Iterator[Tuple[int, Dict]]:
+    columns = [_column(x) for x in header]
+    # Line 1 is the header.
+    for line, row in enumerate(values, start=2):
+        row = {k: _cell(v) for k, v in zip(columns, row) if k}
+        row = {k: v for k, v in row.items() if v is not None}
+        if row:
+            yield line, row
+
+
+def _csv_error(error: Exception) -> str:
+    if isinstance(error, UnicodeDecodeError):
+        return "CSV files must be UTF-8 encoded."
+    return f"Invalid CSV: {error}."
+
+
+def read_csv(file: BinaryIO) -> Iterator[Tuple[int, Dict]]:
+    reader = csv.reader(codecs.getreader("utf-8-sig")(file))
+    try:
+        header = next(reader, None)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise UnsupportedSheet(_csv_error(e))
+    if header is None:
+        return
+    try:
+        yield from _rows(header, reader)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise SheetReadError(_csv_error(e), reader.line_num + 1)
+
+
+def read_xlsx(file: BinaryIO) -> Iterator[Tuple[int, Dict]]:
+    """Rows of the first sheet, the workbook is opened in read-only mode."""
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError):
+        raise UnsupportedSheet("The file is not a valid .xlsx workbook.")
+    line = 1
+    try:
+        values = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(values, None)
+        if header is None:
+            return
+        for line, row in _rows(header, values):
+            yield line, row
+    except (zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+        if line == 1:
+            raise UnsupportedSheet("The file is not a valid .xlsx workbook.")
+        raise SheetReadError(f"Invalid .xlsx workbook: {e}.", line + 1)
+    finally:
+        workbook.close()
+
+
+def read_sheet(file: BinaryIO, filename: str) -> Iterator[Tuple[int, Dict]]:
+    """(line number, {column: value}) of every non empty row, column names
+    are lower cased with spaces replaced by underscores."""
+    extension = filename.rsplit(".", 1)[-1].lower() if filename else ""
+    if extension == "csv":
+        return read_csv(file)
+    if extension == "xlsx":
+        return read_xlsx(file)
+    raise UnsupportedSheet("Only .csv and .xlsx files can be imported.")
+
+
+def next_rows(rows: Iterator, count: int) -> Tuple[List, Optional[SheetReadError]]:
+    """The next count rows at most, with the error that stopped the sheet
+    after the rows read before it."""
+    batch = []
+    try:
+        batch.extend(islice(rows, count))
+    except SheetReadError as e:
+        return batch, e
+    return batch, None
@@ -0,0 +1,347 @@
+"""
+Storing uploaded restaurant media. Uploads are streamed to the storage
+backend (app.storage) in upload_chunk_size chunks on the "uploads" thread
+pool, never on the event loop and never whole in memory. The size limit is
+enforced while streaming and the type is sniffed from the first bytes, the
+client supplied name and content type are ignored. At most upload_workers
+uploads are stored at once and upload_max_queue wait, the others get a 503.
+
+Objects are stored under the sha256 of their content, identical uploads
+share one object (reference counts: app.db.media). The content is spooled
+and hashed first, then a reference to its key is taken, and only then is
+it written, unless the object exists: acquire_media waits for the garbage
+collector to finish deleting the object, and the reference keeps it from
+being deleted after, so identical uploads write it once.
+"""
+import base64
+import binascii
+import hashlib
+import tempfile
+from typing import BinaryIO, NamedTuple, Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, UploadFile
+from starlette import status
+
+from app.config import settings
+from app.core.executor import BoundedExecutor, ExecutorSaturated
+from app.db.media import acquire_media, release_media
+from app.storage import get_storage
+
+LOGO_PREFIX = "logo"
+PHOTO_PREFIX = "restaurants-photos"
+
+# Leading bytes -> extension of the accepted image types.
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+SNIFF_LENGTH = 12
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp",
+}
+EXTENSIONS = {v: k for k, v in CONTENT_TYPES.items()}
+
+upload_writer = BoundedExecutor("uploads",
+                                max_workers=settings.upload_workers,
+                                max_queue=settings.upload_max_queue)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnsupportedMediaType(Exception):
+    pass
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    """File extension of an image from its first SNIFF_LENGTH bytes."""
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def new_key(prefix: str, extension: str) -> str:
+    return f"{prefix}/{ObjectId()}.{extension}"
+
+
+def content_key(prefix: str, digest: str, extension: str) -> str:
+    return f"{prefix}/{digest}.{extension}"
+
+
+class _Spooled(NamedTuple):
+    """Content read and hashed, to be written under key."""
+    key: str
+    source: BinaryIO
+    content_type: str
+
+    def close(self):
+        close = getattr(self.source, "close", None)
+        if close is not None:
+            close()
+
+
+class _LimitedReader:
+    """
+    Reads the already consumed head, then the rest of source in chunk_size
+    reads. Raises UploadTooLarge once more than max_bytes were read.
+    """
+
+    def __init__(self, head: bytes, source: BinaryIO, max_bytes: int,
+                 chunk_size: int):
+        self._head = head
+        self._source = source
+        self._max_bytes = max_bytes
+        self._chunk_size = chunk_size
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._head:
+            chunk, self._head = self._head, b""
+        else:
+            if size is None or size < 0 or size > self._chunk_size:
+                size = self._chunk_size
+            chunk = self._source.read(size)
+        self.size += len(chunk)
+        if self.size > self._max_bytes:
+            raise UploadTooLarge()
+        return chunk
+
+
+class _BytesReader:
+    """read() over bytes without copying them into a BytesIO."""
+
+    def __init__(self, contents: bytes):
+        self._view = memoryview(contents)
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self._view) - self._position
+        chunk = self._view[self._position:self._position + size]
+        self._position += len(chunk)
+        return bytes(chunk)
+
+
+def _spool(chunks, prefix: str, extension: str, chunk_size: int) -> _Spooled:
+    """Spool chunks to a temporary file while they are hashed, the key is
+    only known once the whole content was read."""
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=chunk_size)
+    try:
+        for chunk in chunks:
+            digest.update(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return _Spooled(content_key(prefix, digest.hexdigest(), extension), spool,
+                    CONTENT_TYPES[extension])
+
+
+def _read_chunks(reader, chunk_size: int):
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _copy(source: BinaryIO, prefix: str, max_bytes: int,
+          chunk_size: int) -> _Spooled:
+    """Read and hash source, an image to store under prefix."""
+    head = source.read(SNIFF_LENGTH)
+    extension = sniff_extension(head)
+    if extension is None:
+        raise UnsupportedMediaType()
+    reader = _LimitedReader(head, source, max_bytes, chunk_size)
+    return _spool(_read_chunks(reader, chunk_size), prefix, extension, chunk_size)
+
+
+def _copy_data_url(data: str, prefix: str, max_bytes: int,
+                   chunk_size: int) -> _Spooled:
+    """Decode and hash a base64 data URL, or bare base64."""
+    encoded = data.split(",", 1)[-1]
+    if len(encoded) * 3 // 4 > max_bytes + 2:
+        raise UploadTooLarge()
+    try:
+        contents = base64.b64decode(encoded)
+    except (binascii.Error, ValueError):
+        raise UnsupportedMediaType()
+    if len(contents) > max_bytes:
+        raise UploadTooLarge()
+    extension = sniff_extension(contents[:SNIFF_LENGTH])
+    if extension is None:
+        raise UnsupportedMediaType()
+    key = content_key(prefix, hashlib.sha256(contents).hexdigest(), extension)
+    return _Spooled(key, _BytesReader(contents), CONTENT_TYPES[extension])
+
+
+def _limited(chunks, max_bytes: int):
+    """chunks, raises UploadTooLarge once more than max_bytes were read,
+    e.g. when the object was replaced after it was checked."""
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge()
+        yield chunk
+
+
+def _check_upload(key: str, prefix: str, max_bytes: int,
+                  chunk_size: int) -> _Spooled:
+    """
+    Validate and hash an object uploaded directly to storage, to be moved
+    to its content key under prefix. It is streamed in chunk_size chunks,
+    never whole in memory, and deleted either way.
+    """
+    storage = get_storage()
+    stored = storage.head(key)
+    if stored is None:
+        raise UploadNotFound()
+    try:
+        if stored.size > max_bytes:
+            raise UploadTooLarge()
+        extension = sniff_extension(storage.read_head(key, SNIFF_LENGTH))
+        if extension is None or not key.endswith(f".{extension}"):
+            raise UnsupportedMediaType()
+        return _spool(_limited(storage.read_chunks(key, chunk_size), max_bytes),
+                      prefix, extension, chunk_size)
+    finally:
+        storage.delete(key)
+
+
+def _write(spooled: _Spooled):
+    """Write the spooled content, unless its object exists. Called with a
+    reference to the key held."""
+    storage = get_storage()
+    if storage.head(spooled.key) is None:
+        storage.put(spooled.key, spooled.source, spooled.content_type)
+
+
+def _put_checked(key: str, content_type: str, source: BinaryIO,
+                 max_bytes: int, chunk_size: int) -> str:
+    """Stream source to key, it must be an image of content_type."""
+    head = source.read(SNIFF_LENGTH)
+    if CONTENT_TYPES.get(sniff_extension(head)) != content_type:
+        raise UnsupportedMediaType()
+    get_storage().put(key, _LimitedReader(head, source, max_bytes, chunk_size),
+                      content_type)
+    return key
+
+
+async def _store(fn, *args, max_bytes: Optional[int] = None):
+    """Run fn(*args, max_bytes, chunk_size) on the uploads thread pool."""
+    max_bytes = max_bytes or settings.upload_max_bytes
+    return await _run(fn, *args, max_bytes, settings.upload_chunk_size,
+                      max_bytes=max_bytes)
+
+
+async def _run(fn, *args, max_bytes: int):
+    """Run fn(*args) on the uploads thread pool, its errors answered as HTTP
+    errors."""
+    try:
+        return await upload_writer.run(fn, *args)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many uploads in progress, please retry",
+            headers={"Retry-After": "1"},
+        )
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Uploads are limited to {max_bytes} bytes",
+        )
+    except UnsupportedMediaType:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Only JPEG, PNG, GIF and WebP images are accepted",
+        )
+    except UploadNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Upload not found")
+
+
+def media_url(key: str) -> str:
+    return get_storage().url(key)
+
+
+def image_entry(key: str) -> dict:
+    """Entry of RestaurantsModel.image for a stored object. The id is a
+    string, like the ids of the restaurants."""
+    return {
+        "id": str(ObjectId()),
+        "image": media_url(key),
+        "key": key,
+        "is_deleted": False
+    }
+
+
+async def _save(fn, *args) -> str:
+    """Store the content spooled by fn, returns its key. The caller owns a
+    reference to the key (app.db.media), taken before the object is
+    written."""
+    spooled = await _store(fn, *args)
+    try:
+        await acquire_media([spooled.key])
+        try:
+            await _run(_write, spooled, max_bytes=settings.upload_max_bytes)
+        except BaseException:
+            await release_media([spooled.key])
+            raise
+    finally:
+        spooled.close()
+    return spooled.key
+
+
+async def save_upload(file: UploadFile, prefix: str) -> str:
+    """Store an uploaded file, returns its key, see _save."""
+    return await _save(_copy, file.file, prefix)
+
+
+async def save_data_url(data: str, prefix: str) -> str:
+    """Store a base64 encoded image sent in a JSON body, returns its key,
+    see _save."""
+    return await _save(_copy_data_url, data, prefix)
+
+
+async def put_object(key: str, content_type: str, source: BinaryIO,
+                     max_bytes: int):
+    """Store a direct upload to the local storage."""
+    await _store(_put_checked, key, content_type, source, max_bytes=max_bytes)
+
+
+async def confirm_upload(key: str, prefix: str) -> str:
+    """Check an object uploaded with a presigned URL and store it under
+    prefix, returns its key, see _save."""
+    return await _save(_check_upload, key, prefix)
+
+
+async def presigned_upload(prefix: str, content_type: str):
+    """(key, PresignedUpload) of a new object under prefix."""
+    extension = EXTENSIONS.get(content_type)
+    if extension is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Only JPEG, PNG, GIF and WebP images are accepted",
+        )
+    key = new_key(prefix, extension)
+    upload = get_storage().presigned_put(key, content_type,
+                                         settings.upload_max_bytes,
+                                         settings.presigned_upload_ttl_seconds)
+    return key, upload
@@ -0,0 +1,71 @@
+"""
+Compare the restaurant list serialization paths:
+
+    pydantic  RestaurantsModel(**row).list_response() + jsonable_encoder + json
+    fast      restaurant_response() converter + orjson
+
+Run from the backend directory:
+
+    python -m benchmarks.serialization
+"""
+import json
+import random
+import timeit
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app.models.restaurants import LIST_FIELDS, RestaurantsModel, restaurant_response
+from app.utils.responses import dumps
+
+SIZES = (40, 200, 1000)
+
+
+def make_row(i: int) -> dict:
+    return {
+        "_id": str(ObjectId()),
+        "name": f"Restaurant {i}",
+        "location": {"type": "Point", "coordinates": [76.9 + random.random(), 8.5 + random.random()]},
+        "description": "A restaurant " * 20,
+        "type": random.choice(["bakery", "juicery", "restaurant"]),
+        "circle": f"circle {i % 7}",
+        "district_id": str(ObjectId()),
+        "district": f"district {i % 14}",
+        "status": "open",
+        "logo": f"https://cdn.example.com/logo/{i}.png",
+        "image": [{"id": str(ObjectId()), "image": f"https://cdn.example.com/{i}/{j}.png",
+                   "is_deleted": j % 3 == 0} for j in range(6)],
+        "rating": random.randint(0, 5),
+        "created_ts": 1650000000000 + i,
+        "created_by": str(ObjectId()),
+        "created_by_name": "admin",
+        "is_deleted": False,
+    }
+
+
+def pydantic_path(rows):
+    content = jsonable_encoder([RestaurantsModel(**x).list_response() for x in rows])
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(rows):
+    return dumps([restaurant_response(x, LIST_FIELDS) for x in rows])
+
+
+def main():
+    for size in SIZES:
+        rows = [make_row(i) for i in range(size)]
+        assert json.loads(pydantic_path(rows)) == json.loads(fast_path(rows))
+        number = max(10, 4000 // size)
+        results = {}
+        for name, fn in (("pydantic", pydantic_path), ("fast", fast_path)):
+            best = min(timeit.repeat(lambda: fn(rows), number=number, repeat=5))
+            results[name] = best / number * 1000
+        print(f"{size:>5} rows  pydantic {results['pydantic']:8.3f} ms  "
+              f"fast {results['fast']:8.3f} ms  "
+              f"x{results['pydantic'] / results['fast']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
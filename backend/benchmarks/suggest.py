@@ -0,0 +1,75 @@
+"""
+Typeahead latency of the in-memory suggest index over synthetic restaurants:
+prefixes of growing length, multi word queries and typos (the trigram path).
+
+Run from the backend directory:
+
+    python -m benchmarks.suggest [--size 100000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from bson import ObjectId
+
+from app.utils.suggest import SuggestIndex
+
+FIRST = ["Golden", "Spicy", "Royal", "Green", "Little", "Blue", "Happy", "Old", "New", "Grand",
+         "Kerala", "Malabar", "Urban", "Sweet", "Fresh", "Lucky", "Silver", "Red", "Coastal", "Hill"]
+SECOND = ["Spoon", "Kitchen", "Bakery", "Pizza", "Grill", "Cafe", "Biryani", "Dhaba", "Juice", "Tandoor",
+          "Bistro", "Curry", "Dosa", "Bites", "Chai", "Noodles", "Shawarma", "Treats", "Oven", "Table"]
+DISTRICTS = ["Thiruvananthapuram", "Kollam", "Pathanamthitta", "Alappuzha", "Kottayam", "Idukki",
+             "Ernakulam", "Thrissur", "Palakkad", "Malappuram", "Kozhikode", "Wayanad", "Kannur", "Kasaragod"]
+QUERIES = {
+    "1 letter": ["s", "k", "g", "b"],
+    "3 letters": ["spi", "bir", "mal", "koz"],
+    "word": ["biryani", "grill", "kannur", "bakery"],
+    "2 words": ["spicy biry", "golden sp", "pizza kol", "royal cafe th"],
+    "typo": ["biriyani", "shawrma", "tandor", "ernakulm"],
+}
+
+
+def make_restaurant(i: int) -> tuple:
+    name = f"{random.choice(FIRST)} {random.choice(SECOND)} {i}"
+    if random.random() < 0.3:
+        name = f"{random.choice(FIRST)} {name}"
+    district = random.choice(DISTRICTS)
+    return str(ObjectId()), name, district, f"{district} circle {i % 9}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100_000)
+    args = parser.parse_args()
+    random.seed(1)
+
+    restaurants = [make_restaurant(i) for i in range(args.size)]
+    index = SuggestIndex()
+    started = time.perf_counter()
+    for restaurant in restaurants:
+        index.add(*restaurant)
+    print(f"built {len(index)} restaurants in {time.perf_counter() - started:.2f} s")
+
+    for name, queries in QUERIES.items():
+        for query in queries:
+            index.suggest(query)
+        timings = []
+        for _ in range(200):
+            for query in queries:
+                started = time.perf_counter()
+                index.suggest(query)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{name:>10}  p50 {statistics.median(timings):6.3f} ms  "
+              f"p99 {timings[int(len(timings) * 0.99)]:6.3f} ms  "
+              f"e.g. {queries[0]!r} -> {[x.name for x in index.suggest(queries[0], 3)]}")
+
+    started = time.perf_counter()
+    for restaurant_id, name, district, circle in restaurants[:1000]:
+        index.add(restaurant_id, f"Renamed {name}", district, circle)
+    print(f"1000 updates in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+
+import motor.motor_asyncio
+from mongomock_motor import AsyncMongoMockClient
+
+# app.db.base reads it at import, the client does not connect until used.
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+# and creates its client at import, the tests get an in-memory database.
+motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
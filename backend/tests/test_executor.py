@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core.executor import BoundedExecutor, ExecutorSaturated
+
+
+def test_cancelled_callers_keep_their_worker_until_it_is_done():
+    async def run():
+        executor = BoundedExecutor("test", max_workers=1, max_queue=0)
+        release = threading.Event()
+        caller = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+
+        # The thread still runs, the pool is still full.
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(lambda: None)
+        assert executor.stats()["running"] == 1
+
+        release.set()
+        while executor.pending:
+            await asyncio.sleep(0.01)
+        assert await executor.run(lambda: 42) == 42
+        stats = executor.stats()
+        executor.shutdown()
+        return stats
+
+    stats = asyncio.run(run())
+    assert (stats["running"], stats["completed"], stats["failed"], stats["rejected"]) == (0, 2, 0, 1)
+
+
+def test_failures_are_counted():
+    async def run():
+        executor = BoundedExecutor("test", max_workers=1, max_queue=0)
+        with pytest.raises(ZeroDivisionError):
+            await executor.run(lambda: 1 / 0)
+        executor.shutdown()
+        return executor.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["running"], stats["completed"], stats["failed"]) == (0, 0, 1)
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.db.loader import DataLoader
+
+
+class Cursor:
+
+    def __init__(self, documents, started, release):
+        self.documents = documents
+        self.started = started
+        self.release = release
+
+    async def to_list(self, length):
+        self.started.set()
+        await self.release.wait()
+        return self.documents
+
+
+class Collection:
+    """find() of documents answered once release is set."""
+    name = "test"
+
+    def __init__(self, documents=(), error=None):
+        self.documents = list(documents)
+        self.error = error
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.finds = 0
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        if self.error is not None:
+            raise self.error
+        keys = query["_id"]["$in"]
+        return Cursor([x for x in self.documents if x["_id"] in keys], self.started, self.release)
+
+
+def test_concurrent_loads_share_one_query():
+    async def run():
+        collection = Collection([{"_id": "a", "name": "A"}, {"_id": "b", "name": "B"}])
+        loader = DataLoader(collection)
+        collection.release.set()
+        documents = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("c"))
+        return collection.finds, documents
+
+    finds, documents = asyncio.run(run())
+    assert finds == 1
+    assert documents == [{"_id": "a", "name": "A"}, {"_id": "b", "name": "B"}, {"_id": "a", "name": "A"}, None]
+    assert documents[0] is not documents[2]
+
+
+def test_failed_query_fails_every_waiter():
+    async def run():
+        loader = DataLoader(Collection(error=RuntimeError("down")))
+        return await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+
+    assert [type(x) for x in asyncio.run(run())] == [RuntimeError, RuntimeError]
+
+
+def test_cancelled_fetch_cancels_its_waiters():
+    async def run():
+        collection = Collection([{"_id": "a"}])
+        loader = DataLoader(collection)
+        waiters = [asyncio.ensure_future(loader.load("a")) for _ in range(2)]
+        await collection.started.wait()
+        for fetch in list(loader._fetches):
+            fetch.cancel()
+        return await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 1)
+
+    results = asyncio.run(run())
+    assert all(isinstance(x, asyncio.CancelledError) for x in results)
@@ -0,0 +1,43 @@
+import asyncio
+import sys
+
+import pytest
+
+from app.db import indexes, migrations
+from app.db.base import migrations_collection
+
+
+@pytest.fixture
+def ran(monkeypatch):
+    asyncio.run(migrations_collection.delete_many({}))
+    ran = []
+
+    def migration(name):
+        async def migrate():
+            ran.append(name)
+            return {"updated": 1}
+        return migrate
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", {x: migration(x) for x in ("first", "second")})
+    return ran
+
+
+def test_pending_migrations_run_once(ran):
+    assert asyncio.run(migrations.pending()) == ["first", "second"]
+    asyncio.run(migrations.run(["first"]))
+    assert asyncio.run(migrations.pending()) == ["second"]
+    asyncio.run(migrations.run(asyncio.run(migrations.pending())))
+    assert asyncio.run(migrations.pending()) == []
+    assert ran == ["first", "second"]
+
+
+def test_index_apply_fails_when_an_index_is_not_created(monkeypatch):
+    async def ensure_indexes(prune=False):
+        return {"restaurants": {"missing": ["location_2dsphere"], "failed": ["location_2dsphere"]}}
+
+    monkeypatch.setattr(indexes, "ensure_indexes", ensure_indexes)
+    monkeypatch.setattr(sys, "argv", ["indexes", "apply"])
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    with pytest.raises(SystemExit) as raised:
+        indexes.main()
+    assert "location_2dsphere" in str(raised.value.code)
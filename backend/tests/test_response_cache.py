@@ -0,0 +1,104 @@
+import asyncio
+
+import fakeredis.aioredis
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+from app.config import settings
+from app.utils import response_cache as rc
+from app.utils.response_cache import CachedResponse, RedisTier, ResponseCache, restaurant_tag, restaurant_tags
+
+ENTRY = CachedResponse(200, {"content-type": "application/json"}, b"{}")
+
+
+class BrokenRedis:
+    """Client failing every call, like an unreachable Redis."""
+
+    async def get(self, key):
+        raise ConnectionError("down")
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("down")
+
+    async def mget(self, keys):
+        raise ConnectionError("down")
+
+
+def test_local_hit_and_miss():
+    async def run():
+        cache = ResponseCache(maxsize=2, ttl=60)
+        key = await cache.key("/restaurants", [("page", "1"), ("city", "Kollam")], ("restaurants", ))
+        assert await cache.get(key) is None
+        await cache.set(key, ENTRY)
+        assert await cache.get(key) == ENTRY
+        # Sorted query parameters make the same key.
+        assert await cache.key("/restaurants", [("city", "Kollam"), ("page", "1")], ("restaurants", )) == key
+        return cache.stats()
+
+    assert asyncio.run(run()) == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_invalidation_reaches_instances_sharing_redis():
+    async def run():
+        client = fakeredis.aioredis.FakeRedis()
+        writer = ResponseCache(maxsize=8, ttl=60, shared=RedisTier(client=client))
+        reader = ResponseCache(maxsize=8, ttl=60, shared=RedisTier(client=client))
+        tags = (restaurant_tag("r1"), )
+        key = await reader.key("/restaurants/r1", [], tags)
+        await reader.set(key, ENTRY)
+        assert await writer.get(key) == ENTRY
+
+        await writer.invalidate(*restaurant_tags("r1"))
+        new_key = await reader.key("/restaurants/r1", [], tags)
+        assert new_key != key
+        assert await reader.get(new_key) is None
+
+    asyncio.run(run())
+
+
+def test_shared_tier_failures_are_misses():
+    async def run():
+        cache = ResponseCache(maxsize=8, ttl=60, shared=RedisTier(client=BrokenRedis()))
+        # Without the tag versions nothing is cached.
+        assert await cache.key("/restaurants", [], ("restaurants", )) is None
+        await cache.set("key", ENTRY)
+        cache.local.clear()
+        assert await cache.get("key") is None
+        return cache.misses
+
+    assert asyncio.run(run()) == 1
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "response_cache_enabled", True)
+    monkeypatch.setattr(rc, "response_cache", ResponseCache(maxsize=8, ttl=60))
+    calls = []
+    app = FastAPI()
+
+    @app.get("/restaurants/{restaurant_id}")
+    @rc.cached_response(restaurant_tag)
+    async def get_restaurant(restaurant_id: str):
+        calls.append(restaurant_id)
+        return JSONResponse({"id": restaurant_id}, headers={"ETag": 'W/"v1"'})
+
+    test_client = TestClient(app)
+    test_client.calls = calls
+    return test_client
+
+
+def test_not_modified_from_cached_entry(client):
+    response = client.get("/restaurants/r1")
+    assert response.headers["x-cache"] == "miss"
+
+    response = client.get("/restaurants/r1", headers={"If-None-Match": 'W/"v1"'})
+    assert response.status_code == 304
+    assert response.headers["x-cache"] == "hit"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert client.calls == ["r1"]
+
+    asyncio.run(rc.invalidate_responses(*restaurant_tags("r1")))
+    assert client.get("/restaurants/r1").headers["x-cache"] == "miss"
+    assert client.calls == ["r1", "r1"]
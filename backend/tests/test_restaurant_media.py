@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import hashlib
+import io
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.db.base import districts_collection, media_collection, restaurants_collection, users_collection
+from app.db.media import collect_garbage
+from app.db.reference_data import invalidate_reference_data
+from app.main import app
+from app.router.auth import create_access_token
+from app.storage import get_storage
+from app.utils.uploads import LOGO_PREFIX, content_key
+
+LOGO = b"\x89PNG\r\n\x1a\n" + b"a" * 1000
+OTHER_LOGO = b"\x89PNG\r\n\x1a\n" + b"b" * 1000
+
+
+def logo_key(contents):
+    return content_key(LOGO_PREFIX, hashlib.sha256(contents).hexdigest(), "png")
+
+
+def data_url(contents):
+    return "data:image/png;base64," + base64.b64encode(contents).decode()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_media_root", str(tmp_path))
+    get_storage.cache_clear()
+    yield get_storage()
+    get_storage.cache_clear()
+
+
+@pytest.fixture
+def client(storage):
+    for collection in (users_collection, districts_collection, restaurants_collection, media_collection):
+        run(collection.delete_many({}))
+    run(users_collection.insert_one({"_id": str(ObjectId()), "email": "admin@example.com", "name": "Admin",
+                                     "role": "admin", "is_deleted": False}))
+    test_client = TestClient(app)
+    test_client.headers["Authorization"] = "Bearer " + create_access_token({"sub": "admin@example.com"})
+    return test_client
+
+
+@pytest.fixture
+def district():
+    district_id = ObjectId()
+    run(districts_collection.insert_one({"_id": district_id, "name": "Kollam"}))
+    invalidate_reference_data()
+    return str(district_id)
+
+
+def refs():
+    return {x["_id"]: x["refs"] for x in run(media_collection.find({}).to_list(None))}
+
+
+def restaurant(restaurant_id):
+    return run(restaurants_collection.find_one({"_id": restaurant_id}))
+
+
+def put(client, restaurant_id, district, logo, is_new_logo):
+    response = client.put(f"/business/restaurants/{restaurant_id}", json={
+        "name": "Cafe", "district": district, "type": "bakery", "description": "d",
+        "rating": "4", "logo": logo, "is_new_logo": is_new_logo})
+    assert response.status_code == 200
+
+
+def test_logo_references(client, storage, district):
+    first, second = logo_key(LOGO), logo_key(OTHER_LOGO)
+    response = client.post("/business/restaurants/", json={
+        "name": "Cafe", "district": district, "type": "bakery", "description": "d",
+        "logo": data_url(LOGO), "is_new_logo": True})
+    restaurant_id = response.json()["id"]
+    assert restaurant(restaurant_id)["logo_key"] == first
+    assert refs() == {first: 1}
+
+    # The same bytes again, and the stored logo's URL, keep one reference.
+    put(client, restaurant_id, district, data_url(LOGO), True)
+    put(client, restaurant_id, district, restaurant(restaurant_id)["logo"], False)
+    assert restaurant(restaurant_id)["logo_key"] == first
+    assert refs() == {first: 1}
+
+    # A logo uploaded with a pre-signed URL replaces it.
+    key = client.post(f"/business/restaurants/{restaurant_id}/media/upload-url",
+                      json={"kind": "logo", "content_type": "image/png"}).json()["key"]
+    storage.put(key, io.BytesIO(OTHER_LOGO), "image/png")
+    response = client.post(f"/business/restaurants/{restaurant_id}/media/confirm",
+                           json={"kind": "logo", "key": key})
+    assert response.status_code == 200
+    assert restaurant(restaurant_id)["logo_key"] == second
+    assert refs() == {first: 0, second: 1}
+
+    # A logo hosted elsewhere has no key.
+    put(client, restaurant_id, district, "https://example.com/logo.png", False)
+    assert restaurant(restaurant_id)["logo_key"] is None
+    assert refs() == {first: 0, second: 0}
+
+    put(client, restaurant_id, district, data_url(LOGO), True)
+    assert refs() == {first: 1, second: 0}
+    assert client.delete(f"/business/restaurants/{restaurant_id}").status_code == 200
+    assert refs() == {first: 0, second: 0}
+
+    assert sorted(run(collect_garbage(grace_seconds=-1))["deleted"]) == sorted([first, second])
+    assert storage.head(first) is None and storage.head(second) is None
+
+
+def test_patch_refuses_logo_and_takes_ratings_like_put(client, district):
+    response = client.post("/business/restaurants/", json={
+        "name": "Cafe", "district": district, "type": "bakery", "description": "d",
+        "logo": "https://example.com/logo.png", "is_new_logo": False})
+    restaurant_id = response.json()["id"]
+
+    response = client.patch(f"/business/restaurants/{restaurant_id}",
+                            json={"version": 0, "logo": "https://example.com/other.png"})
+    assert response.status_code == 400
+    assert restaurant(restaurant_id)["logo"] == "https://example.com/logo.png"
+
+    put(client, restaurant_id, district, "https://example.com/logo.png", False)
+    assert restaurant(restaurant_id)["rating"] == 4
+    response = client.patch(f"/business/restaurants/{restaurant_id}?fields=name",
+                            json={"version": 1, "rating": 4.5})
+    assert response.status_code == 200
+    assert restaurant(restaurant_id)["rating"] == 4.5
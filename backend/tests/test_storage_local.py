@@ -0,0 +1,102 @@
+import io
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.router import media
+from app.storage import get_storage
+from app.storage.local import InvalidUploadToken, LocalStorage, sign_upload, verify_upload
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 1000
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_media_root", str(tmp_path))
+    monkeypatch.setattr(settings, "media_signing_key", "test-key")
+    get_storage.cache_clear()
+    yield get_storage()
+    get_storage.cache_clear()
+
+
+@pytest.fixture
+def client(storage):
+    app = FastAPI()
+    app.include_router(media.router)
+    return TestClient(app)
+
+
+def test_token_claims(storage):
+    claims = verify_upload(sign_upload("logo/a.png", "image/png", 2048, 60))
+    assert claims["key"] == "logo/a.png"
+    assert claims["content_type"] == "image/png"
+    assert claims["max_bytes"] == 2048
+
+
+def test_expired_token(storage):
+    with pytest.raises(InvalidUploadToken):
+        verify_upload(sign_upload("logo/a.png", "image/png", 2048, -10))
+
+
+def test_token_signed_with_another_key(storage, monkeypatch):
+    token = sign_upload("logo/a.png", "image/png", 2048, 60)
+    monkeypatch.setattr(settings, "media_signing_key", "another-key")
+    with pytest.raises(InvalidUploadToken):
+        verify_upload(token)
+
+
+def test_tampered_token(storage):
+    token = sign_upload("logo/a.png", "image/png", 2048, 60)
+    header, payload, signature = token.split(".")
+    other = sign_upload("logo/b.png", "image/png", 2048, 60).split(".")[1]
+    with pytest.raises(InvalidUploadToken):
+        verify_upload(".".join((header, other, signature)))
+
+
+def test_presigned_put_url(storage):
+    upload = storage.presigned_put("logo/a.png", "image/png", 2048, 60)
+    assert upload.url.startswith(f"{settings.api_url}/media/upload/")
+    assert verify_upload(upload.url.rsplit("/", 1)[1])["key"] == "logo/a.png"
+
+
+def test_upload(client, storage):
+    token = sign_upload("logo/a.png", "image/png", 2048, 60)
+    response = client.put(f"/media/upload/{token}", data=PNG, headers={"Content-Type": "image/png"})
+    assert response.status_code == 200
+    assert storage.get("logo/a.png") == PNG
+
+
+def test_upload_over_size_limit(client, storage):
+    token = sign_upload("logo/a.png", "image/png", len(PNG) - 1, 60)
+    response = client.put(f"/media/upload/{token}", data=PNG, headers={"Content-Type": "image/png"})
+    assert response.status_code == 413
+    assert storage.head("logo/a.png") is None
+
+
+def test_upload_with_expired_token(client, storage):
+    token = sign_upload("logo/a.png", "image/png", 2048, -10)
+    response = client.put(f"/media/upload/{token}", data=PNG, headers={"Content-Type": "image/png"})
+    assert response.status_code == 403
+    assert storage.head("logo/a.png") is None
+
+
+def test_upload_with_another_content_type(client, storage):
+    token = sign_upload("logo/a.png", "image/png", 2048, 60)
+    response = client.put(f"/media/upload/{token}", data=PNG, headers={"Content-Type": "image/gif"})
+    assert response.status_code == 400
+
+
+def test_read_chunks(storage):
+    storage.put("logo/a.png", io.BytesIO(PNG), "image/png")
+    assert list(storage.read_chunks("logo/a.png", 600)) == [PNG[:600], PNG[600:]]
+
+
+def test_keys_stay_under_the_root(tmp_path):
+    storage = LocalStorage(str(tmp_path), "http://cdn", "http://api")
+    with pytest.raises(ValueError):
+        storage.head("../outside.png")
+    assert not os.path.exists(tmp_path.parent / "outside.png")
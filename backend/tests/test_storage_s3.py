@@ -0,0 +1,72 @@
+import io
+
+import boto3
+import pytest
+import requests
+from moto import mock_s3
+
+from app.storage.s3 import S3Storage
+
+BUCKET = "media"
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 1000
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_s3():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, region="us-east-1")
+
+
+def test_put_and_head(storage):
+    storage.put("logo/a.png", io.BytesIO(PNG), "image/png")
+    stored = storage.head("logo/a.png")
+    assert stored.size == len(PNG)
+    assert stored.content_type == "image/png"
+
+
+def test_head_of_missing_object(storage):
+    assert storage.head("logo/missing.png") is None
+
+
+def test_read_head_and_get(storage):
+    storage.put("logo/a.png", io.BytesIO(PNG), "image/png")
+    assert storage.read_head("logo/a.png", 8) == PNG[:8]
+    assert storage.get("logo/a.png") == PNG
+
+
+def test_read_chunks(storage):
+    storage.put("logo/a.png", io.BytesIO(PNG), "image/png")
+    chunks = list(storage.read_chunks("logo/a.png", 256))
+    assert b"".join(chunks) == PNG
+    assert max(len(x) for x in chunks) <= 256
+
+
+def test_delete(storage):
+    storage.put("logo/a.png", io.BytesIO(PNG), "image/png")
+    storage.delete("logo/a.png")
+    assert storage.head("logo/a.png") is None
+    # Deleting again is not an error.
+    storage.delete("logo/a.png")
+
+
+def test_presigned_put(storage):
+    upload = storage.presigned_put("uploads/b.png", "image/png", 1024, 60)
+    assert upload.method == "PUT"
+    assert upload.headers == {"Content-Type": "image/png"}
+    assert upload.expires_in == 60
+    assert "uploads/b.png" in upload.url
+    assert "Signature=" in upload.url or "X-Amz-Signature=" in upload.url
+    response = requests.put(upload.url, data=PNG, headers=upload.headers)
+    assert response.status_code == 200
+    assert storage.get("uploads/b.png") == PNG
+
+
+def test_urls(storage):
+    assert storage.url("logo/a.png") == f"https://{BUCKET}.s3.amazonaws.com/logo/a.png"
+    minio = S3Storage(BUCKET, region="us-east-1", endpoint_url="http://minio:9000/")
+    assert minio.url("logo/a.png") == f"http://minio:9000/{BUCKET}/logo/a.png"
+    cdn = S3Storage(BUCKET, region="us-east-1", public_url="https://cdn.example.com/")
+    assert cdn.url("logo/a.png") == "https://cdn.example.com/logo/a.png"
@@ -0,0 +1,44 @@
+from app.utils.suggest import SuggestIndex
+
+
+def make_index(extra=()):
+    index = SuggestIndex()
+    # Enough restaurants sharing the words for ranking to be cut.
+    for i in range(3000):
+        index.add(f"r{i}", f"Golden Pizza {i}", "Kollam", f"Kollam circle {i % 9}")
+        index.add(f"b{i}", f"Spicy Grill Biryani {i}", "Kannur", None)
+    for restaurant_id, name in extra:
+        index.add(restaurant_id, name, "Kollam", None)
+    return index
+
+
+def names(index, query, limit=3):
+    return [x.name for x in index.suggest(query, limit)]
+
+
+def test_exact_and_prefix_names_rank_first():
+    index = make_index([("p", "Pizza"), ("s", "Spicy Biryani")])
+    assert names(index, "pizza", 1) == ["Pizza"]
+    assert names(index, "piz", 1) == ["Pizza"]
+    assert names(index, "spicy biry", 1) == ["Spicy Biryani"]
+
+
+def test_matches_every_query_word():
+    index = make_index()
+    suggestions = index.suggest("spicy biry kann", 5)
+    assert len(suggestions) == 5
+    assert all(x.name.startswith("Spicy Grill Biryani") for x in suggestions)
+    assert index.suggest("pizza kannur") == []
+
+
+def test_typos():
+    index = make_index()
+    assert names(index, "biriyani", 1)[0].startswith("Spicy Grill Biryani")
+
+
+def test_removed_restaurants_are_not_suggested():
+    index = make_index([("p", "Pizza")])
+    index.remove("p")
+    assert "Pizza" not in names(index, "pizza")
+    index.add("p", "Pizza Palace", "Kollam")
+    assert names(index, "pizza pal") == ["Pizza Palace"]
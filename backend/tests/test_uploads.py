@@ -0,0 +1,66 @@
+import asyncio
+import base64
+import hashlib
+
+import pytest
+
+from app.config import settings
+from app.db.base import media_collection
+from app.db.media import collect_garbage, release_media
+from app.storage import get_storage
+from app.utils.uploads import LOGO_PREFIX, content_key, save_data_url
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"x" * 1000
+KEY = content_key(LOGO_PREFIX, hashlib.sha256(PNG).hexdigest(), "png")
+DATA_URL = "data:image/png;base64," + base64.b64encode(PNG).decode()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_backend", "local")
+    monkeypatch.setattr(settings, "local_media_root", str(tmp_path))
+    get_storage.cache_clear()
+    asyncio.run(media_collection.delete_many({}))
+    yield get_storage()
+    get_storage.cache_clear()
+
+
+def refs(key):
+    media = asyncio.run(media_collection.find_one({"_id": key}))
+    return None if media is None else media["refs"]
+
+
+def test_identical_uploads_write_once(storage, monkeypatch):
+    puts = []
+    put = storage.put
+    monkeypatch.setattr(storage, "put", lambda key, *args: puts.append(key) or put(key, *args))
+    assert asyncio.run(save_data_url(DATA_URL, LOGO_PREFIX)) == KEY
+    assert asyncio.run(save_data_url(DATA_URL, LOGO_PREFIX)) == KEY
+    assert puts == [KEY]
+    assert storage.get(KEY) == PNG
+    assert refs(KEY) == 2
+
+
+def test_unreferenced_objects_are_collected(storage):
+    asyncio.run(save_data_url(DATA_URL, LOGO_PREFIX))
+    asyncio.run(release_media([KEY]))
+    assert refs(KEY) == 0
+    assert asyncio.run(collect_garbage(grace_seconds=-1))["deleted"] == [KEY]
+    assert storage.head(KEY) is None
+    assert refs(KEY) is None
+
+    # Uploaded again after its collection, the object is written again.
+    assert asyncio.run(save_data_url(DATA_URL, LOGO_PREFIX)) == KEY
+    assert storage.get(KEY) == PNG
+    assert refs(KEY) == 1
+
+
+def test_failed_write_releases_the_reference(storage, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage, "put", fail)
+    with pytest.raises(OSError):
+        asyncio.run(save_data_url(DATA_URL, LOGO_PREFIX))
+    assert refs(KEY) == 0
+    assert storage.head(KEY) is None